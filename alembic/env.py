@@ -25,6 +25,11 @@ target_metadata = Base.metadata
 from dotenv import load_dotenv
 load_dotenv()
 
+# Use the same database as the application when DATABASE_URL is set
+import os
+if os.getenv("DATABASE_URL"):
+    config.set_main_option("sqlalchemy.url", os.environ["DATABASE_URL"])
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
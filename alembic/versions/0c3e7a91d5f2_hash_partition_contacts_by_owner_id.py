@@ -0,0 +1,217 @@
+"""Hash-partition contacts by owner_id
+
+Revision ID: 0c3e7a91d5f2
+Revises: e5b8f1d0a3c6
+Create Date: 2026-10-17 16:41:09.502317
+
+Online on PostgreSQL with CONTACT_PARTITIONS set; a no-op elsewhere and with
+CONTACT_PARTITIONS=0, the default.
+
+1. contacts_partitioned is created next to contacts, PARTITION BY HASH
+   (owner_id) into CONTACT_PARTITIONS partitions with all indexes, and a
+   trigger mirrors every write to contacts into it.
+2. Existing rows are copied in id ranges of CONTACTS_BACKFILL_BATCH, one
+   transaction each, skipping rows the trigger already copied.
+3. One short transaction locks contacts (giving up after
+   CONTACTS_SWAP_LOCK_TIMEOUT), drops it and renames contacts_partitioned
+   to contacts.
+
+Steps 1 and 2 are committed before the swap. If the swap gives up, they
+stay in place and the trigger keeps contacts_partitioned in sync; running
+the upgrade again reuses them and only copies the rows still missing.
+
+Contacts without an owner_id cannot be placed in a partition and are not
+copied; no user can read them. Emails become unique per owner.
+"""
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.models import CONTACT_PARTITIONS, contact_partition_ddl
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0c3e7a91d5f2'
+down_revision: Union[str, None] = 'e5b8f1d0a3c6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH = int(os.getenv('CONTACTS_BACKFILL_BATCH', '10000'))
+SWAP_LOCK_TIMEOUT = os.getenv('CONTACTS_SWAP_LOCK_TIMEOUT', '5s')
+
+COLUMNS = ('id', 'first_name', 'last_name', 'email', 'phone', 'birthday', 'additional_info', 'owner_id',
+           'birthday_md', 'version', 'updated_at')
+COLUMN_LIST = ', '.join(COLUMNS)
+# Indexes of contacts other than the primary key and unique constraints: (name, definition)
+INDEXES = (
+    ('ix_contacts_id', '(id)'),
+    ('ix_contacts_first_name', '(first_name)'),
+    ('ix_contacts_last_name', '(last_name)'),
+    ('ix_contacts_email', '(email)'),
+    ('ix_contacts_owner_id_id', '(owner_id, id)'),
+    ('ix_contacts_owner_id_name', '(owner_id, last_name, first_name, id)'),
+    ('ix_contacts_owner_id_birthday_md', '(owner_id, birthday_md)'),
+    ('ix_contacts_owner_id_version', '(owner_id, version)'),
+)
+SEARCH_COLUMNS = ('first_name', 'last_name', 'email')
+
+
+def _is_partitioned(bind) -> bool:
+    return bind.execute(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'contacts'::regclass)"
+    )).scalar()
+
+
+def _table_exists(bind, table: str) -> bool:
+    return bind.execute(sa.text('SELECT to_regclass(:table) IS NOT NULL'), {'table': table}).scalar()
+
+
+def _has_trigram_search(bind) -> bool:
+    return bind.execute(sa.text(
+        "SELECT count(*) = 2 FROM pg_extension WHERE extname IN ('pg_trgm', 'btree_gin')"
+    )).scalar()
+
+
+def _create_indexes(table: str, suffix: str, trigram: bool):
+    for name, definition in INDEXES:
+        op.execute(f'CREATE INDEX {name}{suffix} ON {table} {definition}')
+    if trigram:
+        for column in SEARCH_COLUMNS:
+            op.execute(f'CREATE INDEX ix_contacts_owner_id_{column}_trgm{suffix} '
+                       f'ON {table} USING gin (owner_id, {column} gin_trgm_ops)')
+
+
+def _rename_indexes(suffix: str, trigram: bool):
+    names = [name for name, _ in INDEXES]
+    if trigram:
+        names += [f'ix_contacts_owner_id_{column}_trgm' for column in SEARCH_COLUMNS]
+    for name in names:
+        op.execute(f'ALTER INDEX {name}{suffix} RENAME TO {name}')
+
+
+def _create_partitioned_table(sequence: str, trigram: bool):
+    op.execute(f"""
+        CREATE TABLE contacts_partitioned (
+            id integer NOT NULL DEFAULT nextval('{sequence}'),
+            first_name varchar,
+            last_name varchar,
+            email varchar,
+            phone varchar,
+            birthday date,
+            additional_info varchar,
+            owner_id integer NOT NULL,
+            birthday_md smallint,
+            version integer NOT NULL DEFAULT 0,
+            updated_at timestamp,
+            CONSTRAINT contacts_partitioned_pkey PRIMARY KEY (id, owner_id),
+            CONSTRAINT uq_contacts_owner_id_email UNIQUE (owner_id, email),
+            CONSTRAINT contacts_partitioned_owner_id_fkey FOREIGN KEY (owner_id) REFERENCES users (id)
+        ) PARTITION BY HASH (owner_id)
+    """)
+    for statement in contact_partition_ddl('contacts_partitioned', CONTACT_PARTITIONS):
+        op.execute(statement)
+    # Built on the empty table: indexes are not built CONCURRENTLY on partitioned tables
+    _create_indexes('contacts_partitioned', '_partitioned', trigram)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql' or CONTACT_PARTITIONS <= 0 or _is_partitioned(bind):
+        return
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('contacts', 'id')")).scalar()
+    trigram = _has_trigram_search(bind)
+
+    # 1. The partitioned table, its indexes and the trigger keeping it in sync. An earlier attempt whose
+    # swap gave up left the table in place, in sync; it is reused as it is.
+    if not _table_exists(bind, 'contacts_partitioned'):
+        _create_partitioned_table(sequence, trigram)
+    updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in COLUMNS if column not in ('id', 'owner_id'))
+    values = ', '.join(f'NEW.{column}' for column in COLUMNS)
+    op.execute(f"""
+        CREATE OR REPLACE FUNCTION contacts_mirror_to_partitioned() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                DELETE FROM contacts_partitioned WHERE id = OLD.id AND owner_id = OLD.owner_id;
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                IF NEW.owner_id IS NOT NULL THEN
+                    INSERT INTO contacts_partitioned ({COLUMN_LIST}) VALUES ({values})
+                    ON CONFLICT (id, owner_id) DO UPDATE SET {updates};
+                END IF;
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    """)
+    op.execute('DROP TRIGGER IF EXISTS contacts_mirror_to_partitioned ON contacts')
+    op.execute('CREATE TRIGGER contacts_mirror_to_partitioned AFTER INSERT OR UPDATE OR DELETE ON contacts '
+               'FOR EACH ROW EXECUTE FUNCTION contacts_mirror_to_partitioned()')
+
+    # 2. Backfill: the trigger is committed, so rows written from now on are mirrored. FOR SHARE makes a
+    # batch wait for concurrent deletes and updates of its rows, so it never copies a row the trigger removed.
+    with op.get_context().autocommit_block():
+        low, high = bind.execute(sa.text('SELECT min(id), max(id) FROM contacts')).one()
+        for start in range(low or 0, (high or -1) + 1, BACKFILL_BATCH):
+            bind.execute(sa.text(
+                f'INSERT INTO contacts_partitioned ({COLUMN_LIST}) SELECT {COLUMN_LIST} FROM contacts '
+                f'WHERE id >= :start AND id < :stop AND owner_id IS NOT NULL FOR SHARE '
+                f'ON CONFLICT (id, owner_id) DO NOTHING'
+            ), {'start': start, 'stop': start + BACKFILL_BATCH})
+
+    # 3. Swap, committed with the revision
+    op.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'")
+    op.execute('LOCK TABLE contacts IN ACCESS EXCLUSIVE MODE')
+    op.execute(f'ALTER SEQUENCE {sequence} OWNED BY NONE')
+    op.execute('DROP TABLE contacts')
+    op.execute('DROP FUNCTION contacts_mirror_to_partitioned()')
+    op.execute('ALTER TABLE contacts_partitioned RENAME TO contacts')
+    op.execute('ALTER TABLE contacts RENAME CONSTRAINT contacts_partitioned_pkey TO contacts_pkey')
+    op.execute('ALTER TABLE contacts RENAME CONSTRAINT contacts_partitioned_owner_id_fkey TO contacts_owner_id_fkey')
+    for remainder in range(CONTACT_PARTITIONS):
+        op.execute(f'ALTER TABLE contacts_partitioned_p{remainder} RENAME TO contacts_p{remainder}')
+    _rename_indexes('_partitioned', trigram)
+    op.execute(f'ALTER SEQUENCE {sequence} OWNED BY contacts.id')
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql' or not _is_partitioned(bind):
+        return
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('contacts', 'id')")).scalar()
+    trigram = _has_trigram_search(bind)
+
+    # Offline: writes wait for the copy. Fails if two contacts of different owners share an email.
+    op.execute('LOCK TABLE contacts IN EXCLUSIVE MODE')
+    op.execute(f"""
+        CREATE TABLE contacts_unpartitioned (
+            id integer NOT NULL DEFAULT nextval('{sequence}'),
+            first_name varchar,
+            last_name varchar,
+            email varchar,
+            phone varchar,
+            birthday date,
+            additional_info varchar,
+            owner_id integer,
+            birthday_md smallint,
+            version integer NOT NULL DEFAULT 0,
+            updated_at timestamp,
+            CONSTRAINT contacts_unpartitioned_pkey PRIMARY KEY (id),
+            CONSTRAINT contacts_unpartitioned_owner_id_fkey FOREIGN KEY (owner_id) REFERENCES users (id)
+        )
+    """)
+    op.execute(f'INSERT INTO contacts_unpartitioned ({COLUMN_LIST}) SELECT {COLUMN_LIST} FROM contacts')
+    _create_indexes('contacts_unpartitioned', '_unpartitioned', trigram)
+    op.execute('CREATE UNIQUE INDEX uq_contacts_email_unpartitioned ON contacts_unpartitioned (email)')
+    op.execute(f'ALTER SEQUENCE {sequence} OWNED BY NONE')
+    op.execute('DROP TABLE contacts')
+    op.execute('ALTER TABLE contacts_unpartitioned RENAME TO contacts')
+    op.execute('ALTER TABLE contacts RENAME CONSTRAINT contacts_unpartitioned_pkey TO contacts_pkey')
+    op.execute('ALTER TABLE contacts RENAME CONSTRAINT contacts_unpartitioned_owner_id_fkey '
+               'TO contacts_owner_id_fkey')
+    _rename_indexes('_unpartitioned', trigram)
+    # ix_contacts_email is unique on the unpartitioned table
+    op.execute('DROP INDEX ix_contacts_email')
+    op.execute('ALTER INDEX uq_contacts_email_unpartitioned RENAME TO ix_contacts_email')
+    op.execute(f'ALTER SEQUENCE {sequence} OWNED BY contacts.id')
@@ -0,0 +1,41 @@
+"""Add owner_id and keyset pagination indexes to contacts
+
+Revision ID: 4c1d2e7a9b10
+Revises: fabf735f0555
+Create Date: 2026-10-17 09:12:41.503128
+
+owner_id is only added when missing (create_all may have created it), and a
+downgrade keeps it: an added column cannot be told apart from one that was
+there before, and dropping it would detach every contact from its owner.
+Drop contacts.owner_id by hand if it must go.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c1d2e7a9b10'
+down_revision: Union[str, None] = 'fabf735f0555'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('contacts')}
+    if 'owner_id' not in columns:
+        op.add_column('contacts', sa.Column('owner_id', sa.Integer(), nullable=True))
+        op.create_foreign_key('contacts_owner_id_fkey', 'contacts', 'users', ['owner_id'], ['id'])
+    # Build the indexes without locking out writes on large tables
+    with op.get_context().autocommit_block():
+        op.create_index('ix_contacts_owner_id_id', 'contacts', ['owner_id', 'id'],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_contacts_owner_id_name', 'contacts', ['owner_id', 'last_name', 'first_name', 'id'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_owner_id_name', table_name='contacts')
+    op.drop_index('ix_contacts_owner_id_id', table_name='contacts')
+    # owner_id stays; see the module docstring
@@ -0,0 +1,54 @@
+"""Sort contacts by name with NULL names as empty
+
+Revision ID: 5a7d2c9e4b13
+Revises: 0c3e7a91d5f2
+Create Date: 2026-10-17 18:05:27.114903
+
+ix_contacts_owner_id_name is rebuilt on coalesce(last_name, '') and
+coalesce(first_name, ''), the keys name-sorted contact pages are ordered
+and compared by. The new index is built next to the old one, then swapped
+in. Indexes of a hash-partitioned contacts table are not built
+CONCURRENTLY, so that build blocks writes.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a7d2c9e4b13'
+down_revision: Union[str, None] = '0c3e7a91d5f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COALESCED = "(owner_id, coalesce(last_name, ''), coalesce(first_name, ''), id)"
+PLAIN = '(owner_id, last_name, first_name, id)'
+
+
+def _is_partitioned(bind) -> bool:
+    return bind.execute(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'contacts'::regclass)"
+    )).scalar()
+
+
+def _replace_index(definition: str):
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_contacts_owner_id_name')
+        op.execute(f'CREATE INDEX ix_contacts_owner_id_name ON contacts {definition}')
+        return
+    concurrently = '' if _is_partitioned(bind) else ' CONCURRENTLY'
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX IF EXISTS ix_contacts_owner_id_name_new')
+        op.execute(f'CREATE INDEX{concurrently} ix_contacts_owner_id_name_new ON contacts {definition}')
+    op.execute('DROP INDEX IF EXISTS ix_contacts_owner_id_name')
+    op.execute('ALTER INDEX ix_contacts_owner_id_name_new RENAME TO ix_contacts_owner_id_name')
+
+
+def upgrade() -> None:
+    _replace_index(COALESCED)
+
+
+def downgrade() -> None:
+    _replace_index(PLAIN)
@@ -0,0 +1,41 @@
+"""Add trigram search indexes to contacts
+
+Revision ID: 8e3f05b2c6d4
+Revises: 4c1d2e7a9b10
+Create Date: 2026-10-17 10:03:17.228940
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e3f05b2c6d4'
+down_revision: Union[str, None] = '4c1d2e7a9b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_COLUMNS = ('first_name', 'last_name', 'email')
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # btree_gin lets owner_id share the GIN index, so each search only visits one owner's entries
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gin')
+    with op.get_context().autocommit_block():
+        for column in SEARCH_COLUMNS:
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_contacts_owner_id_{column}_trgm '
+                f'ON contacts USING gin (owner_id, {column} gin_trgm_ops)'
+            )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    with op.get_context().autocommit_block():
+        for column in SEARCH_COLUMNS:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS ix_contacts_owner_id_{column}_trgm')
@@ -0,0 +1,40 @@
+"""Add birthday_md to contacts
+
+Revision ID: b7a41c93e2f8
+Revises: 8e3f05b2c6d4
+Create Date: 2026-10-17 10:41:52.771305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7a41c93e2f8'
+down_revision: Union[str, None] = '8e3f05b2c6d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('contacts', sa.Column('birthday_md', sa.SmallInteger(), nullable=True))
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "UPDATE contacts SET birthday_md = EXTRACT(MONTH FROM birthday) * 100 + EXTRACT(DAY FROM birthday) "
+            "WHERE birthday IS NOT NULL"
+        )
+    else:
+        op.execute(
+            "UPDATE contacts SET birthday_md = CAST(strftime('%m%d', birthday) AS INTEGER) "
+            "WHERE birthday IS NOT NULL"
+        )
+    with op.get_context().autocommit_block():
+        op.create_index('ix_contacts_owner_id_birthday_md', 'contacts', ['owner_id', 'birthday_md'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_owner_id_birthday_md', table_name='contacts')
+    op.drop_column('contacts', 'birthday_md')
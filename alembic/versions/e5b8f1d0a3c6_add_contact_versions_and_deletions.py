@@ -0,0 +1,49 @@
+"""Add contact versions, updated_at and contact_deletions
+
+Revision ID: e5b8f1d0a3c6
+Revises: d2a9c4e61f37
+Create Date: 2026-10-17 13:22:40.118734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b8f1d0a3c6'
+down_revision: Union[str, None] = 'd2a9c4e61f37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('contacts_version', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('contacts', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('contacts', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute("UPDATE contacts SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL")
+    op.create_table(
+        'contact_deletions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('contact_id', sa.Integer(), nullable=False),
+        sa.Column('owner_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['owner_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_contact_deletions_owner_id_version', 'contact_deletions', ['owner_id', 'version'],
+                    unique=False)
+    with op.get_context().autocommit_block():
+        op.create_index('ix_contacts_owner_id_version', 'contacts', ['owner_id', 'version'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_owner_id_version', table_name='contacts')
+    op.drop_index('ix_contact_deletions_owner_id_version', table_name='contact_deletions')
+    op.drop_table('contact_deletions')
+    op.drop_column('contacts', 'updated_at')
+    op.drop_column('contacts', 'version')
+    op.drop_column('users', 'contacts_version')
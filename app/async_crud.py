@@ -0,0 +1,360 @@
+"""
+Async CRUD layer.
+
+This module mirrors ``app.crud`` for ``AsyncSession``: every function here has
+the same name and arguments as its sync twin. Routers do not call either module
+directly but go through ``call``, which picks the right implementation for the
+session the request was given.
+"""
+
+from datetime import date
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from app import hashing, response_cache, token_cache
+from app.crud import (contact_changes_queries, contact_patch_bump, contact_row_dicts, contact_rows_query,
+                      contacts_page_query, contacts_version_bump, delete_contact_query, enqueue_email,
+                      patch_contact_query, upcoming_birthdays_query, update_contact_query)
+from app.models import Contact, ContactDeletion, User
+from app.schemas import ContactCreate, ContactPatch, ContactUpdate, UserCreate
+from app.search import search_contacts_query
+
+
+async def call(func, db, *args, **kwargs):
+    """
+    Run a ``crud`` function against either kind of session.
+
+    With an ``AsyncSession`` the async twin of ``func`` from this module is
+    awaited; functions without a twin run through ``AsyncSession.run_sync``.
+    With a sync ``Session`` the function runs in the threadpool.
+
+    Args:
+        func (Callable): A function from ``app.crud`` taking the session first.
+        db (Session | AsyncSession): The request's database session.
+
+    Returns:
+        The return value of the function.
+    """
+    if isinstance(db, AsyncSession):
+        twin = globals().get(func.__name__)
+        if twin is not None and twin is not func:
+            return await twin(db, *args, **kwargs)
+        return await db.run_sync(func, *args, **kwargs)
+    return await run_in_threadpool(func, db, *args, **kwargs)
+
+async def _contacts(db: AsyncSession, stmt, as_rows: bool):
+    if as_rows:
+        return contact_row_dicts(await db.execute(contact_rows_query(stmt)))
+    return (await db.scalars(stmt)).all()
+
+# Users
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    """
+    Retrieve a user from the database by their email address.
+
+    Args:
+        db (AsyncSession): The async database session.
+        email (str): The email address of the user.
+
+    Returns:
+        User: The user object if found, otherwise None.
+    """
+    result = await db.execute(select(User).filter(User.email == email).limit(1))
+    return result.scalars().first()
+
+async def create_user(db: AsyncSession, user: UserCreate, hashed_password: str = None,
+                      verification_email: tuple = None):
+    """
+    Create a new user in the database.
+
+    Args:
+        db (AsyncSession): The async database session.
+        user (UserCreate): The user creation schema containing user details.
+        hashed_password (str, optional): The password hash. Computed on the hashing
+            executor if omitted.
+        verification_email (Tuple[str, str], optional): The subject and body of an email to the
+            user, enqueued in the outbox in the same transaction as the user.
+
+    Returns:
+        User: The newly created user object.
+    """
+    if hashed_password is None:
+        hashed_password = await hashing.hash_password(user.password)
+    db_user = User(email=user.email, hashed_password=hashed_password)
+    db.add(db_user)
+    if verification_email is not None:
+        await db.flush()
+        subject, body = verification_email
+        await db.run_sync(enqueue_email, user.email, subject, body, dedupe_key=f"verify-email:{db_user.id}",
+                          commit=False)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+async def verify_user_email(db: AsyncSession, email: str):
+    """
+    Verify a user's email address.
+
+    Args:
+        db (AsyncSession): The async database session.
+        email (str): The email address of the user.
+
+    Returns:
+        User: The verified user object.
+    """
+    user = await get_user_by_email(db, email)
+    if user:
+        user.is_verified = True
+        await db.commit()
+        await db.refresh(user)
+        await token_cache.ainvalidate_user(user.email)
+    return user
+
+async def update_user_password(db: AsyncSession, user_id: int, hashed_password: str):
+    """
+    Replace the stored password hash of a user.
+
+    Args:
+        db (AsyncSession): The async database session.
+        user_id (int): The ID of the user.
+        hashed_password (str): The new password hash.
+
+    Returns:
+        User: The updated user object if found, otherwise None.
+    """
+    result = await db.execute(select(User).filter(User.id == user_id))
+    db_user = result.scalars().first()
+    if db_user:
+        db_user.hashed_password = hashed_password
+        await db.commit()
+    return db_user
+
+# Contacts
+
+async def get_contacts_version(db: AsyncSession, user_id: int) -> int:
+    """
+    Retrieve the contacts version of a user.
+
+    Args:
+        db (AsyncSession): The async database session.
+        user_id (int): The ID of the user.
+
+    Returns:
+        int: The number of committed transactions that changed the user's contacts.
+    """
+    return await db.scalar(select(User.contacts_version).where(User.id == user_id)) or 0
+
+async def get_contact_changes(db: AsyncSession, user_id: int, since: int = 0, as_rows: bool = False):
+    """
+    Retrieve the contacts changed and deleted since a contacts version.
+
+    Args:
+        db (AsyncSession): The async database session.
+        user_id (int): The ID of the user who owns the contacts.
+        since (int, optional): The version the client has. Defaults to 0 (everything).
+        as_rows (bool, optional): Return contacts as dictionaries instead of ORM objects. Defaults to False.
+
+    Returns:
+        dict: The current ``version``, the ``updated`` contacts and the ``deleted`` contact IDs.
+    """
+    version = await get_contacts_version(db, user_id)
+    changed, deleted = contact_changes_queries(user_id, since, version)
+    updated = await _contacts(db, changed, as_rows)
+    # An ID can be reused after a delete (SQLite); the contact that exists now wins
+    updated_ids = {contact["id"] if as_rows else contact.id for contact in updated}
+    return {"version": version, "updated": updated,
+            "deleted": [contact_id for contact_id in await db.scalars(deleted) if contact_id not in updated_ids]}
+
+async def get_contact(db: AsyncSession, contact_id: int, user_id: int):
+    """
+    Retrieve a contact by its ID and owner ID.
+
+    Args:
+        db (AsyncSession): The async database session.
+        contact_id (int): The ID of the contact.
+        user_id (int): The ID of the user who owns the contact.
+
+    Returns:
+        Contact: The contact object if found, otherwise None.
+    """
+    result = await db.execute(select(Contact).filter(Contact.id == contact_id, Contact.owner_id == user_id))
+    return result.scalars().first()
+
+async def get_contacts(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 10, after: list = None,
+                       sort: str = "id", as_rows: bool = False):
+    """
+    Retrieve a list of contacts for a user with offset or keyset pagination.
+
+    Args:
+        db (AsyncSession): The async database session.
+        user_id (int): The ID of the user who owns the contacts.
+        skip (int, optional): The number of contacts to skip. Defaults to 0. Ignored with ``after``.
+        limit (int, optional): The maximum number of contacts to return. Defaults to 10.
+        after (list, optional): Sort key values from ``crud.decode_contact_cursor``.
+        sort (str, optional): A key of ``crud.CONTACT_SORT_KEYS``. Defaults to "id".
+        as_rows (bool, optional): Return dictionaries instead of ORM objects. Defaults to False.
+
+    Returns:
+        List[Contact]: A list of contact objects.
+    """
+    return await _contacts(db, contacts_page_query(user_id, skip, limit, after, sort), as_rows)
+
+async def create_contact(db: AsyncSession, contact: ContactCreate, user_id: int):
+    """
+    Create a new contact for a user.
+
+    Args:
+        db (AsyncSession): The async database session.
+        contact (ContactCreate): The contact creation schema containing contact details.
+        user_id (int): The ID of the user who owns the contact.
+
+    Returns:
+        Contact: The newly created contact object.
+    """
+    version = await db.scalar(contacts_version_bump(user_id))
+    db_contact = Contact(**contact.dict(), owner_id=user_id, version=version)
+    db.add(db_contact)
+    await db.commit()
+    await response_cache.abump_owner(user_id)
+    await db.refresh(db_contact)
+    return db_contact
+
+async def _finish_contact_write(db: AsyncSession, db_contact, user_id: int):
+    if db_contact is None:
+        # No such contact: undo the version bump
+        await db.rollback()
+        return None
+    db.expunge(db_contact)
+    await db.commit()
+    await response_cache.abump_owner(user_id)
+    return db_contact
+
+async def update_contact(db: AsyncSession, contact_id: int, contact: ContactUpdate, user_id: int):
+    """
+    Update an existing contact for a user with a single UPDATE ... RETURNING.
+
+    Args:
+        db (AsyncSession): The async database session.
+        contact_id (int): The ID of the contact to update.
+        contact (ContactUpdate): The contact update schema containing updated contact details.
+        user_id (int): The ID of the user who owns the contact.
+
+    Returns:
+        Contact: The updated contact object if found, otherwise None.
+    """
+    dialect_name = db.bind.dialect.name
+    version = None if dialect_name == "postgresql" else await db.scalar(contacts_version_bump(user_id))
+    result = await db.scalars(update_contact_query(dialect_name, contact_id, contact.dict(), user_id, version))
+    return await _finish_contact_write(db, result.first(), user_id)
+
+async def patch_contact(db: AsyncSession, contact_id: int, contact: ContactPatch, user_id: int):
+    """
+    Change only the given fields of a user's contact, writing nothing if they already have those values.
+
+    Args:
+        db (AsyncSession): The async database session.
+        contact_id (int): The ID of the contact to update.
+        contact (ContactPatch): The fields to change.
+        user_id (int): The ID of the user who owns the contact.
+
+    Returns:
+        Contact: The updated or unchanged contact object if found, otherwise None.
+    """
+    values = contact.dict(exclude_unset=True)
+    dialect_name = db.bind.dialect.name
+    db_contact = None
+    if values and dialect_name == "postgresql":
+        db_contact = (await db.scalars(patch_contact_query(dialect_name, contact_id, values, user_id))).first()
+    elif values:
+        version = await db.scalar(contact_patch_bump(contact_id, values, user_id))
+        if version is not None:
+            result = await db.scalars(patch_contact_query(dialect_name, contact_id, values, user_id, version))
+            db_contact = result.first()
+    if db_contact is None:
+        # Nothing to change, or no such contact
+        await db.rollback()
+        return await get_contact(db, contact_id, user_id)
+    return await _finish_contact_write(db, db_contact, user_id)
+
+async def delete_contact(db: AsyncSession, contact_id: int, user_id: int):
+    """
+    Delete a contact by its ID and owner ID with a single DELETE ... RETURNING.
+
+    Args:
+        db (AsyncSession): The async database session.
+        contact_id (int): The ID of the contact to delete.
+        user_id (int): The ID of the user who owns the contact.
+
+    Returns:
+        Contact: The deleted contact object if found, otherwise None.
+    """
+    dialect_name = db.bind.dialect.name
+    if dialect_name == "postgresql":
+        db_contact = (await db.scalars(delete_contact_query(dialect_name, contact_id, user_id))).first()
+    else:
+        version = await db.scalar(contacts_version_bump(user_id))
+        db_contact = (await db.scalars(delete_contact_query(dialect_name, contact_id, user_id))).first()
+        if db_contact is not None:
+            await db.execute(insert(ContactDeletion).values(contact_id=contact_id, owner_id=user_id, version=version))
+    return await _finish_contact_write(db, db_contact, user_id)
+
+async def search_contacts(db: AsyncSession, query: str, user_id: int, skip: int = 0, limit: int = 20,
+                          prefix: bool = False, as_rows: bool = False):
+    """
+    Search for contacts by query string within a user's contacts.
+
+    Args:
+        db (AsyncSession): The async database session.
+        query (str): The search query string.
+        user_id (int): The ID of the user who owns the contacts.
+        skip (int, optional): The number of results to skip. Defaults to 0.
+        limit (int, optional): The maximum number of results. Defaults to 20.
+        prefix (bool, optional): Only match fields starting with the query. Defaults to False.
+        as_rows (bool, optional): Return dictionaries instead of ORM objects. Defaults to False.
+
+    Returns:
+        List[Contact]: A list of contact objects matching the search query, best matches first.
+    """
+    stmt = search_contacts_query(db.bind.dialect.name, query, user_id, skip, limit, prefix)
+    return await _contacts(db, stmt, as_rows)
+
+async def get_upcoming_birthdays(db: AsyncSession, user_id: int, days: int = 7, today: date = None,
+                                 as_rows: bool = False):
+    """
+    Retrieve contacts with birthdays within the upcoming days for a user.
+
+    Args:
+        db (AsyncSession): The async database session.
+        user_id (int): The ID of the user.
+        days (int, optional): The size of the window in days. Defaults to 7.
+        today (date, optional): The first day of the window. Defaults to today.
+        as_rows (bool, optional): Return dictionaries instead of ORM objects. Defaults to False.
+
+    Returns:
+        List[Contact]: A list of contact objects with birthdays in the window, soonest first.
+    """
+    return await _contacts(db, upcoming_birthdays_query(user_id, days, today), as_rows)
+
+async def update_user_avatar(db: AsyncSession, user_id: int, avatar_url: str):
+    """
+    Update the avatar URL for a user.
+
+    Args:
+        db (AsyncSession): The async database session.
+        user_id (int): The ID of the user.
+        avatar_url (str): The new avatar URL.
+
+    Returns:
+        User: The updated user object if found, otherwise None.
+    """
+    result = await db.execute(select(User).filter(User.id == user_id))
+    db_user = result.scalars().first()
+    if db_user:
+        db_user.avatar_url = avatar_url
+        await db.commit()
+        await db.refresh(db_user)
+        await token_cache.ainvalidate_user(db_user.email)
+        return db_user
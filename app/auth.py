@@ -10,11 +10,9 @@ from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
 from itsdangerous import URLSafeTimedSerializer
-import smtplib
-from email.mime.text import MIMEText
-from . import schemas, crud, database
+from . import schemas, crud, database, token_cache, hashing, outbox
+from .async_crud import call
 from dotenv import load_dotenv
 import os
 
@@ -30,7 +28,6 @@ EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 serializer = URLSafeTimedSerializer(EMAIL_SECRET_KEY)
 
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
@@ -86,24 +83,19 @@ def verify_verification_token(token: str) -> str:
 
 def send_email(to_email: str, subject: str, body: str):
     """
-    Send an email.
+    Send an email immediately through the configured SMTP server.
+
+    Request handlers should enqueue emails with ``crud.enqueue_email`` instead,
+    so that they are delivered and retried by ``app.outbox``.
 
     Args:
         to_email (str): The recipient's email address.
         subject (str): The subject of the email.
         body (str): The body content of the email.
     """
-    from_email = EMAIL_SENDER
-    password = EMAIL_PASSWORD
-
-    msg = MIMEText(body)
-    msg['Subject'] = subject
-    msg['From'] = from_email
-    msg['To'] = to_email
-
-    with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-        server.login(from_email, password)
-        server.sendmail(from_email, [to_email], msg.as_string())
+    msg = outbox.build_message(to_email, subject, body)
+    with outbox.smtp_connect() as server:
+        server.sendmail(msg['From'], [to_email], msg.as_string())
 
 def get_user(db: Session, email: str):
     """
@@ -118,53 +110,79 @@ def get_user(db: Session, email: str):
     """
     return crud.get_user_by_email(db, email)
 
-def authenticate_user(db: Session, email: str, password: str):
+async def authenticate_user(db: Session, email: str, password: str):
     """
     Authenticate a user.
 
+    The password is verified on the hashing executor. If the stored hash was
+    made under an outdated hashing policy it is replaced with a fresh one.
+
     Args:
-        db (Session): The database session.
+        db (Session | AsyncSession): The database session.
         email (str): The email address of the user.
         password (str): The password of the user.
 
+    Raises:
+        HTTPException: 503 if the hashing queue is full.
+
     Returns:
         User: The authenticated user object if successful, otherwise False.
     """
-    user = get_user(db, email)
+    user = await call(crud.get_user_by_email, db, email)
     if not user:
         return False
-    if not pwd_context.verify(password, user.hashed_password):
+    valid, new_hash = await hashing.verify_password(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash:
+        await call(crud.update_user_password, db, user.id, new_hash)
+        hashing.rehashed_total.inc()
     return user
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_session)):
     """
     Get the current logged-in user.
 
+    Verified tokens and the users they resolve to are served from the token cache
+    when possible, so repeated requests with the same token skip both the JWT
+    verification and the user lookup.
+
     Args:
         token (str): The JWT token of the user.
-        db (Session): The database session.
+        db (Session | AsyncSession): The database session.
 
     Raises:
         HTTPException: If the token is invalid or the user is not found.
 
     Returns:
-        User: The current logged-in user.
+        CachedUser: A snapshot of the current logged-in user.
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+    claims = None
+    if token_cache.TOKEN_CACHE_ENABLED:
+        claims, cached_user = await token_cache.cache.lookup(token)
+        if cached_user is not None:
+            return cached_user
+    if claims is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            email: str = payload.get("sub")
+            if email is None:
+                raise credentials_exception
+            token_data = schemas.TokenData(email=email)
+        except JWTError:
             raise credentials_exception
-        token_data = schemas.TokenData(email=email)
-    except JWTError:
-        raise credentials_exception
-    user = get_user(db, email=token_data.email)
+        claims = (token_data.email, payload.get("exp"))
+        if token_cache.TOKEN_CACHE_ENABLED and claims[1] is not None:
+            await token_cache.cache.astore_claims(token, *claims)
+    email, exp = claims
+    user = await call(crud.get_user_by_email, db, email=email)
     if user is None:
         raise credentials_exception
-    return user
+    if not token_cache.TOKEN_CACHE_ENABLED or exp is None:
+        return user
+    return await token_cache.cache.astore_user(user, exp)
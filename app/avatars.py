@@ -0,0 +1,348 @@
+"""
+Background avatar uploads.
+
+``POST /api/upload-avatar`` does not talk to the storage backend. It spools
+the uploaded file to disk in ``AVATAR_CHUNK_BYTES`` chunks, rejecting files
+larger than ``AVATAR_MAX_BYTES`` with 413, and hands it to the
+``AvatarUploader``. The request returns 202 with a job ID that
+``GET /api/upload-avatar/{job_id}`` reports on.
+
+On a small thread pool, the uploader hashes the file and, unless an identical
+upload is already stored, has ``render_variants`` decode it on a process pool
+and re-encode it without metadata as square WebP and JPEG variants of every
+size in ``AVATAR_SIZES``. The variants are stored through
+``storage.get_storage()`` under ``avatars/<sha256>/<size>.<webp|jpg>``. Those
+keys are content-addressed, so they are served with immutable cache headers and
+identical uploads are stored once. The largest WebP variant becomes the user's
+``avatar_url``, and the other variants sit next to it.
+
+Jobs and spooled files live in the worker process that accepted the upload,
+so job status is only known to that worker; a job is lost if the worker dies
+before finishing it, and the client uploads again.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile, status
+from starlette.concurrency import run_in_threadpool
+
+from app import crud, database, storage
+from app.metrics import registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+AVATAR_MAX_BYTES = int(os.getenv("AVATAR_MAX_BYTES", str(5 * 1024 * 1024)))
+AVATAR_CHUNK_BYTES = int(os.getenv("AVATAR_CHUNK_BYTES", str(256 * 1024)))
+# Directory of the spooled uploads; the system temporary directory by default
+AVATAR_SPOOL_DIR = os.getenv("AVATAR_SPOOL_DIR") or None
+# Concurrent uploads to the storage backend, per worker process
+AVATAR_UPLOAD_WORKERS = int(os.getenv("AVATAR_UPLOAD_WORKERS", "2"))
+# Uploads waiting for an upload worker before new ones are rejected with 503
+AVATAR_UPLOAD_QUEUE_LIMIT = int(os.getenv("AVATAR_UPLOAD_QUEUE_LIMIT", "32"))
+# Finished jobs remembered for status requests
+AVATAR_JOBS_KEPT = int(os.getenv("AVATAR_JOBS_KEPT", "1000"))
+# Processes decoding and encoding images, per worker process
+AVATAR_PROCESS_WORKERS = int(os.getenv("AVATAR_PROCESS_WORKERS", "2"))
+# Edge lengths of the square variants; the largest WebP one is the avatar_url
+AVATAR_SIZES = sorted(int(size) for size in os.getenv("AVATAR_SIZES", "64,128,256").split(","))
+AVATAR_QUALITY = int(os.getenv("AVATAR_QUALITY", "82"))
+# Larger images are rejected before they are decoded
+AVATAR_MAX_PIXELS = int(os.getenv("AVATAR_MAX_PIXELS", str(40_000_000)))
+
+# Variant formats: (Pillow format, MIME type, extension); the first one is the avatar_url
+FORMATS = (("WEBP", "image/webp", "webp"), ("JPEG", "image/jpeg", "jpg"))
+
+uploads_total = registry.counter("avatar_uploads_total", "Avatar upload jobs finished.", ["status"])
+upload_seconds = registry.histogram("avatar_upload_duration_seconds", "Time spent storing an avatar.")
+upload_bytes = registry.histogram("avatar_upload_bytes", "Size of accepted avatar uploads.",
+                                  buckets=(16384, 65536, 262144, 1048576, 4194304, 16777216))
+pending_uploads = registry.gauge("avatar_uploads_pending", "Avatar uploads queued or running.")
+rejected_total = registry.counter("avatar_uploads_rejected_total",
+                                  "Avatar uploads rejected because the upload queue was full.")
+processing_seconds = registry.histogram("avatar_processing_duration_seconds",
+                                        "Time spent decoding an avatar and encoding its variants.")
+deduplicated_total = registry.counter("avatar_uploads_deduplicated_total",
+                                      "Avatar uploads identical to an already stored one.")
+
+
+class InvalidImage(ValueError):
+    """
+    The upload is not an image that can be turned into avatar variants.
+    """
+
+
+def file_digest(path: str) -> str:
+    """
+    Return the SHA-256 of a file as hex.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(AVATAR_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def render_variants(path: str, directory: str, sizes: Sequence[int] = tuple(AVATAR_SIZES),
+                    quality: int = AVATAR_QUALITY,
+                    max_pixels: int = AVATAR_MAX_PIXELS) -> List[Tuple[str, str, str]]:
+    """
+    Decode an image and write its square avatar variants.
+
+    Runs on the process pool. The image is rotated according to its EXIF
+    orientation, center-cropped to a square and re-encoded, so no metadata
+    (EXIF, GPS, comments) of the upload is kept. Transparency is kept in WebP
+    and flattened onto white in JPEG.
+
+    Args:
+        path (str): The uploaded file.
+        directory (str): Where to write the variants.
+        sizes (Sequence[int], optional): Edge lengths of the variants, ascending.
+        quality (int, optional): The WebP and JPEG quality.
+        max_pixels (int, optional): The largest accepted image.
+
+    Raises:
+        InvalidImage: If the file is not a decodable image or is too large.
+
+    Returns:
+        list: ``(name, path, content type)`` of every variant, e.g. ``("64.webp", ...)``,
+        ending with the largest variant of the first format.
+    """
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(path) as image:
+            if image.width * image.height > max_pixels:
+                raise InvalidImage(f"Image larger than {max_pixels} pixels")
+            # JPEGs are decoded at the smallest scale still larger than the variants
+            image.draft("RGB", (sizes[-1], sizes[-1]))
+            image = ImageOps.exif_transpose(image)
+            has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+            image = image.convert("RGBA" if has_alpha else "RGB")
+    except InvalidImage:
+        raise
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as error:
+        raise InvalidImage("Not a supported image") from error
+
+    largest = ImageOps.fit(image, (sizes[-1], sizes[-1]), Image.Resampling.LANCZOS)
+    variants = []
+    for size in sizes:
+        variant = largest if size == sizes[-1] else largest.resize((size, size), Image.Resampling.LANCZOS)
+        for pillow_format, content_type, extension in FORMATS:
+            output = variant
+            if pillow_format == "JPEG" and variant.mode == "RGBA":
+                output = Image.new("RGB", variant.size, "white")
+                output.paste(variant, mask=variant.getchannel("A"))
+            name = f"{size}.{extension}"
+            target = os.path.join(directory, name)
+            if pillow_format == "JPEG":
+                output.save(target, pillow_format, quality=quality, optimize=True, progressive=True)
+            else:
+                output.save(target, pillow_format, quality=quality, method=4)
+            variants.append((name, target, content_type))
+    # The avatar_url variant last: once it is stored, all variants are
+    variants.sort(key=lambda variant: variant[0] == f"{sizes[-1]}.{FORMATS[0][2]}")
+    return variants
+
+
+async def spool(upload: UploadFile, max_bytes: int = AVATAR_MAX_BYTES) -> str:
+    """
+    Copy an uploaded file to a temporary file in chunks.
+
+    Args:
+        upload (UploadFile): The uploaded file.
+        max_bytes (int, optional): The largest accepted file.
+
+    Raises:
+        HTTPException: 413 if the file is larger than ``max_bytes``, 400 if it is empty.
+
+    Returns:
+        str: The path of the temporary file; the caller owns it.
+    """
+    fd, path = tempfile.mkstemp(prefix="avatar-", dir=AVATAR_SPOOL_DIR)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as file:
+            while True:
+                chunk = await upload.read(AVATAR_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                        detail=f"Avatar larger than {max_bytes} bytes")
+                await run_in_threadpool(file.write, chunk)
+        if not size:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Empty avatar file")
+    except BaseException:
+        os.unlink(path)
+        raise
+    upload_bytes.observe(size)
+    return path
+
+
+class AvatarJob:
+    """
+    An avatar upload accepted by this worker.
+
+    Attributes:
+        id (str): The job ID.
+        user_id (int): The user the avatar belongs to.
+        path (str): The spooled file, removed when the job finishes.
+        status (str): "pending", "running", "done" or "failed".
+        avatar_url (str, optional): The stored avatar, once done.
+        error (str, optional): Why the job failed.
+    """
+
+    __slots__ = ("id", "user_id", "path", "status", "avatar_url", "error")
+
+    def __init__(self, user_id: int, path: str):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.path = path
+        self.status = "pending"
+        self.avatar_url = None
+        self.error = None
+
+
+class AvatarUploader:
+    """
+    Process and store spooled avatars on a bounded thread pool and record their URLs.
+
+    Args:
+        workers (int, optional): Concurrent uploads.
+        process_workers (int, optional): Processes rendering the variants.
+        queue_limit (int, optional): Uploads allowed to wait for a worker.
+        jobs_kept (int, optional): Jobs remembered for status requests.
+    """
+
+    def __init__(self, workers: int = AVATAR_UPLOAD_WORKERS, process_workers: int = AVATAR_PROCESS_WORKERS,
+                 queue_limit: int = AVATAR_UPLOAD_QUEUE_LIMIT, jobs_kept: int = AVATAR_JOBS_KEPT):
+        self.workers = workers
+        self.process_workers = process_workers
+        self.queue_limit = queue_limit
+        self.jobs_kept = jobs_kept
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self._jobs = OrderedDict()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, user_id: int, path: str) -> AvatarJob:
+        """
+        Queue a spooled avatar for upload.
+
+        Args:
+            user_id (int): The user the avatar belongs to.
+            path (str): The spooled file; owned by the uploader from now on.
+
+        Raises:
+            HTTPException: 503 if the upload queue is full.
+
+        Returns:
+            AvatarJob: The queued job.
+        """
+        with self._lock:
+            if self._pending >= self.workers + self.queue_limit:
+                rejected_total.inc()
+                os.unlink(path)
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Too many avatar uploads in progress, try again later",
+                    headers={"Retry-After": "5"},
+                )
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="avatars")
+                self._processes = ProcessPoolExecutor(max_workers=self.process_workers)
+            job = AvatarJob(user_id, path)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.jobs_kept:
+                self._jobs.popitem(last=False)
+            self._pending += 1
+            pending_uploads.set(self._pending)
+            executor, processes = self._executor, self._processes
+        executor.submit(self._run, job, processes)
+        return job
+
+    def get(self, job_id: str, user_id: int) -> Optional[AvatarJob]:
+        """
+        Look a job up.
+
+        Args:
+            job_id (str): The job ID.
+            user_id (int): The user asking; jobs of other users are not returned.
+
+        Returns:
+            AvatarJob: The job, or None if it is unknown to this worker.
+        """
+        job = self._jobs.get(job_id)
+        return job if job is not None and job.user_id == user_id else None
+
+    def _store(self, path: str, processes: ProcessPoolExecutor) -> str:
+        backend = storage.get_storage()
+        prefix = f"avatars/{file_digest(path)}"
+        primary = f"{prefix}/{AVATAR_SIZES[-1]}.{FORMATS[0][2]}"
+        if backend.exists(primary):
+            deduplicated_total.inc()
+            return backend.url(primary)
+        directory = tempfile.mkdtemp(prefix="avatar-variants-", dir=AVATAR_SPOOL_DIR)
+        try:
+            started = time.perf_counter()
+            variants = processes.submit(render_variants, path, directory, tuple(AVATAR_SIZES)).result()
+            processing_seconds.observe(time.perf_counter() - started)
+            for name, variant_path, content_type in variants:
+                avatar_url = backend.save(variant_path, f"{prefix}/{name}", content_type,
+                                          storage.IMMUTABLE_CACHE_CONTROL)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        return avatar_url
+
+    def _run(self, job: AvatarJob, processes: ProcessPoolExecutor):
+        job.status = "running"
+        started = time.perf_counter()
+        try:
+            avatar_url = self._store(job.path, processes)
+            with database.SessionLocal() as db:
+                crud.update_user_avatar(db, job.user_id, avatar_url)
+            job.avatar_url = avatar_url
+            job.status = "done"
+        except InvalidImage as error:
+            job.error = str(error)
+            job.status = "failed"
+        except Exception as error:
+            logger.exception("Avatar upload %s of user %s failed", job.id, job.user_id)
+            job.error = type(error).__name__
+            job.status = "failed"
+        finally:
+            os.unlink(job.path)
+            upload_seconds.observe(time.perf_counter() - started)
+            uploads_total.inc(status=job.status)
+            with self._lock:
+                self._pending -= 1
+                pending_uploads.set(self._pending)
+
+    def shutdown(self):
+        """
+        Stop accepting uploads and wait for the queued ones to finish.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+            processes, self._processes = self._processes, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+            processes.shutdown(wait=True)
+
+
+uploader = AvatarUploader()
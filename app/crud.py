@@ -1,11 +1,15 @@
+import base64
+import calendar
+import json
+from sqlalchemy import (DateTime, bindparam, case, delete, func, insert, literal, literal_column, or_, select,
+                        tuple_, update)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
-from app import models
-from app.models import Contact, User
-from app.schemas import ContactCreate, ContactUpdate, UserCreate
-from datetime import date, timedelta
-from passlib.context import CryptContext
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app import models, token_cache, hashing, response_cache
+from app.models import Contact, ContactDeletion, EmailOutbox, User
+from app.schemas import BulkItemResult, ContactBulkRequest, ContactCreate, ContactPatch, ContactUpdate, UserCreate
+from app.search import search_contacts_query
+from datetime import date, datetime, timedelta
 
 # Users
 
@@ -22,20 +26,29 @@ def get_user_by_email(db: Session, email: str):
     """
     return db.query(User).filter(User.email == email).first()
 
-def create_user(db: Session, user: UserCreate):
+def create_user(db: Session, user: UserCreate, hashed_password: str = None, verification_email: tuple = None):
     """
     Create a new user in the database.
 
     Args:
         db (Session): The database session.
         user (UserCreate): The user creation schema containing user details.
+        hashed_password (str, optional): The password hash, computed beforehand with
+            ``hashing.hash_password``. Hashed in the calling thread if omitted.
+        verification_email (Tuple[str, str], optional): The subject and body of an email to the
+            user, enqueued in the outbox in the same transaction as the user.
 
     Returns:
         User: The newly created user object.
     """
-    hashed_password = pwd_context.hash(user.password)
+    if hashed_password is None:
+        hashed_password = hashing.hash_password_sync(user.password)
     db_user = User(email=user.email, hashed_password=hashed_password)
     db.add(db_user)
+    if verification_email is not None:
+        db.flush()
+        subject, body = verification_email
+        enqueue_email(db, user.email, subject, body, dedupe_key=f"verify-email:{db_user.id}", commit=False)
     db.commit()
     db.refresh(db_user)
     return db_user
@@ -56,10 +69,233 @@ def verify_user_email(db: Session, email: str):
         user.is_verified = True
         db.commit()
         db.refresh(user)
+        token_cache.invalidate_user(user.email)
     return user
 
+def update_user_password(db: Session, user_id: int, hashed_password: str):
+    """
+    Replace the stored password hash of a user.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): The ID of the user.
+        hashed_password (str): The new password hash.
+
+    Returns:
+        User: The updated user object if found, otherwise None.
+    """
+    db_user = db.query(User).filter(User.id == user_id).first()
+    if db_user:
+        db_user.hashed_password = hashed_password
+        db.commit()
+    return db_user
+
 # Contacts
 
+# Sort orders available to keyset pagination, each ending in the unique id tie-breaker
+CONTACT_SORT_KEYS = {
+    "id": ("id",),
+    "name": ("last_name", "first_name", "id"),
+}
+
+# Fields of schemas.Contact in declaration order, selected as plain rows by the fast response path
+CONTACT_ROW_COLUMNS = ("first_name", "last_name", "email", "phone", "birthday", "additional_info", "id", "updated_at")
+
+def contact_rows_query(stmt):
+    """
+    Turn a SELECT of ``Contact`` entities into a SELECT of plain columns.
+
+    Filters, ordering and paging are kept; only the selected columns change, so
+    results come back as tuples without building ORM objects.
+
+    Args:
+        stmt (Select): A query selecting ``Contact``.
+
+    Returns:
+        Select: The same query selecting ``CONTACT_ROW_COLUMNS``.
+    """
+    columns = [getattr(Contact, name) for name in CONTACT_ROW_COLUMNS]
+    return stmt.with_only_columns(*columns, maintain_column_froms=True)
+
+def contact_row_dicts(rows) -> list:
+    """
+    Convert rows of ``contact_rows_query`` into dictionaries keyed like ``schemas.Contact``.
+    """
+    return [dict(zip(CONTACT_ROW_COLUMNS, row)) for row in rows]
+
+def _contacts(db: Session, stmt, as_rows: bool):
+    if as_rows:
+        return contact_row_dicts(db.execute(contact_rows_query(stmt)))
+    return db.scalars(stmt).all()
+
+def contact_sort_columns(sort: str = "id") -> list:
+    """
+    Return the ORDER BY expressions of a sort order, matching the ``ix_contacts_owner_id_*`` indexes.
+
+    NULL names sort as empty strings, so every database orders them alike and
+    a keyset comparison never meets a NULL.
+
+    Args:
+        sort (str, optional): A key of ``CONTACT_SORT_KEYS``. Defaults to "id".
+
+    Returns:
+        list: One expression per sort key.
+    """
+    return [Contact.id if name == "id" else func.coalesce(getattr(Contact, name), literal_column("''"))
+            for name in CONTACT_SORT_KEYS[sort]]
+
+def encode_contact_cursor(contact, sort: str = "id") -> str:
+    """
+    Build the opaque cursor pointing just after a contact.
+
+    Args:
+        contact (Contact | dict): The last contact of the current page, or its row.
+        sort (str, optional): The sort order of the page. Defaults to "id".
+
+    Returns:
+        str: A URL-safe cursor for the next page.
+    """
+    if isinstance(contact, dict):
+        values = [contact[name] for name in CONTACT_SORT_KEYS[sort]]
+    else:
+        values = [getattr(contact, name) for name in CONTACT_SORT_KEYS[sort]]
+    # As ordered by contact_sort_columns
+    values = ["" if value is None else value for value in values]
+    raw = json.dumps([sort] + values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_contact_cursor(cursor: str, sort: str = "id") -> list:
+    """
+    Decode a cursor produced by ``encode_contact_cursor``.
+
+    Args:
+        cursor (str): The opaque cursor.
+        sort (str, optional): The sort order the cursor must belong to. Defaults to "id".
+
+    Raises:
+        ValueError: If the cursor is malformed or was made for another sort order.
+
+    Returns:
+        list: The sort key values of the last contact of the previous page.
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Malformed cursor")
+    if not isinstance(data, list) or not data or data[0] != sort or len(data) != len(CONTACT_SORT_KEYS[sort]) + 1:
+        raise ValueError("Cursor does not match the requested sort order")
+    for name, value in zip(CONTACT_SORT_KEYS[sort], data[1:]):
+        valid = isinstance(value, int) and not isinstance(value, bool) if name == "id" else isinstance(value, str)
+        if not valid:
+            raise ValueError("Malformed cursor")
+    return data[1:]
+
+def contacts_page_query(user_id: int, skip: int = 0, limit: int = 10, after: list = None, sort: str = "id"):
+    """
+    Build the SELECT for one page of a user's contacts.
+
+    With ``after`` the page starts strictly after that sort key (keyset
+    pagination, served by the ``(owner_id, ...)`` composite indexes); otherwise
+    ``skip`` rows are skipped.
+
+    Args:
+        user_id (int): The ID of the user who owns the contacts.
+        skip (int, optional): The number of contacts to skip when ``after`` is not given.
+        limit (int, optional): The maximum number of contacts to return.
+        after (list, optional): Sort key values decoded from a cursor.
+        sort (str, optional): A key of ``CONTACT_SORT_KEYS``. Defaults to "id".
+
+    Returns:
+        Select: The page query.
+    """
+    columns = contact_sort_columns(sort)
+    stmt = select(Contact).filter(Contact.owner_id == user_id).order_by(*columns)
+    if after is not None:
+        stmt = stmt.filter(tuple_(*columns) > tuple_(*after))
+    else:
+        stmt = stmt.offset(skip)
+    return stmt.limit(limit)
+
+def contacts_version_bump(user_id: int):
+    """
+    Build the UPDATE that increments a user's contacts version.
+
+    Run it in the transaction that changes the contacts. It locks the user row
+    until commit, so writes to one user's contacts are serialized and their
+    versions follow commit order.
+
+    Args:
+        user_id (int): The ID of the user who owns the contacts.
+
+    Returns:
+        Update: The UPDATE ... RETURNING the new version.
+    """
+    return (
+        update(User)
+        .where(User.id == user_id)
+        .values(contacts_version=User.contacts_version + 1)
+        .returning(User.contacts_version)
+    )
+
+def contact_changes_queries(user_id: int, since: int, version: int):
+    """
+    Build the queries for the contacts changed and deleted between two versions.
+
+    Args:
+        user_id (int): The ID of the user who owns the contacts.
+        since (int): The version the client has; changes after it are returned.
+        version (int): The current version; later changes are left for the next sync.
+
+    Returns:
+        tuple: The SELECT of changed contacts and the SELECT of deleted contact IDs.
+    """
+    changed = (
+        select(Contact)
+        .filter(Contact.owner_id == user_id, Contact.version > since, Contact.version <= version)
+        .order_by(Contact.version, Contact.id)
+    )
+    deleted = (
+        select(ContactDeletion.contact_id)
+        .filter(ContactDeletion.owner_id == user_id, ContactDeletion.version > since,
+                ContactDeletion.version <= version)
+        .order_by(ContactDeletion.version, ContactDeletion.contact_id)
+    )
+    return changed, deleted
+
+def get_contacts_version(db: Session, user_id: int) -> int:
+    """
+    Retrieve the contacts version of a user.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): The ID of the user.
+
+    Returns:
+        int: The number of committed transactions that changed the user's contacts.
+    """
+    return db.scalar(select(User.contacts_version).where(User.id == user_id)) or 0
+
+def get_contact_changes(db: Session, user_id: int, since: int = 0, as_rows: bool = False):
+    """
+    Retrieve the contacts changed and deleted since a contacts version.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): The ID of the user who owns the contacts.
+        since (int, optional): The version the client has. Defaults to 0 (everything).
+        as_rows (bool, optional): Return contacts as dictionaries instead of ORM objects. Defaults to False.
+
+    Returns:
+        dict: The current ``version``, the ``updated`` contacts and the ``deleted`` contact IDs.
+    """
+    version = get_contacts_version(db, user_id)
+    changed, deleted = contact_changes_queries(user_id, since, version)
+    updated = _contacts(db, changed, as_rows)
+    # An ID can be reused after a delete (SQLite); the contact that exists now wins
+    updated_ids = {contact["id"] if as_rows else contact.id for contact in updated}
+    return {"version": version, "updated": updated,
+            "deleted": [contact_id for contact_id in db.scalars(deleted) if contact_id not in updated_ids]}
+
 def get_contact(db: Session, contact_id: int, user_id: int):
     """
     Retrieve a contact by its ID and owner ID.
@@ -74,20 +310,24 @@ def get_contact(db: Session, contact_id: int, user_id: int):
     """
     return db.query(Contact).filter(Contact.id == contact_id, Contact.owner_id == user_id).first()
 
-def get_contacts(db: Session, user_id: int, skip: int = 0, limit: int = 10):
+def get_contacts(db: Session, user_id: int, skip: int = 0, limit: int = 10, after: list = None, sort: str = "id",
+                 as_rows: bool = False):
     """
-    Retrieve a list of contacts for a user with pagination.
+    Retrieve a list of contacts for a user with offset or keyset pagination.
 
     Args:
         db (Session): The database session.
         user_id (int): The ID of the user who owns the contacts.
-        skip (int, optional): The number of contacts to skip. Defaults to 0.
+        skip (int, optional): The number of contacts to skip. Defaults to 0. Ignored with ``after``.
         limit (int, optional): The maximum number of contacts to return. Defaults to 10.
+        after (list, optional): Sort key values from ``decode_contact_cursor``.
+        sort (str, optional): A key of ``CONTACT_SORT_KEYS``. Defaults to "id".
+        as_rows (bool, optional): Return dictionaries instead of ORM objects. Defaults to False.
 
     Returns:
         List[Contact]: A list of contact objects.
     """
-    return db.query(Contact).filter(Contact.owner_id == user_id).offset(skip).limit(limit).all()
+    return _contacts(db, contacts_page_query(user_id, skip, limit, after, sort), as_rows)
 
 def create_contact(db: Session, contact: ContactCreate, user_id: int):
     """
@@ -101,16 +341,154 @@ def create_contact(db: Session, contact: ContactCreate, user_id: int):
     Returns:
         Contact: The newly created contact object.
     """
-    db_contact = Contact(**contact.dict(), owner_id=user_id)
+    version = db.scalar(contacts_version_bump(user_id))
+    db_contact = Contact(**contact.dict(), owner_id=user_id, version=version)
     db.add(db_contact)
     db.commit()
+    response_cache.bump_owner(user_id)
     db.refresh(db_contact)
     return db_contact
 
+def update_contact_query(dialect_name: str, contact_id: int, values: dict, user_id: int, version: int = None):
+    """
+    Build the UPDATE ... RETURNING of one of a user's contacts.
+
+    On PostgreSQL the contacts version is bumped by a data-modifying CTE of
+    the same statement, so the update takes one round trip. Other databases
+    cannot modify data in a CTE: run ``contacts_version_bump`` first and pass
+    the new version.
+
+    Args:
+        dialect_name (str): The SQLAlchemy dialect name of the session's database.
+        contact_id (int): The ID of the contact to update.
+        values (dict): The contact fields to set.
+        user_id (int): The ID of the user who owns the contact.
+        version (int, optional): The new contacts version; ignored on PostgreSQL.
+
+    Returns:
+        Update: The statement, returning the updated ``Contact``, or no row if the user has no such contact.
+    """
+    if dialect_name == "postgresql":
+        bump = contacts_version_bump(user_id).cte("contacts_version_bump")
+        version = select(bump.c.contacts_version).scalar_subquery()
+    values = dict(values, version=version)
+    if "birthday" in values:
+        values["birthday_md"] = models.birthday_md(values["birthday"])
+    return (
+        update(Contact)
+        .where(Contact.id == contact_id, Contact.owner_id == user_id)
+        .values(**values)
+        .returning(Contact)
+    )
+
+def contact_patch_bump(contact_id: int, values: dict, user_id: int):
+    """
+    Build the contacts version bump of a partial update, applied only if the update changes something.
+
+    Args:
+        contact_id (int): The ID of the contact to update.
+        values (dict): The contact fields to set.
+        user_id (int): The ID of the user who owns the contact.
+
+    Returns:
+        Update: The UPDATE ... RETURNING the new version, or no row if the user has no such
+            contact or it already has all of ``values``.
+    """
+    changed = select(Contact.id).where(*_contact_differs(contact_id, values, user_id)).exists()
+    return contacts_version_bump(user_id).where(changed)
+
+def _contact_differs(contact_id: int, values: dict, user_id: int):
+    return (
+        Contact.id == contact_id,
+        Contact.owner_id == user_id,
+        or_(*(getattr(Contact, key).is_distinct_from(value) for key, value in values.items())),
+    )
+
+def patch_contact_query(dialect_name: str, contact_id: int, values: dict, user_id: int, version: int = None):
+    """
+    Build the UPDATE of only the given fields of a user's contact, if any of them differs.
+
+    Columns that are not in ``values`` are not written, and a contact that
+    already has all of ``values`` is not matched, so it is not written at all.
+    On PostgreSQL the statement includes ``contact_patch_bump`` as a
+    data-modifying CTE; elsewhere run ``contact_patch_bump`` first and pass
+    the version it returns.
+
+    Args:
+        dialect_name (str): The SQLAlchemy dialect name of the session's database.
+        contact_id (int): The ID of the contact to update.
+        values (dict): The contact fields to set, at least one.
+        user_id (int): The ID of the user who owns the contact.
+        version (int, optional): The new contacts version; ignored on PostgreSQL.
+
+    Returns:
+        Update: The statement, returning the updated ``Contact``, or no row if nothing was written.
+    """
+    stmt = update(Contact).where(*_contact_differs(contact_id, values, user_id))
+    if dialect_name == "postgresql":
+        # UPDATE ... FROM the bump: no version, no write
+        version = contact_patch_bump(contact_id, values, user_id).cte("contacts_version_bump").c.contacts_version
+    values = dict(values, version=version)
+    if "birthday" in values:
+        values["birthday_md"] = models.birthday_md(values["birthday"])
+    return stmt.values(**values).returning(Contact)
+
+def delete_contact_query(dialect_name: str, contact_id: int, user_id: int):
+    """
+    Build the DELETE ... RETURNING of one of a user's contacts.
+
+    On PostgreSQL the statement also bumps the contacts version and records
+    the deletion in data-modifying CTEs, so the delete takes one round trip.
+    Elsewhere only the contact is deleted: run ``contacts_version_bump``
+    first and insert the ``ContactDeletion`` if a row is returned.
+
+    Args:
+        dialect_name (str): The SQLAlchemy dialect name of the session's database.
+        contact_id (int): The ID of the contact to delete.
+        user_id (int): The ID of the user who owns the contact.
+
+    Returns:
+        Executable: The statement, returning the deleted ``Contact``, or no row if the user has no such contact.
+    """
+    if dialect_name != "postgresql":
+        return (
+            delete(Contact)
+            .where(Contact.id == contact_id, Contact.owner_id == user_id)
+            .returning(Contact)
+        )
+    table = Contact.__table__
+    bump = contacts_version_bump(user_id).cte("contacts_version_bump")
+    deleted = (
+        delete(table).where(table.c.id == contact_id, table.c.owner_id == user_id).returning(*table.c)
+        .cte("deleted_contact")
+    )
+    deletion = insert(ContactDeletion).from_select(
+        ["contact_id", "owner_id", "version", "deleted_at"],
+        select(deleted.c.id, deleted.c.owner_id, bump.c.contacts_version, literal(datetime.utcnow(), DateTime)),
+    ).cte("contact_deletion")
+    return (
+        select(Contact).from_statement(select(deleted).add_cte(deletion))
+        .execution_options(populate_existing=True)
+    )
+
+def _finish_contact_write(db: Session, db_contact, user_id: int):
+    if db_contact is None:
+        # No such contact: undo the version bump
+        db.rollback()
+        return None
+    # A detached object is not expired by the commit, so returning it issues no further query
+    db.expunge(db_contact)
+    db.commit()
+    response_cache.bump_owner(user_id)
+    return db_contact
+
 def update_contact(db: Session, contact_id: int, contact: ContactUpdate, user_id: int):
     """
     Update an existing contact for a user.
 
+    The contact is updated and returned by a single UPDATE ... RETURNING (see
+    ``update_contact_query``); it is not read before or after.
+
     Args:
         db (Session): The database session.
         contact_id (int): The ID of the contact to update.
@@ -120,18 +498,49 @@ def update_contact(db: Session, contact_id: int, contact: ContactUpdate, user_id
     Returns:
         Contact: The updated contact object if found, otherwise None.
     """
-    db_contact = db.query(Contact).filter(Contact.id == contact_id, Contact.owner_id == user_id).first()
-    if db_contact:
-        for key, value in contact.dict().items():
-            setattr(db_contact, key, value)
-        db.commit()
-        db.refresh(db_contact)
-    return db_contact
+    dialect_name = db.bind.dialect.name
+    version = None if dialect_name == "postgresql" else db.scalar(contacts_version_bump(user_id))
+    db_contact = db.scalars(update_contact_query(dialect_name, contact_id, contact.dict(), user_id, version)).first()
+    return _finish_contact_write(db, db_contact, user_id)
+
+def patch_contact(db: Session, contact_id: int, contact: ContactPatch, user_id: int):
+    """
+    Change only the given fields of a user's contact.
+
+    Only the fields set in ``contact`` are written, and nothing is written
+    (nor the contacts version bumped) if the contact already has their values.
+
+    Args:
+        db (Session): The database session.
+        contact_id (int): The ID of the contact to update.
+        contact (ContactPatch): The fields to change.
+        user_id (int): The ID of the user who owns the contact.
+
+    Returns:
+        Contact: The updated or unchanged contact object if found, otherwise None.
+    """
+    values = contact.dict(exclude_unset=True)
+    dialect_name = db.bind.dialect.name
+    db_contact = None
+    if values and dialect_name == "postgresql":
+        db_contact = db.scalars(patch_contact_query(dialect_name, contact_id, values, user_id)).first()
+    elif values:
+        version = db.scalar(contact_patch_bump(contact_id, values, user_id))
+        if version is not None:
+            db_contact = db.scalars(patch_contact_query(dialect_name, contact_id, values, user_id, version)).first()
+    if db_contact is None:
+        # Nothing to change, or no such contact
+        db.rollback()
+        return get_contact(db, contact_id, user_id)
+    return _finish_contact_write(db, db_contact, user_id)
 
 def delete_contact(db: Session, contact_id: int, user_id: int):
     """
     Delete a contact by its ID and owner ID.
 
+    The contact is deleted and returned by a single DELETE ... RETURNING (see
+    ``delete_contact_query``); it is not read first.
+
     Args:
         db (Session): The database session.
         contact_id (int): The ID of the contact to delete.
@@ -140,42 +549,204 @@ def delete_contact(db: Session, contact_id: int, user_id: int):
     Returns:
         Contact: The deleted contact object if found, otherwise None.
     """
-    db_contact = db.query(Contact).filter(Contact.id == contact_id, Contact.owner_id == user_id).first()
-    if db_contact:
-        db.delete(db_contact)
-        db.commit()
-    return db_contact
+    dialect_name = db.bind.dialect.name
+    if dialect_name == "postgresql":
+        db_contact = db.scalars(delete_contact_query(dialect_name, contact_id, user_id)).first()
+    else:
+        version = db.scalar(contacts_version_bump(user_id))
+        db_contact = db.scalars(delete_contact_query(dialect_name, contact_id, user_id)).first()
+        if db_contact is not None:
+            db.execute(insert(ContactDeletion).values(contact_id=contact_id, owner_id=user_id, version=version))
+    return _finish_contact_write(db, db_contact, user_id)
+
+def insert_ignoring_conflicts(dialect_name: str, table, index_elements=("email",)):
+    """
+    Build an INSERT that skips rows conflicting on a unique key.
+
+    Args:
+        dialect_name (str): The SQLAlchemy dialect name of the session's database.
+        table (Table): The table to insert into.
+        index_elements (Sequence[str], optional): The unique key columns. Defaults to ("email",).
+
+    Returns:
+        Insert: The INSERT ... ON CONFLICT (...) DO NOTHING statement.
+    """
+    dialect_insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    return dialect_insert(table).on_conflict_do_nothing(index_elements=list(index_elements))
 
-def search_contacts(db: Session, query: str, user_id: int):
+def bulk_contacts(db: Session, request: ContactBulkRequest, user_id: int):
+    """
+    Apply a batch of deletes, updates and creates for a user in one transaction.
+
+    Each operation type is a single statement: one DELETE ... RETURNING (and
+    one executemany INSERT of the deletion records), one executemany UPDATE
+    (after one SELECT of the owned IDs and conflicting emails) and one
+    executemany INSERT ... ON CONFLICT DO NOTHING RETURNING. All changes share
+    one new contacts version. An update or create whose email belongs to
+    another contact, or to an earlier item of the same type in the batch, is
+    reported as a conflict instead of failing the batch.
+
+    Args:
+        db (Session): The database session.
+        request (ContactBulkRequest): The operations to apply.
+        user_id (int): The ID of the user who owns the contacts.
+
+    Returns:
+        List[BulkItemResult]: The outcome of every item, deletes first, then updates, then creates.
+    """
+    table = Contact.__table__
+    results = []
+    email_key = models.contact_email_key(db.connection())
+    version = db.scalar(contacts_version_bump(user_id))
+
+    if request.delete:
+        deleted = set(db.scalars(
+            delete(table).where(table.c.owner_id == user_id, table.c.id.in_(request.delete)).returning(table.c.id)
+        ))
+        if deleted:
+            db.execute(insert(ContactDeletion),
+                       [{"contact_id": contact_id, "owner_id": user_id, "version": version} for contact_id in deleted])
+        for index, contact_id in enumerate(request.delete):
+            status = "deleted" if contact_id in deleted else "not_found"
+            results.append(BulkItemResult(op="delete", index=index, status=status, id=contact_id))
+
+    if request.update:
+        ids = {item.id for item in request.update}
+        owned = set(db.scalars(select(table.c.id).where(table.c.owner_id == user_id, table.c.id.in_(ids))))
+        emails = select(table.c.email, table.c.id).where(table.c.email.in_({item.email for item in request.update}))
+        if "owner_id" in email_key:
+            emails = emails.where(table.c.owner_id == user_id)
+        email_owners = dict(db.execute(emails).all())
+        params = []
+        for index, item in enumerate(request.update):
+            if item.id not in owned:
+                status = "not_found"
+            elif email_owners.get(item.email, item.id) != item.id:
+                # Taken by another contact, or by an earlier item of this batch
+                status = "conflict"
+            else:
+                status = "updated"
+                email_owners[item.email] = item.id
+                params.append(dict(item.dict(exclude={"id"}), b_id=item.id, version=version,
+                                   birthday_md=models.birthday_md(item.birthday)))
+            results.append(BulkItemResult(op="update", index=index, status=status, id=item.id))
+        if params:
+            db.execute(
+                update(table).where(table.c.id == bindparam("b_id"), table.c.owner_id == user_id),
+                params,
+            )
+
+    if request.create:
+        # Only the first item with an email is inserted; later ones are conflicts
+        first_items = {}
+        for item in request.create:
+            first_items.setdefault(item.email, item)
+        rows = [dict(item.dict(), owner_id=user_id, version=version, birthday_md=models.birthday_md(item.birthday))
+                for item in first_items.values()]
+        stmt = insert_ignoring_conflicts(db.bind.dialect.name, table, email_key).returning(
+            table.c.id, table.c.email)
+        created = {email: contact_id for contact_id, email in db.execute(stmt, rows)}
+        for index, item in enumerate(request.create):
+            contact_id = created.pop(item.email, None) if first_items[item.email] is item else None
+            status = "created" if contact_id is not None else "conflict"
+            results.append(BulkItemResult(op="create", index=index, status=status, id=contact_id))
+
+    db.commit()
+    response_cache.bump_owner(user_id)
+    return results
+
+def search_contacts(db: Session, query: str, user_id: int, skip: int = 0, limit: int = 20, prefix: bool = False,
+                    as_rows: bool = False):
     """
     Search for contacts by query string within a user's contacts.
+
+    Matching is case-insensitive over first name, last name and email; see
+    ``app.search`` for the ranking and the indexes serving it.
+
+    Args:
+        db (Session): The database session.
         query (str): The search query string.
         user_id (int): The ID of the user who owns the contacts.
+        skip (int, optional): The number of results to skip. Defaults to 0.
+        limit (int, optional): The maximum number of results. Defaults to 20.
+        prefix (bool, optional): Only match fields starting with the query. Defaults to False.
+        as_rows (bool, optional): Return dictionaries instead of ORM objects. Defaults to False.
 
     Returns:
-        List[Contact]: A list of contact objects matching the search query.
+        List[Contact]: A list of contact objects matching the search query, best matches first.
     """
-    return db.query(Contact).filter(
-        Contact.owner_id == user_id,
-        (Contact.first_name.contains(query) |
-        Contact.last_name.contains(query) |
-        Contact.email.contains(query))
-    ).all()
+    stmt = search_contacts_query(db.bind.dialect.name, query, user_id, skip, limit, prefix)
+    return _contacts(db, stmt, as_rows)
 
-def get_upcoming_birthdays(db: Session, user_id: int):
+def birthday_window(today: date, days: int):
     """
-    Retrieve contacts with birthdays within the upcoming week for a user.
+    Compute the month-day ranges covering the next ``days`` days.
+
+    Ranges are inclusive and expressed like ``models.birthday_md``. A window
+    crossing New Year is split in two. In common years, a window ending on
+    28 February also covers 29 February birthdays.
+
+    Args:
+        today (date): The first day of the window.
+        days (int): The number of days after ``today`` included in the window.
+
+    Returns:
+        List[Tuple[int, int]]: One or two ``(start, end)`` month-day ranges.
+    """
+    if days >= 365:
+        return [(101, 1231)]
+    end = today + timedelta(days=days)
+    start_md, end_md = models.birthday_md(today), models.birthday_md(end)
+    if end_md == 228 and not calendar.isleap(end.year):
+        end_md = 229
+    if end.year == today.year:
+        return [(start_md, end_md)]
+    return [(start_md, 1231), (101, end_md)]
+
+def upcoming_birthdays_query(user_id: int, days: int = 7, today: date = None):
+    """
+    Build the query for contacts whose birthday falls in the next ``days`` days.
+
+    Each month-day range is an index range scan on ``(owner_id, birthday_md)``.
+    Results are ordered by how soon the birthday comes.
+
+    Args:
+        user_id (int): The ID of the user.
+        days (int, optional): The size of the window in days. Defaults to 7.
+        today (date, optional): The first day of the window. Defaults to today.
+
+    Returns:
+        Select: The upcoming birthdays query.
+    """
+    today = today or date.today()
+    ranges = birthday_window(today, days)
+    # Soonest first from today, also when the window is the whole year
+    start_md = models.birthday_md(today)
+    return (
+        select(Contact)
+        .filter(Contact.owner_id == user_id,
+                or_(*(Contact.birthday_md.between(start, end) for start, end in ranges)))
+        .order_by(case((Contact.birthday_md >= start_md, 0), else_=1), Contact.birthday_md, Contact.id)
+    )
+
+def get_upcoming_birthdays(db: Session, user_id: int, days: int = 7, today: date = None, as_rows: bool = False):
+    """
+    Retrieve contacts with birthdays within the upcoming days for a user.
+
+    Birthdays match on month and day regardless of birth year, including
+    across the end of the year.
 
     Args:
         db (Session): The database session.
         user_id (int): The ID of the user.
+        days (int, optional): The size of the window in days. Defaults to 7.
+        today (date, optional): The first day of the window. Defaults to today.
+        as_rows (bool, optional): Return dictionaries instead of ORM objects. Defaults to False.
 
     Returns:
-        List[Contact]: A list of contact objects with birthdays in the upcoming week.
+        List[Contact]: A list of contact objects with birthdays in the window, soonest first.
     """
-    today = date.today()
-    next_week = today + timedelta(days=7)
-    return db.query(Contact).filter(Contact.owner_id == user_id, Contact.birthday.between(today, next_week)).all()
+    return _contacts(db, upcoming_birthdays_query(user_id, days, today), as_rows)
 
 def update_user_avatar(db: Session, user_id: int, avatar_url: str):
     """
@@ -194,5 +765,30 @@ def update_user_avatar(db: Session, user_id: int, avatar_url: str):
         db_user.avatar_url = avatar_url
         db.commit()
         db.refresh(db_user)
+        token_cache.invalidate_user(db_user.email)
         return db_user
 
+# Email outbox
+
+def enqueue_email(db: Session, to_email: str, subject: str, body: str, dedupe_key: str, commit: bool = True) -> bool:
+    """
+    Store an email in the outbox for delivery by ``app.outbox``.
+
+    Args:
+        db (Session): The database session.
+        to_email (str): The recipient's email address.
+        subject (str): The subject of the email.
+        body (str): The body of the email.
+        dedupe_key (str): A unique key for the email; an email already enqueued
+            under the same key is not enqueued again.
+        commit (bool, optional): Commit the transaction; False leaves it to the caller.
+
+    Returns:
+        bool: True if the email was enqueued, False if it was a duplicate.
+    """
+    table = EmailOutbox.__table__
+    stmt = insert_ignoring_conflicts(db.bind.dialect.name, table, index_elements=("dedupe_key",))
+    result = db.execute(stmt.values(to_email=to_email, subject=subject, body=body, dedupe_key=dedupe_key))
+    if commit:
+        db.commit()
+    return result.rowcount == 1
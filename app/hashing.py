@@ -0,0 +1,205 @@
+"""
+Password hashing off the event loop.
+
+This module owns the passlib ``CryptContext`` and runs bcrypt hashing and
+verification on a dedicated, bounded executor so that login and registration
+bursts do not starve other requests. When more operations are outstanding than
+the executor can absorb, new ones are rejected with 503 instead of queueing
+without bound.
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+from app.metrics import registry
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+
+load_dotenv()
+
+HASH_EXECUTOR = os.getenv("HASH_EXECUTOR", "thread")
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "32"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+queue_wait_seconds = registry.histogram(
+    "password_hash_queue_wait_seconds", "Time password operations wait for a hashing worker.", ["operation"])
+hash_seconds = registry.histogram(
+    "password_hash_duration_seconds", "Time spent hashing or verifying a password.", ["operation"])
+in_flight = registry.gauge(
+    "password_hash_in_flight", "Password operations queued or running on the hashing executor.")
+rejected_total = registry.counter(
+    "password_hash_rejected_total", "Password operations rejected because the hashing queue was full.")
+rehashed_total = registry.counter(
+    "password_rehashed_total", "Password hashes upgraded on login after the hashing policy changed.")
+
+_context: Optional["CryptContext"] = None
+_executor: Optional[Executor] = None
+_in_flight = 0
+
+
+def get_context() -> "CryptContext":
+    """
+    Return the passlib context, creating it on first use.
+
+    passlib and its bcrypt backend are imported here rather than with the
+    module, which keeps them out of the application import time. Hashes created
+    with a different cost are reported by ``needs_update`` and transparently
+    rehashed on the next successful login.
+
+    Returns:
+        CryptContext: The password hashing policy.
+    """
+    global _context
+    if _context is None:
+        from passlib.context import CryptContext
+
+        _context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=BCRYPT_ROUNDS,
+            bcrypt__min_rounds=BCRYPT_ROUNDS,
+            bcrypt__max_rounds=BCRYPT_ROUNDS,
+        )
+    return _context
+
+
+def _load_backend() -> Tuple[str, float]:
+    started = time.perf_counter()
+    backend = get_context().handler("bcrypt").get_backend()
+    return backend, time.perf_counter() - started
+
+
+def _hash(password: str) -> Tuple[str, float]:
+    started = time.perf_counter()
+    hashed = get_context().hash(password)
+    return hashed, time.perf_counter() - started
+
+
+def _verify_and_update(password: str, hashed_password: str) -> Tuple[Tuple[bool, Optional[str]], float]:
+    started = time.perf_counter()
+    result = get_context().verify_and_update(password, hashed_password)
+    return result, time.perf_counter() - started
+
+
+def get_executor() -> Executor:
+    """
+    Return the hashing executor, creating it on first use.
+
+    ``HASH_EXECUTOR=process`` selects a process pool, anything else a thread
+    pool (bcrypt releases the GIL, so threads scale across cores too).
+
+    Returns:
+        Executor: The hashing executor.
+    """
+    global _executor
+    if _executor is None:
+        if HASH_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="hashing")
+    return _executor
+
+
+def shutdown():
+    """
+    Shut the hashing executor down, waiting for running operations.
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+async def _submit(operation: str, function, *args):
+    global _in_flight
+    if _in_flight >= HASH_WORKERS + HASH_QUEUE_LIMIT:
+        rejected_total.inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent password operations, try again later",
+            headers={"Retry-After": "1"},
+        )
+    _in_flight += 1
+    in_flight.set(_in_flight)
+    started = time.perf_counter()
+    try:
+        result, elapsed = await asyncio.get_running_loop().run_in_executor(get_executor(), function, *args)
+    finally:
+        _in_flight -= 1
+        in_flight.set(_in_flight)
+    hash_seconds.observe(elapsed, operation=operation)
+    queue_wait_seconds.observe(max(time.perf_counter() - started - elapsed, 0.0), operation=operation)
+    return result
+
+
+async def hash_password(password: str) -> str:
+    """
+    Hash a password on the hashing executor.
+
+    Args:
+        password (str): The plain-text password.
+
+    Raises:
+        HTTPException: 503 if the hashing queue is full.
+
+    Returns:
+        str: The password hash.
+    """
+    return await _submit("hash", _hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password on the hashing executor.
+
+    Args:
+        password (str): The plain-text password.
+        hashed_password (str): The stored hash.
+
+    Raises:
+        HTTPException: 503 if the hashing queue is full.
+
+    Returns:
+        tuple: Whether the password matches, and a replacement hash if the stored
+        one no longer satisfies the hashing policy (otherwise None).
+    """
+    return await _submit("verify", _verify_and_update, password, hashed_password)
+
+
+async def warm() -> str:
+    """
+    Start the hashing executor and load the bcrypt backend on it.
+
+    Called by the readiness check so that the first login does not pay for
+    importing passlib or, with ``HASH_EXECUTOR=process``, for spawning a worker.
+
+    Returns:
+        str: The name of the loaded bcrypt backend.
+    """
+    backend, _ = await asyncio.get_running_loop().run_in_executor(get_executor(), _load_backend)
+    return backend
+
+
+def hash_password_sync(password: str) -> str:
+    """
+    Hash a password in the calling thread.
+
+    Intended for scripts and tests that run outside the event loop.
+
+    Args:
+        password (str): The plain-text password.
+
+    Returns:
+        str: The password hash.
+    """
+    hashed, elapsed = _hash(password)
+    hash_seconds.observe(elapsed, operation="hash")
+    return hashed
@@ -1,47 +1,418 @@
-from app.database import SessionLocal, engine
-from app import models
+"""
+Streaming contact importer.
 
+This module loads contacts from CSV, NDJSON or vCard files. Input is parsed
+lazily and processed in fixed-size chunks: each chunk is validated with
+``schemas.ContactCreate`` and loaded in its own transaction with PostgreSQL
+``COPY`` into a staging table (other databases fall back to an executemany
+INSERT), so memory use does not grow with the file. Rows whose email already
+exists are skipped. Progress is checkpointed after every chunk so an
+interrupted import can be resumed, and rejected rows are reported with their
+validation errors.
 
-def init_db():
+Usage:
+    python -m app.import_data contacts.csv --owner-id 1 --checkpoint contacts.ckpt --errors errors.ndjson
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app import crud, models, response_cache
+from app.database import SessionLocal
+from app.schemas import ContactCreate
+
+DEFAULT_CHUNK_SIZE = 5000
+
+CONTACT_COLUMNS = ("first_name", "last_name", "email", "phone", "birthday", "additional_info")
+LOADED_COLUMNS = CONTACT_COLUMNS + ("owner_id", "birthday_md", "version", "updated_at")
+
+# Parsers
+
+def parse_csv(stream: TextIO) -> Iterator[Tuple[int, dict]]:
+    """
+    Parse a CSV file whose header names ``ContactCreate`` fields.
+
+    Args:
+        stream (TextIO): The input, opened with ``newline=""``.
+
+    Yields:
+        Tuple[int, dict]: The 1-based row number and the raw row.
+    """
+    for number, row in enumerate(csv.DictReader(stream), start=1):
+        yield number, {key: value for key, value in row.items() if key and value != ""}
+
+
+def parse_ndjson(stream: TextIO) -> Iterator[Tuple[int, dict]]:
+    """
+    Parse newline-delimited JSON objects. Blank lines are skipped.
+
+    Args:
+        stream (TextIO): The input.
+
+    Yields:
+        Tuple[int, dict]: The 1-based line number and the raw object. Lines that
+        are not JSON objects yield an empty dict, which fails validation.
+    """
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            data = None
+        yield number, data if isinstance(data, dict) else {}
+
+
+def _vcard_unescape(value: str) -> str:
+    return value.replace("\\n", "\n").replace("\\N", "\n").replace("\\,", ",").replace("\\;", ";").replace("\\\\", "\\")
+
+
+def _vcard_birthday(value: str) -> str:
+    if len(value) == 8 and value.isdigit():
+        return f"{value[:4]}-{value[4:6]}-{value[6:]}"
+    return value
+
+
+def parse_vcard(stream: TextIO) -> Iterator[Tuple[int, dict]]:
     """
-    Initialize the database with initial data.
+    Parse vCard 3.0/4.0 cards, reading N, FN, EMAIL, TEL, BDAY and NOTE.
 
-    This function populates the database with initial contacts.
+    Args:
+        stream (TextIO): The input.
 
-    Usage:
-        Call this function to initialize the database with initial data.
+    Yields:
+        Tuple[int, dict]: The 1-based card number and the raw contact.
     """
+    def unfolded_lines():
+        current = None
+        for line in stream:
+            line = line.rstrip("\r\n")
+            if line[:1] in (" ", "\t") and current is not None:
+                current += line[1:]
+                continue
+            if current is not None:
+                yield current
+            current = line
+        if current is not None:
+            yield current
+
+    number = 0
+    card = None
+    for line in unfolded_lines():
+        name, _, value = line.partition(":")
+        prop = name.split(";", 1)[0].split(".")[-1].upper()
+        if prop == "BEGIN" and value.upper() == "VCARD":
+            card = {}
+        elif prop == "END" and value.upper() == "VCARD" and card is not None:
+            number += 1
+            yield number, card
+            card = None
+        elif card is not None:
+            if prop == "N":
+                parts = [_vcard_unescape(part) for part in value.split(";")]
+                card.setdefault("last_name", parts[0])
+                if len(parts) > 1:
+                    card.setdefault("first_name", parts[1])
+            elif prop == "FN" and "first_name" not in card:
+                first, _, last = _vcard_unescape(value).partition(" ")
+                card["first_name"] = first
+                card.setdefault("last_name", last)
+            elif prop == "EMAIL":
+                card.setdefault("email", value)
+            elif prop == "TEL":
+                card.setdefault("phone", value)
+            elif prop == "BDAY":
+                card["birthday"] = _vcard_birthday(value)
+            elif prop == "NOTE":
+                card["additional_info"] = _vcard_unescape(value)
+
+
+PARSERS: Dict[str, Callable[[TextIO], Iterator[Tuple[int, dict]]]] = {
+    "csv": parse_csv,
+    "ndjson": parse_ndjson,
+    "vcf": parse_vcard,
+}
+
+
+def detect_format(filename: str) -> str:
+    """
+    Guess the input format from a file name.
+
+    Args:
+        filename (str): The file name.
+
+    Raises:
+        ValueError: If the extension is not recognised.
+
+    Returns:
+        str: A key of ``PARSERS``.
+    """
+    extension = os.path.splitext(filename)[1].lower().lstrip(".")
+    extension = {"jsonl": "ndjson", "vcard": "vcf"}.get(extension, extension)
+    if extension not in PARSERS:
+        raise ValueError(f"Unsupported import format '{extension}'; expected one of {', '.join(PARSERS)}")
+    return extension
+
+# Loaders
+
+def _copy_value(value) -> str:
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def copy_rows(db: Session, rows: List[dict]) -> int:
+    """
+    Load rows with ``COPY`` into a staging table, then insert the new ones.
+
+    Requires PostgreSQL through psycopg2.
+
+    Args:
+        db (Session): The database session.
+        rows (List[dict]): Rows keyed by ``LOADED_COLUMNS``.
+
+    Returns:
+        int: The number of rows inserted; rows with an existing email are skipped.
+    """
+    columns = ", ".join(LOADED_COLUMNS)
+    db.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS contacts_import ("
+        "first_name varchar, last_name varchar, email varchar, phone varchar, birthday date, "
+        "additional_info varchar, owner_id integer, birthday_md smallint, version integer, "
+        "updated_at timestamp) ON COMMIT DELETE ROWS"
+    ))
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(row[column]) for column in LOADED_COLUMNS))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor = db.connection().connection.driver_connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY contacts_import ({columns}) FROM STDIN", buffer)
+    finally:
+        cursor.close()
+    result = db.execute(text(
+        f"INSERT INTO contacts ({columns}) SELECT {columns} FROM contacts_import "
+        f"ON CONFLICT ({', '.join(models.contact_email_key(db.connection()))}) DO NOTHING"
+    ))
+    return result.rowcount
+
+
+def insert_rows(db: Session, rows: List[dict]) -> int:
+    """
+    Load rows with an executemany INSERT ... ON CONFLICT DO NOTHING.
+
+    Args:
+        db (Session): The database session.
+        rows (List[dict]): Rows keyed by ``LOADED_COLUMNS``.
+
+    Returns:
+        int: The number of rows inserted; rows with an existing email are skipped.
+    """
+    table = models.Contact.__table__
+    key = models.contact_email_key(db.connection())
+    stmt = crud.insert_ignoring_conflicts(db.bind.dialect.name, table, key).returning(table.c.id)
+    return len(db.execute(stmt, rows).all())
+
+
+def _supports_copy(db: Session) -> bool:
+    dialect = db.bind.dialect
+    return dialect.name == "postgresql" and dialect.driver == "psycopg2"
+
+# Import
+
+class ImportStats:
+    """
+    Running totals of an import.
+
+    Attributes:
+        rows_read (int): Rows parsed from the input, including resumed ones.
+        imported (int): Rows inserted.
+        skipped (int): Valid rows skipped because their email already exists.
+        rejected (int): Rows that failed validation.
+        elapsed (float): Seconds spent in this run.
+    """
+
+    def __init__(self, rows_read: int = 0, imported: int = 0, skipped: int = 0, rejected: int = 0):
+        self.rows_read = rows_read
+        self.imported = imported
+        self.skipped = skipped
+        self.rejected = rejected
+        self.elapsed = 0.0
+
+    def as_dict(self) -> dict:
+        """
+        Return the totals as a JSON-serialisable dict.
+        """
+        return {"rows_read": self.rows_read, "imported": self.imported, "skipped": self.skipped,
+                "rejected": self.rejected, "elapsed": round(self.elapsed, 3)}
+
+
+def load_checkpoint(path: Optional[str]) -> ImportStats:
+    """
+    Read the totals of a previous, interrupted run.
+
+    Args:
+        path (str, optional): The checkpoint file.
+
+    Returns:
+        ImportStats: The saved totals, or zeros if there is no checkpoint.
+    """
+    if not path or not os.path.exists(path):
+        return ImportStats()
+    with open(path) as checkpoint:
+        data = json.load(checkpoint)
+    return ImportStats(data["rows_read"], data["imported"], data["skipped"], data["rejected"])
+
+
+def save_checkpoint(path: str, stats: ImportStats):
+    """
+    Atomically record the totals after a committed chunk.
+
+    Args:
+        path (str): The checkpoint file.
+        stats (ImportStats): The totals to save.
+    """
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as checkpoint:
+        json.dump(stats.as_dict(), checkpoint)
+    os.replace(temporary, path)
+
+
+def _chunks(records: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(records)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _validation_errors(error: ValidationError) -> List[dict]:
+    return [{"loc": list(item["loc"]), "msg": item["msg"]} for item in error.errors()]
+
+
+def import_contacts(db: Session, stream: TextIO, owner_id: int, fmt: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    checkpoint: Optional[str] = None, on_error: Optional[Callable[[dict], None]] = None,
+                    on_progress: Optional[Callable[[ImportStats], None]] = None) -> ImportStats:
+    """
+    Stream contacts from a file into a user's address book.
+
+    Each chunk is committed separately. With a checkpoint file, rows already
+    committed by a previous run are skipped and the file is removed once the
+    import completes.
+
+    Args:
+        db (Session): The database session.
+        stream (TextIO): The input.
+        owner_id (int): The ID of the user who will own the contacts.
+        fmt (str): A key of ``PARSERS``.
+        chunk_size (int, optional): Rows validated and loaded per transaction.
+        checkpoint (str, optional): Path of the checkpoint file.
+        on_error (Callable, optional): Called with ``{"row", "errors", "data"}`` for every rejected row.
+        on_progress (Callable, optional): Called with the running totals after every chunk.
+
+    Returns:
+        ImportStats: The totals of the import.
+    """
+    stats = load_checkpoint(checkpoint)
+    resume_after = stats.rows_read
+    load = copy_rows if _supports_copy(db) else insert_rows
+    started = time.perf_counter()
+
+    for chunk in _chunks(PARSERS[fmt](stream), chunk_size):
+        chunk = [(number, raw) for number, raw in chunk if number > resume_after]
+        if not chunk:
+            continue
+        rows = []
+        for number, raw in chunk:
+            try:
+                contact = ContactCreate(**raw)
+            except ValidationError as error:
+                stats.rejected += 1
+                if on_error is not None:
+                    on_error({"row": number, "errors": _validation_errors(error), "data": raw})
+                continue
+            row = contact.dict()
+            row.update(owner_id=owner_id, birthday_md=models.birthday_md(contact.birthday))
+            rows.append(row)
+        imported = 0
+        if rows:
+            # The whole chunk is one change of the owner's contacts
+            version = db.scalar(crud.contacts_version_bump(owner_id))
+            updated_at = datetime.utcnow()
+            for row in rows:
+                row.update(version=version, updated_at=updated_at)
+            imported = load(db, rows)
+        db.commit()
+        if imported:
+            response_cache.bump_owner(owner_id)
+        stats.rows_read = chunk[-1][0]
+        stats.imported += imported
+        stats.skipped += len(rows) - imported
+        stats.elapsed = time.perf_counter() - started
+        if checkpoint:
+            save_checkpoint(checkpoint, stats)
+        if on_progress is not None:
+            on_progress(stats)
+
+    stats.elapsed = time.perf_counter() - started
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return stats
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    Command-line entry point.
+
+    Args:
+        argv (List[str], optional): Arguments, defaults to ``sys.argv[1:]``.
+    """
+    parser = argparse.ArgumentParser(description="Import contacts from CSV, NDJSON or vCard files.")
+    parser.add_argument("path", help="file to import")
+    parser.add_argument("--owner-id", type=int, required=True, help="ID of the user who will own the contacts")
+    parser.add_argument("--format", choices=sorted(PARSERS), help="input format (default: from the extension)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per transaction")
+    parser.add_argument("--checkpoint", help="checkpoint file used to resume an interrupted import")
+    parser.add_argument("--errors", help="write rejected rows to this NDJSON file")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or detect_format(args.path)
+    error_report = open(args.errors, "a") if args.errors else None
+
+    def on_error(record):
+        if error_report is not None:
+            error_report.write(json.dumps(record, default=str) + "\n")
+
+    def on_progress(stats):
+        rate = (stats.imported + stats.skipped + stats.rejected) / stats.elapsed if stats.elapsed else 0
+        print(f"read {stats.rows_read} rows: {stats.imported} imported, {stats.skipped} skipped, "
+              f"{stats.rejected} rejected ({rate:.0f} rows/s)", file=sys.stderr)
+
     db = SessionLocal()
-    contacts = [
-        {
-            "first_name": "John",
-            "last_name": "Doe",
-            "email": "john.doe@example.com",
-            "phone": "1234567890",
-            "birthday": "1980-01-01",
-            "additional_info": "Friend from work"
-        },
-        {
-            "first_name": "Jane",
-            "last_name": "Smith",
-            "email": "jane.smith@example.com",
-            "phone": "0987654321",
-            "birthday": "1990-02-02",
-            "additional_info": "Met at a conference"
-        },
-    ]
-
-    for contact in contacts:
-        db_contact = models.Contact(**contact)
-        db.add(db_contact)
-
-    db.commit()
-    db.close()
+    try:
+        with open(args.path, newline="", encoding="utf-8") as stream:
+            stats = import_contacts(db, stream, args.owner_id, fmt, args.chunk_size, args.checkpoint,
+                                    on_error, on_progress)
+    finally:
+        db.close()
+        if error_report is not None:
+            error_report.close()
+    print(json.dumps(stats.as_dict()))
 
 
 if __name__ == "__main__":
-    # Create all database tables defined in models.Base
-    models.Base.metadata.create_all(bind=engine)
-
-    # Initialize the database with initial data
-    init_db()
+    main()
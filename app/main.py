@@ -1,14 +1,37 @@
+import time
+
+# Cold start is measured from here: the import of the application, startup and the first successful /ready
+IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+import logging
+import anyio.to_thread
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from app.routers import users, contacts  # Assuming `app` is the top-level directory
 from app.database import engine, SessionLocal
-from app import models
-from fastapi_limiter import FastAPILimiter
+from app import avatars, crud, database, models, hashing, outbox, rate_limit, replicas, response_cache, storage
+from app.async_crud import call
+from app.metrics import registry
+from app.middleware import QueryTimingMiddleware
 import redis
 import os
 
-# Create the database tables based on the models
-models.Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
+
+# Create missing tables on startup; DB_CREATE_ALL=0 leaves the schema to Alembic (``alembic upgrade head``)
+DB_CREATE_ALL = os.getenv("DB_CREATE_ALL", "1") == "1"
+# Pooled connections opened by the first readiness check, per engine
+DB_WARM_CONNECTIONS = int(os.getenv("DB_WARM_CONNECTIONS", "4"))
+# Threads running sync routes and sync database calls in this worker
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+
+startup_seconds = registry.gauge(
+    "app_startup_seconds", "Time from the import of the application to the end of its startup handler.")
+ready_seconds = registry.gauge(
+    "app_ready_seconds", "Time from the import of the application to its first successful readiness check.")
 
 # Initialize FastAPI application
 app = FastAPI()
@@ -18,29 +41,70 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allows all origins, you can configure specific origins
     allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],  # Allows all methods
+    allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["X-Next-Cursor", "ETag"],  # Lets browser clients read the pagination cursor and ETags
 )
 
+# Per-request SQL statement count, DB time, pool wait and handler time: Server-Timing header and /metrics
+app.add_middleware(QueryTimingMiddleware)
+
 # Include routers for users and contacts
 app.include_router(users.router, prefix="/api")
 app.include_router(contacts.router, prefix="/api")
 
+# Files of the local storage backend are served by the application itself
+if storage.STORAGE_BACKEND == "local" and storage.LOCAL_STORAGE_URL.startswith("/"):
+    os.makedirs(storage.LOCAL_STORAGE_DIR, exist_ok=True)
+    app.mount(storage.LOCAL_STORAGE_URL, storage.ImmutableStaticFiles(directory=storage.LOCAL_STORAGE_DIR),
+              name="media")
+
 # Redis configuration from environment variables
 REDIS_HOST = os.getenv("REDIS_HOST")
 REDIS_PORT = os.getenv("REDIS_PORT")
+# Connections the shared client may open; 0 opens one per concurrent command
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "0"))
+
+# Sync Redis client shared by the response cache, the rate limiter and the read replicas' read-your-writes windows;
+# all only use it from the threadpool
+redis_client = None
 
-# Startup event: Initialize FastAPILimiter with Redis client
+# Startup event: Connect Redis and start background work
 @app.on_event("startup")
 async def startup():
     """
     Perform operations on application startup.
 
-    This function initializes FastAPILimiter with a Redis client based on environment variables.
+    This function sizes the threadpool to ``THREADPOOL_SIZE``, creates a Redis
+    client based on environment variables when the response cache or the rate
+    limiter use Redis, shares it with them and the read-your-writes windows of
+    the read replicas, and starts the rate limit sync, the replica health
+    checks and the email outbox dispatcher. Missing tables are created unless
+    ``DB_CREATE_ALL=0``, when the schema is left to Alembic.
     """
-    redis_url = f"redis://{REDIS_HOST}:{REDIS_PORT}/0"
-    redis_client = redis.StrictRedis.from_url(redis_url)
-    await FastAPILimiter.init(redis_client)
+    global redis_client
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    if DB_CREATE_ALL:
+        await run_in_threadpool(models.Base.metadata.create_all, bind=engine)
+    if outbox.OUTBOX_ENABLED:
+        outbox.dispatcher.start()
+    if response_cache.RESPONSE_CACHE_REDIS or rate_limit.RATE_LIMIT_BACKEND == "redis":
+        redis_url = f"redis://{REDIS_HOST}:{REDIS_PORT}/0"
+        if REDIS_MAX_CONNECTIONS:
+            # Commands wait for a free connection instead of failing when all are in use
+            pool = redis.BlockingConnectionPool.from_url(redis_url, max_connections=REDIS_MAX_CONNECTIONS)
+            redis_client = redis.StrictRedis(connection_pool=pool)
+        else:
+            redis_client = redis.StrictRedis.from_url(redis_url)
+    if response_cache.RESPONSE_CACHE_REDIS:
+        response_cache.cache.redis = redis_client
+    if rate_limit.RATE_LIMIT_BACKEND == "redis":
+        rate_limit.limiter.backend = rate_limit.RedisBackend(redis_client)
+    rate_limit.limiter.backend.start()
+    if replicas.replica_set.replicas:
+        replicas.recent_writes.redis = redis_client
+        replicas.replica_set.start()
+    startup_seconds.set(time.perf_counter() - IMPORT_STARTED)
 
 # Shutdown event: Close the Redis connection
 @app.on_event("shutdown")
@@ -48,12 +112,104 @@ async def shutdown():
     """
     Perform operations on application shutdown.
 
-    This function closes the Redis connection used by FastAPILimiter.
+    This function stops the email outbox dispatcher, pushes the last rate limit
+    consumption, waits for queued avatar uploads, stops the password hashing
+    executor and the replica health checks, and closes the Redis connections.
+    """
+    await outbox.dispatcher.stop()
+    await replicas.replica_set.stop()
+    await run_in_threadpool(avatars.uploader.shutdown)
+    await rate_limit.limiter.backend.stop()
+    hashing.shutdown()
+    if redis_client is not None:
+        redis_client.connection_pool.disconnect()
+
+# Metrics endpoint: per-worker counters, gauges and histograms in Prometheus text format
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """
+    Expose the in-process metrics of this worker.
+
+    Returns:
+        PlainTextResponse: The metrics in the Prometheus text exposition format.
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+# Readiness: the first check warms the application up, later ones only check the database
+ready_at = None
+_warm_lock = asyncio.Lock()
+
+
+async def warm_up():
+    """
+    Prepare the worker for traffic.
+
+    Fills the connection pools, checks the read replicas, configures the
+    mappers and compiles the login query by running it once, loads the bcrypt
+    backend on the hashing executor and connects to the Redis server shared by
+    the response cache and the rate limiter. Both fall back to local state without Redis, so a failed Redis
+    ping is logged but does not keep the worker from becoming ready.
+    """
+    await run_in_threadpool(database.warm_pool, engine, DB_WARM_CONNECTIONS)
+    # Replicas that cannot take reads are skipped rather than failing the check
+    await run_in_threadpool(replicas.replica_set.check)
+    if database.async_engine is not None:
+        await database.warm_async_pool(database.async_engine, DB_WARM_CONNECTIONS)
+        async with database.AsyncSessionLocal() as db:
+            await call(crud.get_user_by_email, db, "")
+    else:
+        with SessionLocal() as db:
+            await call(crud.get_user_by_email, db, "")
+    await hashing.warm()
+    if redis_client is not None:
+        try:
+            await run_in_threadpool(redis_client.ping)
+        except redis.RedisError as error:
+            logger.warning("Redis is unavailable, serving with local caches and rate limits: %s", error)
+
+
+async def check_database():
+    """
+    Run ``SELECT 1`` on the engine serving requests.
+    """
+    if database.async_engine is not None:
+        await database.warm_async_pool(database.async_engine, 1)
+    else:
+        await run_in_threadpool(database.warm_pool, engine, 1)
+
+
+# Readiness endpoint: 503 until the worker is warmed up and while the database is unreachable
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    """
+    Report whether this worker can serve traffic.
+
+    The first call warms the worker up (see ``warm_up``) and records the cold
+    start time in ``app_ready_seconds``; concurrent calls wait for it. Later
+    calls only check the database.
+
+    Returns:
+        JSONResponse: ``{"status": "ready"}``, or 503 with the failure.
     """
-    redis_client = await FastAPILimiter.redis()
-    redis_client.connection_pool.disconnect()
+    global ready_at
+    try:
+        if ready_at is None:
+            async with _warm_lock:
+                if ready_at is None:
+                    await warm_up()
+                    ready_at = time.perf_counter()
+                    ready_seconds.set(ready_at - IMPORT_STARTED)
+                    logger.info("Ready %.2fs after import", ready_at - IMPORT_STARTED)
+        else:
+            await check_database()
+    except Exception as error:
+        logger.warning("Readiness check failed: %s", error)
+        return JSONResponse(status_code=503, content={"status": "unavailable", "detail": type(error).__name__})
+    return JSONResponse({"status": "ready"})
 
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Production entry point: python -m app.server
+    from app.server import main
+    main()
@@ -0,0 +1,239 @@
+"""
+In-process metrics.
+
+This module provides minimal counters, gauges and histograms that are
+rendered in the Prometheus text exposition format by the ``/metrics``
+endpoint. Each worker process keeps its own values.
+"""
+
+import threading
+from typing import Callable, Dict, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metric:
+    """
+    Base class for a named metric with an optional set of label names.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The help text.
+        labelnames (Sequence[str], optional): Names of the labels of the metric.
+    """
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """
+        Yield ``(suffix, label string, value)`` tuples for rendering.
+        """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """
+        Render the metric in the Prometheus text format.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing counter.
+    """
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        Increment the counter for the given labels.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """
+        Return the current value for the given labels.
+        """
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield "", _format_labels(self.labelnames, key), value
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down, or be read from a callback at render time.
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        """
+        Set the gauge for the given labels.
+        """
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        Increment the gauge for the given labels.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        """
+        Decrement the gauge for the given labels.
+        """
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels):
+        """
+        Read the gauge for the given labels from ``function`` at render time.
+        """
+        with self._lock:
+            self._functions[self._key(labels)] = function
+
+    def value(self, **labels) -> float:
+        """
+        Return the current value for the given labels.
+        """
+        key = self._key(labels)
+        if key in self._functions:
+            return self._functions[key]()
+        return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+            functions = list(self._functions.items())
+        for key, value in items:
+            yield "", _format_labels(self.labelnames, key), value
+        for key, function in functions:
+            yield "", _format_labels(self.labelnames, key), function()
+
+
+class Histogram(Metric):
+    """
+    A distribution of observed values over fixed buckets.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        """
+        Record an observation for the given labels.
+        """
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def summary(self, **labels) -> Tuple[float, int]:
+        """
+        Return the ``(sum, count)`` of observations for the given labels.
+        """
+        state = self._values.get(self._key(labels))
+        if state is None:
+            return 0.0, 0
+        return state[1], state[2]
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield "_bucket", _format_labels(self.labelnames, key, f'le="{bound}"'), bucket_count
+            yield "_bucket", _format_labels(self.labelnames, key, 'le="+Inf"'), count
+            yield "_sum", _format_labels(self.labelnames, key), total
+            yield "_count", _format_labels(self.labelnames, key), count
+
+
+class Registry:
+    """
+    A collection of metrics rendered together.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """
+        Create a counter, or return the one already registered under ``name``.
+        """
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """
+        Create a gauge, or return the one already registered under ``name``.
+        """
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """
+        Create a histogram, or return the one already registered under ``name``.
+        """
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        Render every registered metric in the Prometheus text format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = Registry()
@@ -0,0 +1,97 @@
+"""
+Per-request timing.
+
+``QueryTimingMiddleware`` collects, for every HTTP request, the number of
+SQL statements, the time spent executing them and waiting for pooled
+connections (through ``database.query_stats``) and the total handler time.
+The values are sent to the client in a ``Server-Timing`` header and recorded
+in per-route histograms on ``/metrics``, so an endpoint issuing more
+statements than it should stands out.
+"""
+
+import os
+import time
+
+from dotenv import load_dotenv
+from starlette.datastructures import MutableHeaders
+
+from app import database
+from app.metrics import registry
+
+load_dotenv()
+
+# Send the Server-Timing header; the metrics are recorded either way
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "1") == "1"
+
+STATEMENT_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 13, 21, 34, 55, 100)
+
+requests_total = registry.counter("http_requests_total", "HTTP requests served.", ["method", "route", "status"])
+request_seconds = registry.histogram("http_request_duration_seconds", "Time spent handling HTTP requests.",
+                                     ["method", "route"])
+request_statements = registry.histogram("http_request_db_statements", "SQL statements executed per HTTP request.",
+                                        ["method", "route"], buckets=STATEMENT_BUCKETS)
+request_db_seconds = registry.histogram("http_request_db_seconds", "Time spent executing SQL per HTTP request.",
+                                        ["method", "route"])
+request_pool_wait_seconds = registry.histogram(
+    "http_request_pool_wait_seconds", "Time spent waiting for pooled connections per HTTP request.",
+    ["method", "route"])
+
+
+def server_timing(stats: database.QueryStats, elapsed: float) -> str:
+    """
+    Render request stats as a ``Server-Timing`` header value.
+
+    Args:
+        stats (database.QueryStats): The database work of the request.
+        elapsed (float): Seconds spent in the handler.
+
+    Returns:
+        str: E.g. ``db;dur=1.52;desc="3 statements", pool;dur=0.01, app;dur=4.87``.
+    """
+    return (f'db;dur={stats.db_seconds * 1000:.2f};desc="{stats.statements} statements", '
+            f'pool;dur={stats.pool_wait_seconds * 1000:.2f}, app;dur={elapsed * 1000:.2f}')
+
+
+class QueryTimingMiddleware:
+    """
+    ASGI middleware measuring the database work and duration of HTTP requests.
+
+    Args:
+        app: The ASGI application to wrap.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = database.QueryStats(f"{scope['method']} {scope['path']}")
+        token = database.query_stats.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING_ENABLED:
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", server_timing(stats, time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - started
+            database.query_stats.reset(token)
+            # The route template, not the path, so IDs do not create a series each
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            requests_total.inc(method=method, route=route, status=status)
+            request_seconds.observe(elapsed, method=method, route=route)
+            request_statements.observe(stats.statements, method=method, route=route)
+            request_db_seconds.observe(stats.db_seconds, method=method, route=route)
+            request_pool_wait_seconds.observe(stats.pool_wait_seconds, method=method, route=route)
@@ -1,6 +1,92 @@
-from sqlalchemy import Column, Integer, String, Date, Boolean
+import os
+from datetime import date, datetime
+from sqlalchemy import (Column, Integer, SmallInteger, String, Date, DateTime, Boolean, ForeignKey, Index, Text,
+                        PrimaryKeyConstraint, UniqueConstraint, event, text)
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import validates
 from app.database import Base
 
+# Hash partitions of a contacts table created on PostgreSQL by create_all or the 0c3e7a91d5f2 migration;
+# 0 (the default) keeps one plain table. Queries follow the schema the database actually has.
+CONTACT_PARTITIONS = int(os.getenv("CONTACT_PARTITIONS", "0"))
+
+# PostgreSQL extensions the contact search indexes and ranking need; see app.search
+SEARCH_EXTENSIONS = ("pg_trgm", "btree_gin")
+
+_IS_PARTITIONED_QUERY = text(
+    "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('contacts'))"
+)
+
+
+def partitions_contacts(dialect) -> bool:
+    """
+    Check whether a contacts table created on a database of this dialect is partitioned.
+    """
+    return CONTACT_PARTITIONS > 0 and dialect.name == "postgresql"
+
+
+def contacts_partitioned(connection) -> bool:
+    """
+    Check whether the contacts table of a database is partitioned.
+
+    Looked up on every call: one catalog query, and right across the online
+    swap of the 0c3e7a91d5f2 migration.
+
+    Args:
+        connection (Connection): A connection to the database.
+
+    Returns:
+        bool: True if contacts is a partitioned PostgreSQL table.
+    """
+    return connection.dialect.name == "postgresql" and bool(connection.execute(_IS_PARTITIONED_QUERY).scalar())
+
+
+def contact_email_key(connection):
+    """
+    Return the unique key of contact emails, the ON CONFLICT target of contact inserts.
+
+    PostgreSQL requires the partition key in every unique constraint of a
+    partitioned table, so emails are unique per owner there, and globally
+    otherwise.
+
+    Args:
+        connection (Connection): A connection to the database.
+
+    Returns:
+        Tuple[str, ...]: ``("owner_id", "email")`` or ``("email",)``.
+    """
+    return ("owner_id", "email") if contacts_partitioned(connection) else ("email",)
+
+
+def _partitioned_ddl(ddl, target, bind, **kwargs):
+    return partitions_contacts(kwargs["dialect"])
+
+
+def _unpartitioned_ddl(ddl, target, bind, **kwargs):
+    return not partitions_contacts(kwargs["dialect"])
+
+
+def birthday_md(birthday):
+    """
+    Encode the month and day of a birthday as ``month * 100 + day``.
+
+    Args:
+        birthday (date | str | None): The birthday, or its ISO format.
+
+    Returns:
+        int: The encoded month-day (e.g. 1231 for 31 December), or None.
+    """
+    if birthday is None:
+        return None
+    if isinstance(birthday, str):
+        birthday = date.fromisoformat(birthday)
+    return birthday.month * 100 + birthday.day
+
+
+def _birthday_md_default(context):
+    # Covers Core inserts (bulk, import) that set birthday without birthday_md
+    return birthday_md(context.get_current_parameters().get("birthday"))
+
 class Contact(Base):
     """
     Database model for a contact.
@@ -15,16 +101,94 @@ class Contact(Base):
         phone (str): The phone number of the contact.
         birthday (date): The birthday of the contact.
         additional_info (str, optional): Additional information about the contact.
+        owner_id (int): The ID of the user who owns the contact.
+        birthday_md (int): Month and day of the birthday as ``month * 100 + day``, kept
+            in sync with ``birthday`` for index range scans over upcoming birthdays.
+        version (int): The owner's ``contacts_version`` of the last write to the contact.
+        updated_at (datetime): When the contact was created or last modified (UTC).
+
+    With ``CONTACT_PARTITIONS`` set, a table created on PostgreSQL is
+    hash-partitioned on ``owner_id`` into ``contacts_p0`` ...
+    ``contacts_p<CONTACT_PARTITIONS - 1>``; its primary key becomes
+    ``(id, owner_id)`` and the email is unique per owner. Every query filters
+    on ``owner_id``, so it only reads one partition. Other databases always
+    get one table.
     """
     __tablename__ = "contacts"
+    __table_args__ = (
+        # Keyset pagination: (owner_id, id) and (owner_id, last_name, first_name, id) orderings; names sort
+        # as '' when NULL (see crud.contact_sort_columns)
+        Index("ix_contacts_owner_id_id", "owner_id", "id"),
+        Index("ix_contacts_owner_id_name", "owner_id", text("coalesce(last_name, '')"),
+              text("coalesce(first_name, '')"), "id"),
+        Index("ix_contacts_owner_id_birthday_md", "owner_id", "birthday_md"),
+        # Changes since a version: (owner_id, version) range scans
+        Index("ix_contacts_owner_id_version", "owner_id", "version"),
+        # Search: case-insensitive substring and prefix filters within one owner's contacts (app.search)
+        *(Index(f"ix_contacts_owner_id_{column}_trgm", "owner_id", column, postgresql_using="gin",
+                postgresql_ops={column: "gin_trgm_ops"}).ddl_if(dialect="postgresql")
+          for column in ("first_name", "last_name", "email")),
+        Index("ix_contacts_email", "email", unique=True).ddl_if(callable_=_unpartitioned_ddl),
+        UniqueConstraint("owner_id", "email", name="uq_contacts_owner_id_email").ddl_if(callable_=_partitioned_ddl),
+    )
+    if CONTACT_PARTITIONS > 0:
+        __table_args__ += ({"postgresql_partition_by": "HASH (owner_id)"},)
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     first_name = Column(String, index=True)
     last_name = Column(String, index=True)
-    email = Column(String, unique=True, index=True)
+    email = Column(String)
     phone = Column(String)
     birthday = Column(Date)
     additional_info = Column(String, nullable=True)
+    owner_id = Column(Integer, ForeignKey("users.id"))
+    birthday_md = Column(SmallInteger, default=_birthday_md_default)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @validates("birthday")
+    def _sync_birthday_md(self, key, value):
+        self.birthday_md = birthday_md(value)
+        return value
+
+
+def contact_partition_ddl(table: str = "contacts", partitions: int = CONTACT_PARTITIONS):
+    """
+    Build the statements creating the hash partitions of a contacts table.
+
+    Args:
+        table (str, optional): The partitioned table.
+        partitions (int, optional): The number of partitions.
+
+    Returns:
+        List[str]: One ``CREATE TABLE ... PARTITION OF`` per partition, named ``<table>_p<remainder>``.
+    """
+    return [f"CREATE TABLE {table}_p{remainder} PARTITION OF {table} "
+            f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})" for remainder in range(partitions)]
+
+
+@compiles(PrimaryKeyConstraint, "postgresql")
+def _compile_primary_key(constraint, compiler, **kwargs):
+    # The primary key of a partitioned table must include the partition key
+    if constraint.table is Contact.__table__ and partitions_contacts(compiler.dialect):
+        return "PRIMARY KEY (id, owner_id)"
+    return compiler.visit_primary_key_constraint(constraint, **kwargs)
+
+
+@event.listens_for(Base.metadata, "before_create")
+def _create_search_extensions(target, connection, **kwargs):
+    # pg_trgm provides similarity() and the trigram operator classes; btree_gin lets owner_id share the
+    # GIN indexes. Both are trusted extensions, installable by the database owner.
+    if connection.dialect.name == "postgresql":
+        for extension in SEARCH_EXTENSIONS:
+            connection.execute(text(f"CREATE EXTENSION IF NOT EXISTS {extension}"))
+
+
+@event.listens_for(Contact.__table__, "after_create")
+def _create_contact_partitions(table, connection, **kwargs):
+    if partitions_contacts(connection.dialect):
+        for statement in contact_partition_ddl():
+            connection.execute(text(statement))
 
 
 class User(Base):
@@ -39,6 +203,8 @@ class User(Base):
         hashed_password (str): The hashed password of the user.
         is_verified (bool): Indicates if the user's email has been verified (default: False).
         avatar_url (str, optional): URL of the user's avatar image.
+        contacts_version (int): Counter incremented by every transaction that changes
+            the user's contacts; the basis of contact ETags and change feeds.
     """
     __tablename__ = "users"
 
@@ -47,3 +213,69 @@ class User(Base):
     hashed_password = Column(String)
     is_verified = Column(Boolean, default=False)
     avatar_url = Column(String, nullable=True)
+    contacts_version = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+class ContactDeletion(Base):
+    """
+    Database model for a deleted contact.
+
+    A row is written to the 'contact_deletions' table for every deleted
+    contact, so that change feeds can report deletions.
+
+    Attributes:
+        id (int): The primary key ID of the deletion.
+        contact_id (int): The ID the deleted contact had.
+        owner_id (int): The ID of the user who owned the contact.
+        version (int): The owner's ``contacts_version`` of the deletion.
+        deleted_at (datetime): When the contact was deleted (UTC).
+    """
+    __tablename__ = "contact_deletions"
+    __table_args__ = (
+        Index("ix_contact_deletions_owner_id_version", "owner_id", "version"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    contact_id = Column(Integer, nullable=False)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    version = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class EmailOutbox(Base):
+    """
+    Database model for an outgoing email.
+
+    Emails are written to the 'email_outbox' table by request handlers and
+    delivered by the dispatcher in ``app.outbox``.
+
+    Attributes:
+        id (int): The primary key ID of the email.
+        dedupe_key (str): A unique key; enqueueing the same key again is a no-op.
+        to_email (str): The recipient's email address.
+        subject (str): The subject of the email.
+        body (str): The body of the email.
+        status (str): "pending", "sent" or "failed".
+        attempts (int): The number of delivery attempts so far.
+        next_attempt_at (datetime): When the email may next be claimed for delivery.
+        last_error (str, optional): The error of the last failed attempt.
+        created_at (datetime): When the email was enqueued.
+        sent_at (datetime, optional): When the email was delivered.
+    """
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        # The dispatcher polls for pending emails that are due
+        Index("ix_email_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    dedupe_key = Column(String, unique=True, nullable=False)
+    to_email = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String(16), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
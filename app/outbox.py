@@ -0,0 +1,404 @@
+"""
+Outbox-backed email delivery.
+
+Request handlers do not talk to SMTP. They store emails in the
+``email_outbox`` table with ``crud.enqueue_email`` and the ``OutboxDispatcher``
+delivers them in the background: it claims due emails in batches, sends them
+over a small pool of reused SMTP connections and retries failures with
+exponential backoff. Claiming an email leases it for ``OUTBOX_LEASE_SECONDS``
+(with ``FOR UPDATE SKIP LOCKED`` on PostgreSQL), so every worker process can run
+a dispatcher against the same table without sending an email twice, and emails
+claimed by a worker that died are picked up again once the lease expires.
+Results are recorded as each send completes, and the lease must cover a whole
+batch (``min_lease_seconds``), which is checked on import.
+
+The SMTP server is configured with ``SMTP_HOST``, ``SMTP_PORT`` and
+``SMTP_SECURITY`` ("ssl", "starttls" or "none"), so a local stand-in such as
+aiosmtpd can replace Gmail in tests and benchmarks.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import queue
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app import database
+from app.metrics import registry
+from app.models import EmailOutbox
+
+if TYPE_CHECKING:
+    import smtplib
+    from email.mime.text import MIMEText
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EMAIL_SENDER = os.getenv("EMAIL_SENDER")
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_SECURITY = os.getenv("SMTP_SECURITY", "ssl")
+SMTP_USERNAME = os.getenv("SMTP_USERNAME", EMAIL_SENDER or "")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", os.getenv("EMAIL_PASSWORD", ""))
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "10"))
+# Pooled connections, which is also the number of emails sent concurrently
+SMTP_CONNECTIONS = int(os.getenv("SMTP_CONNECTIONS", "2"))
+# Idle pooled connections are checked with NOOP before reuse
+SMTP_MAX_IDLE = float(os.getenv("SMTP_MAX_IDLE", "30"))
+
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "1") == "1"
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+# Long enough for a whole batch to go out when every send takes SMTP_TIMEOUT; see min_lease_seconds
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "10"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "3600"))
+
+
+
+def min_lease_seconds(batch_size: int = OUTBOX_BATCH_SIZE, connections: int = SMTP_CONNECTIONS) -> float:
+    """
+    Return the shortest lease under which a claimed batch is delivered before its lease expires.
+
+    The last email of a batch waits for ``ceil(batch_size / connections)``
+    sends ahead of it on the same connection, each bounded by ``SMTP_TIMEOUT``.
+    """
+    return math.ceil(batch_size / max(connections, 1)) * SMTP_TIMEOUT
+
+
+if OUTBOX_ENABLED and OUTBOX_LEASE_SECONDS < min_lease_seconds():
+    # Emails still queued in the batch would be claimed, and sent, again by another dispatcher
+    raise ValueError(
+        f"OUTBOX_LEASE_SECONDS={OUTBOX_LEASE_SECONDS} is shorter than a batch of OUTBOX_BATCH_SIZE="
+        f"{OUTBOX_BATCH_SIZE} emails over SMTP_CONNECTIONS={SMTP_CONNECTIONS} connections may take "
+        f"({min_lease_seconds():g}s with SMTP_TIMEOUT={SMTP_TIMEOUT:g})"
+    )
+
+sent_total = registry.counter("outbox_emails_sent_total", "Emails delivered from the outbox.")
+attempt_failures_total = registry.counter(
+    "outbox_send_failures_total", "Failed email delivery attempts, including ones that are retried.")
+dropped_total = registry.counter(
+    "outbox_emails_failed_total", "Emails given up on after OUTBOX_MAX_ATTEMPTS attempts.")
+batch_seconds = registry.histogram("outbox_batch_duration_seconds", "Time spent delivering a batch of emails.")
+
+# SMTP
+#
+# smtplib and the email package are imported on first use: together they are a
+# noticeable part of the application import time and only the dispatcher needs them.
+# ``smtplib.SMTPException`` is an ``OSError``, so failures are caught as ``OSError``.
+
+def smtp_connect() -> "smtplib.SMTP":
+    """
+    Open an authenticated connection to the configured SMTP server.
+
+    Returns:
+        smtplib.SMTP: The connection.
+    """
+    import smtplib
+
+    if SMTP_SECURITY == "ssl":
+        server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    else:
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_SECURITY == "starttls":
+            server.starttls()
+    if SMTP_USERNAME and SMTP_PASSWORD:
+        server.login(SMTP_USERNAME, SMTP_PASSWORD)
+    return server
+
+
+def build_message(to_email: str, subject: str, body: str) -> "MIMEText":
+    """
+    Build a plain-text email from the configured sender.
+
+    Args:
+        to_email (str): The recipient's email address.
+        subject (str): The subject of the email.
+        body (str): The body of the email.
+
+    Returns:
+        MIMEText: The message.
+    """
+    from email.mime.text import MIMEText
+
+    msg = MIMEText(body)
+    msg['Subject'] = subject
+    msg['From'] = EMAIL_SENDER or SMTP_USERNAME
+    msg['To'] = to_email
+    return msg
+
+
+def _close(server: "smtplib.SMTP"):
+    try:
+        server.quit()
+    except OSError:
+        server.close()
+
+
+class SMTPConnectionPool:
+    """
+    A pool of reusable SMTP connections.
+
+    Connections are opened on demand and returned to the pool after use. After
+    a failed send the session is reset, and discarded if that fails too, so a
+    broken connection is never reused.
+
+    Args:
+        size (int, optional): The maximum number of idle connections kept. Defaults to ``SMTP_CONNECTIONS``.
+        max_idle (float, optional): Seconds after which an idle connection is checked
+            with NOOP before reuse. Defaults to ``SMTP_MAX_IDLE``.
+    """
+
+    def __init__(self, size: int = SMTP_CONNECTIONS, max_idle: float = SMTP_MAX_IDLE):
+        self.max_idle = max_idle
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _get(self) -> "smtplib.SMTP":
+        while True:
+            try:
+                server, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return smtp_connect()
+            if time.monotonic() - last_used < self.max_idle:
+                return server
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except OSError:
+                pass
+            _close(server)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a ``with`` block.
+        """
+        server = self._get()
+        try:
+            yield server
+        except BaseException:
+            # A refused message leaves the session usable once it is reset
+            try:
+                server.rset()
+            except OSError:
+                _close(server)
+                raise
+            self._release(server)
+            raise
+        self._release(server)
+
+    def _release(self, server: "smtplib.SMTP"):
+        try:
+            self._idle.put_nowait((server, time.monotonic()))
+        except queue.Full:
+            _close(server)
+
+    def close(self):
+        """
+        Close every idle connection.
+        """
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            _close(server)
+
+# Outbox
+
+def backoff(attempts: int) -> float:
+    """
+    Return the delay before the next delivery attempt.
+
+    Args:
+        attempts (int): The number of attempts made so far.
+
+    Returns:
+        float: Seconds to wait; exponential in ``attempts``, capped at
+        ``OUTBOX_BACKOFF_MAX`` and jittered so retries do not arrive in bursts.
+    """
+    delay = min(OUTBOX_BACKOFF_BASE * 2 ** max(attempts - 1, 0), OUTBOX_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim_batch(db: Session, batch_size: int = OUTBOX_BATCH_SIZE) -> List[dict]:
+    """
+    Claim the pending emails that are due for delivery.
+
+    Each claimed email has its attempt counter incremented and is leased for
+    ``OUTBOX_LEASE_SECONDS``, during which no other dispatcher claims it.
+
+    Args:
+        db (Session): The database session.
+        batch_size (int, optional): The maximum number of emails to claim. Defaults to ``OUTBOX_BATCH_SIZE``.
+
+    Returns:
+        List[dict]: The claimed emails.
+    """
+    now = datetime.utcnow()
+    stmt = (
+        select(EmailOutbox)
+        .filter(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+        .order_by(EmailOutbox.next_attempt_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    claimed = []
+    for email in db.scalars(stmt):
+        email.attempts += 1
+        email.next_attempt_at = now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        claimed.append({"id": email.id, "to_email": email.to_email, "subject": email.subject,
+                        "body": email.body, "attempts": email.attempts})
+    db.commit()
+    return claimed
+
+
+def record_results(db: Session, sent: List[int], failed: List[tuple]):
+    """
+    Mark delivered emails as sent and schedule retries for failed ones.
+
+    Args:
+        db (Session): The database session.
+        sent (List[int]): IDs of the delivered emails.
+        failed (List[tuple]): ``(email, error)`` pairs of claimed emails that failed.
+    """
+    now = datetime.utcnow()
+    if sent:
+        db.execute(update(EmailOutbox).where(EmailOutbox.id.in_(sent)).values(status="sent", sent_at=now))
+    for email, error in failed:
+        values = {"last_error": str(error)[:500]}
+        if email["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+            values["status"] = "failed"
+            dropped_total.inc()
+            logger.error("Outbox: giving up on email %s to %s: %s", email["id"], email["to_email"], error)
+        else:
+            values["next_attempt_at"] = now + timedelta(seconds=backoff(email["attempts"]))
+        db.execute(update(EmailOutbox).where(EmailOutbox.id == email["id"]).values(**values))
+    db.commit()
+
+
+class OutboxDispatcher:
+    """
+    Background delivery of outbox emails.
+
+    Args:
+        batch_size (int, optional): Emails claimed per batch. Defaults to ``OUTBOX_BATCH_SIZE``.
+        poll_interval (float, optional): Seconds between polls when idle. Defaults to ``OUTBOX_POLL_INTERVAL``.
+        connections (int, optional): SMTP connections used concurrently. Defaults to ``SMTP_CONNECTIONS``.
+    """
+
+    def __init__(self, batch_size: int = OUTBOX_BATCH_SIZE, poll_interval: float = OUTBOX_POLL_INTERVAL,
+                 connections: int = SMTP_CONNECTIONS):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.connections = connections
+        self.pool = SMTPConnectionPool(connections)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._senders: Optional[ThreadPoolExecutor] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def _send(self, email: dict):
+        msg = build_message(email["to_email"], email["subject"], email["body"])
+        with self.pool.connection() as server:
+            server.sendmail(msg['From'], [email["to_email"]], msg.as_string())
+
+    def dispatch_once(self) -> int:
+        """
+        Claim and deliver one batch of due emails.
+
+        Returns:
+            int: The number of emails claimed.
+        """
+        db = database.SessionLocal()
+        try:
+            batch = claim_batch(db, self.batch_size)
+            if not batch:
+                return 0
+            started = time.perf_counter()
+            if self._senders is None:
+                self._senders = ThreadPoolExecutor(max_workers=self.connections, thread_name_prefix="outbox-smtp")
+            futures = {self._senders.submit(self._send, email): email for email in batch}
+            # Each result is recorded as soon as it is known, so a sent email is never resent once
+            # its lease expires, even if the rest of the batch is slow
+            for future in as_completed(futures):
+                email = futures[future]
+                try:
+                    future.result()
+                except Exception as error:
+                    attempt_failures_total.inc()
+                    logger.warning("Outbox: delivery of email %s failed: %s", email["id"], error)
+                    record_results(db, [], [(email, error)])
+                else:
+                    record_results(db, [email["id"]], [])
+                    sent_total.inc()
+            batch_seconds.observe(time.perf_counter() - started)
+            return len(batch)
+        finally:
+            db.close()
+
+    def notify(self):
+        """
+        Wake the dispatcher up to deliver newly enqueued emails without waiting for the next poll.
+        """
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        """
+        Start the dispatcher on the running event loop.
+        """
+        if self._task is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox")
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the dispatcher and close its SMTP connections.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        if self._senders is not None:
+            self._senders.shutdown(wait=True)
+            self._senders = None
+        self.pool.close()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            try:
+                claimed = await loop.run_in_executor(self._executor, self.dispatch_once)
+            except Exception:
+                logger.exception("Outbox: dispatch failed")
+                claimed = 0
+            if claimed >= self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+dispatcher = OutboxDispatcher()
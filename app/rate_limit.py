@@ -0,0 +1,457 @@
+"""
+Token-bucket rate limiting.
+
+Limited routes declare a named policy with a ``RateLimiter`` dependency, e.g.
+``RateLimiter("contacts:create", times=5, seconds=60)``: at most ``times``
+requests per ``seconds`` per user, refilled continuously. The defaults can be
+overridden per policy with ``RATE_LIMIT_POLICIES`` and per user with
+``RATE_LIMIT_USER_POLICIES`` (JSON, see ``parse_policy``).
+
+Every worker enforces the limits with in-process token buckets, so a limited
+request never waits for Redis. With the Redis backend the consumption of
+every worker is pushed to a shared bucket per key in one pipelined batch
+every ``RATE_LIMIT_SYNC_INTERVAL`` seconds, and the shared level is copied
+back into the local buckets. The long-run rate is enforced across workers;
+a burst may exceed a limit by what the other workers admit before the next
+sync. Policies marked strict (or all of them with ``RATE_LIMIT_STRICT=1``)
+consume from the shared bucket on every request instead.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException, status
+from starlette.concurrency import run_in_threadpool
+
+from app import auth, schemas
+from app.metrics import registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+# "redis" shares the buckets between workers through the client connected in main.startup; "memory" keeps them local
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "redis")
+# Consume from the shared bucket on every request for all policies
+RATE_LIMIT_STRICT = os.getenv("RATE_LIMIT_STRICT", "0") == "1"
+# Seconds between pushes of local consumption to Redis
+RATE_LIMIT_SYNC_INTERVAL = float(os.getenv("RATE_LIMIT_SYNC_INTERVAL", "0.25"))
+# Policy overrides, e.g. {"contacts:create": "20/60", "contacts:bulk": {"times": 5, "seconds": 60, "strict": true}}
+RATE_LIMIT_POLICIES = os.getenv("RATE_LIMIT_POLICIES", "{}")
+# Per-user policy overrides keyed by user ID, e.g. {"42": {"contacts:bulk": "100/60"}}
+RATE_LIMIT_USER_POLICIES = os.getenv("RATE_LIMIT_USER_POLICIES", "{}")
+
+_KEY_PREFIX = "rate-limit:"
+# Local buckets are pruned once per this many requests
+_PRUNE_EVERY = 1024
+
+rejected_total = registry.counter("rate_limit_rejected_total", "Requests rejected by a rate limit.", ["policy"])
+sync_seconds = registry.histogram("rate_limit_sync_seconds", "Time spent pushing local consumption to Redis.")
+sync_failures_total = registry.counter("rate_limit_sync_failures_total", "Failed pushes of local consumption to Redis.")
+
+# Refill and consume a shared bucket atomically, on the Redis clock.
+# KEYS[1]: the bucket; ARGV: capacity, tokens per second, cost, strict (1: only consume if enough tokens).
+# Returns {allowed, tokens left}.
+_TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 1
+if ARGV[4] == '1' and tokens < cost then
+    allowed = 0
+else
+    tokens = tokens - cost
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+class Policy:
+    """
+    A rate limit: ``times`` requests per ``seconds``.
+
+    Args:
+        times (int): The bucket capacity, i.e. the largest burst.
+        seconds (float): The time in which an empty bucket refills completely.
+        strict (bool, optional): Consume from the shared bucket on every request. Defaults to False.
+    """
+
+    def __init__(self, times: int, seconds: float, strict: bool = False):
+        if times <= 0 or seconds <= 0:
+            raise ValueError("A rate limit needs a positive number of requests and seconds")
+        self.times = times
+        self.seconds = seconds
+        self.strict = strict
+
+    @property
+    def rate(self) -> float:
+        """
+        Tokens added per second.
+        """
+        return self.times / self.seconds
+
+    def __eq__(self, other):
+        return isinstance(other, Policy) and (self.times, self.seconds, self.strict) == (
+            other.times, other.seconds, other.strict)
+
+    def __repr__(self):
+        return f"Policy(times={self.times}, seconds={self.seconds}, strict={self.strict})"
+
+
+def parse_policy(spec: Union[str, dict], strict: bool = False) -> Policy:
+    """
+    Parse a policy from configuration.
+
+    Args:
+        spec (str | dict): ``"times/seconds"``, optionally followed by ``"/strict"``,
+            or ``{"times": ..., "seconds": ..., "strict": ...}``.
+        strict (bool, optional): Strictness if the spec does not set it. Defaults to False.
+
+    Returns:
+        Policy: The parsed policy.
+
+    Raises:
+        ValueError: If the spec is malformed.
+    """
+    if isinstance(spec, dict):
+        return Policy(int(spec["times"]), float(spec["seconds"]), bool(spec.get("strict", strict)))
+    parts = spec.split("/")
+    if len(parts) not in (2, 3) or (len(parts) == 3 and parts[2] != "strict"):
+        raise ValueError(f"Invalid rate limit {spec!r}, expected 'times/seconds[/strict]'")
+    return Policy(int(parts[0]), float(parts[1]), strict or len(parts) == 3)
+
+
+class TokenBucket:
+    """
+    The local state of one key.
+
+    Args:
+        tokens (float): The initial number of tokens.
+        now (float): The current ``time.monotonic()``.
+    """
+
+    __slots__ = ("tokens", "updated", "pending", "full_at")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        # Tokens consumed here and not yet pushed to the shared bucket
+        self.pending = 0.0
+        # When the bucket will be full again, after which it is equivalent to a new one
+        self.full_at = now
+
+    def refill(self, policy: Policy, now: float):
+        """
+        Add the tokens accrued since the last update, up to the capacity.
+        """
+        self.tokens = min(policy.times, self.tokens + (now - self.updated) * policy.rate)
+        self.updated = now
+        self.full_at = now + (policy.times - self.tokens) / policy.rate
+
+    def take(self, policy: Policy, cost: float, now: float) -> float:
+        """
+        Consume ``cost`` tokens if available.
+
+        Returns:
+            float: 0 if the tokens were consumed, otherwise the seconds until they will be available.
+        """
+        self.refill(policy, now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            self.pending += cost
+            self.full_at += cost / policy.rate
+            return 0.0
+        return (cost - self.tokens) / policy.rate
+
+
+class MemoryBackend:
+    """
+    Token buckets kept in this process only.
+
+    Used in tests and single-worker deployments; with several workers each
+    one enforces the limits separately.
+    """
+
+    def __init__(self):
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._hits = 0
+
+    def take(self, key: str, policy: Policy, cost: float = 1) -> float:
+        """
+        Consume tokens from the local bucket of a key.
+
+        Args:
+            key (str): The bucket key.
+            policy (Policy): The limit of the bucket.
+            cost (float, optional): Tokens to consume. Defaults to 1.
+
+        Returns:
+            float: 0 if the request is allowed, otherwise the seconds to wait.
+        """
+        now = time.monotonic()
+        self._hits += 1
+        if self._hits % _PRUNE_EVERY == 0:
+            self.prune(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(policy.times, now)
+        return bucket.take(policy, cost, now)
+
+    def prune(self, now: float):
+        """
+        Drop buckets that have been idle long enough to be full again.
+        """
+        idle = [key for key, bucket in self._buckets.items() if bucket.full_at <= now]
+        for key in idle:
+            del self._buckets[key]
+
+    async def hit(self, key: str, policy: Policy, cost: float = 1) -> float:
+        """
+        Account for a request.
+
+        Args:
+            key (str): The bucket key.
+            policy (Policy): The limit of the bucket.
+            cost (float, optional): Tokens to consume. Defaults to 1.
+
+        Returns:
+            float: 0 if the request is allowed, otherwise the seconds to wait.
+        """
+        return self.take(key, policy, cost)
+
+    def start(self):
+        """
+        Start background work on the running event loop.
+        """
+
+    async def stop(self):
+        """
+        Stop background work.
+        """
+
+
+class RedisBackend(MemoryBackend):
+    """
+    Local token buckets kept approximately in sync through Redis.
+
+    Args:
+        redis (redis.Redis): A sync client; it is only used from the threadpool.
+        sync_interval (float, optional): Seconds between pushes. Defaults to ``RATE_LIMIT_SYNC_INTERVAL``.
+    """
+
+    def __init__(self, redis, sync_interval: float = RATE_LIMIT_SYNC_INTERVAL):
+        super().__init__()
+        self.redis = redis
+        self.sync_interval = sync_interval
+        self._script = redis.register_script(_TOKEN_BUCKET_SCRIPT)
+        # Keys whose buckets are not full: synced until they are
+        self._active: Dict[str, Policy] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def prune(self, now: float):
+        """
+        Drop idle buckets that have no consumption waiting to be pushed.
+        """
+        idle = [key for key, bucket in self._buckets.items() if bucket.full_at <= now and key not in self._active]
+        for key in idle:
+            del self._buckets[key]
+
+    def _take_shared(self, key: str, policy: Policy, cost: float) -> float:
+        allowed, tokens = self._script(keys=[_KEY_PREFIX + key], args=[policy.times, policy.rate, cost, 1])
+        return 0.0 if allowed else (cost - float(tokens)) / policy.rate
+
+    async def hit(self, key: str, policy: Policy, cost: float = 1) -> float:
+        if policy.strict:
+            try:
+                return await run_in_threadpool(self._take_shared, key, policy, cost)
+            except Exception:
+                logger.warning("Rate limit: shared bucket unavailable, enforcing locally", exc_info=True)
+                return self.take(key, policy, cost)
+        retry_after = self.take(key, policy, cost)
+        if not retry_after:
+            self._active[key] = policy
+        return retry_after
+
+    def _push(self, batch: List[Tuple[str, Policy, float]]) -> List[float]:
+        with self.redis.pipeline(transaction=False) as pipe:
+            for key, policy, consumed in batch:
+                self._script(keys=[_KEY_PREFIX + key], args=[policy.times, policy.rate, consumed, 0], client=pipe)
+            return [float(tokens) for _, tokens in pipe.execute()]
+
+    async def sync(self) -> int:
+        """
+        Push the local consumption of every key in use and adopt the shared levels.
+
+        Keys stay in use until their buckets are full again, so a worker also
+        sees what other workers consume of a key after it stopped consuming.
+        If Redis is unavailable the consumption is kept and pushed with the
+        next sync, and the local buckets keep enforcing the limits meanwhile.
+
+        Returns:
+            int: The number of keys synced.
+        """
+        if not self._active:
+            return 0
+        batch = []
+        for key, policy in self._active.items():
+            bucket = self._buckets[key]
+            batch.append((key, policy, bucket.pending))
+            bucket.pending = 0.0
+        started = time.perf_counter()
+        try:
+            levels = await run_in_threadpool(self._push, batch)
+        except Exception:
+            sync_failures_total.inc()
+            logger.warning("Rate limit: sync with Redis failed", exc_info=True)
+            for key, policy, consumed in batch:
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.pending += consumed
+            return 0
+        sync_seconds.observe(time.perf_counter() - started)
+        now = time.monotonic()
+        for (key, policy, _), level in zip(batch, levels):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                # Consumption admitted while the push was in flight is still pending
+                bucket.tokens = level - bucket.pending
+                bucket.updated = now
+                bucket.full_at = now + (policy.times - bucket.tokens) / policy.rate
+                if bucket.full_at > now or bucket.pending:
+                    continue
+            self._active.pop(key, None)
+        return len(batch)
+
+    def start(self):
+        """
+        Start pushing local consumption on the running event loop.
+        """
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the sync task after a final push.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.sync()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception:
+                logger.exception("Rate limit: sync failed")
+
+
+class Limiter:
+    """
+    Resolves policies and holds the backend shared by every ``RateLimiter``.
+
+    Args:
+        policies (dict, optional): Policy overrides by name.
+        user_policies (dict, optional): Policy overrides by user ID, then name.
+        backend (MemoryBackend, optional): The bucket store. Defaults to a ``MemoryBackend``.
+    """
+
+    def __init__(self, policies: dict = None, user_policies: dict = None, backend: MemoryBackend = None):
+        self.policies = {name: parse_policy(spec, RATE_LIMIT_STRICT) for name, spec in (policies or {}).items()}
+        self.user_policies = {
+            str(user_id): {name: parse_policy(spec, RATE_LIMIT_STRICT) for name, spec in overrides.items()}
+            for user_id, overrides in (user_policies or {}).items()
+        }
+        self.backend = backend or MemoryBackend()
+
+    def policy(self, name: str, user_id: int, default: Policy) -> Policy:
+        """
+        Return the policy that applies to a user.
+
+        Args:
+            name (str): The policy name.
+            user_id (int): The ID of the user.
+            default (Policy): The policy declared by the route.
+
+        Returns:
+            Policy: The user's override, else the configured override, else the default.
+        """
+        overrides = self.user_policies.get(str(user_id))
+        if overrides and name in overrides:
+            return overrides[name]
+        return self.policies.get(name, default)
+
+    async def check(self, name: str, user_id: int, default: Policy, cost: float = 1):
+        """
+        Account for a request of a user.
+
+        Raises:
+            HTTPException: 429 with a ``Retry-After`` header if the limit is exhausted.
+        """
+        policy = self.policy(name, user_id, default)
+        retry_after = await self.backend.hit(f"{name}:{user_id}", policy, cost)
+        if retry_after:
+            rejected_total.inc(policy=name)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too Many Requests",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+
+
+limiter = Limiter(json.loads(RATE_LIMIT_POLICIES), json.loads(RATE_LIMIT_USER_POLICIES))
+
+
+class RateLimiter:
+    """
+    Dependency limiting a route per user.
+
+    Args:
+        name (str): The policy name, used for overrides, bucket keys and metrics.
+        times (int): Default number of requests allowed per ``seconds``.
+        seconds (float): Default refill period.
+        cost (float, optional): Tokens consumed per request. Defaults to 1.
+    """
+
+    def __init__(self, name: str, times: int, seconds: float, cost: float = 1):
+        self.name = name
+        self.default = Policy(times, seconds, RATE_LIMIT_STRICT)
+        self.cost = cost
+
+    async def __call__(self, current_user: schemas.UserResponse = Depends(auth.get_current_user)):
+        await self.charge(current_user.id, self.cost)
+
+    async def charge(self, user_id: int, cost: float):
+        """
+        Account for ``cost`` tokens of a user, for routes whose cost is only known in the handler.
+
+        Args:
+            user_id (int): The ID of the user.
+            cost (float): Tokens to consume.
+
+        Raises:
+            HTTPException: 429 with a ``Retry-After`` header if the limit is exhausted.
+        """
+        if RATE_LIMIT_ENABLED:
+            await limiter.check(self.name, user_id, self.default, cost)
@@ -0,0 +1,340 @@
+"""
+Read replicas.
+
+Requests that only read contacts can be served from read replicas listed in
+``DATABASE_REPLICA_URLS`` (comma-separated). Routes say which kind of session
+they need:
+
+* ``get_read_session``: a session on the next healthy replica, round-robin.
+  It falls back to the primary when no replica is configured or healthy, and
+  for a user who wrote within the last ``DB_READ_YOUR_WRITES_SECONDS``, so a
+  client always reads its own writes despite replication lag. The window
+  must cover the most lag a replica taking reads can have,
+  ``DB_REPLICA_MAX_LAG_SECONDS`` plus one ``DB_REPLICA_HEALTH_INTERVAL``;
+  a shorter one is rejected at import.
+* ``get_write_session``: the request's primary session. A commit through it
+  starts the user's read-your-writes window.
+
+Routes using ``database.get_session`` directly stay on the primary.
+
+A background task checks every replica each ``DB_REPLICA_HEALTH_INTERVAL``
+seconds with ``SELECT 1`` and, on PostgreSQL, its replay lag; replicas that
+fail or lag more than ``DB_REPLICA_MAX_LAG_SECONDS`` take no reads until a
+later check passes. A replica whose connection fails during a request is
+taken out of rotation immediately.
+
+The read-your-writes windows live in this process, and in the Redis server
+shared by the response cache when ``main.startup`` connects one, so they hold
+across workers.
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import time
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from fastapi import Depends
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app import auth, database, schemas
+from app.metrics import registry
+from app.token_cache import ExpiringLRU
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+DB_REPLICA_HEALTH_INTERVAL = float(os.getenv("DB_REPLICA_HEALTH_INTERVAL", "5"))
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "10"))
+# Seconds after a user's write during which their reads go to the primary; at least the lag a replica
+# may reach while still taking reads (DB_REPLICA_MAX_LAG_SECONDS plus one health check interval)
+DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "15"))
+DB_READ_YOUR_WRITES_MAX_ENTRIES = int(os.getenv("DB_READ_YOUR_WRITES_MAX_ENTRIES", "100000"))
+
+if DATABASE_REPLICA_URLS and DB_READ_YOUR_WRITES_SECONDS < DB_REPLICA_MAX_LAG_SECONDS + DB_REPLICA_HEALTH_INTERVAL:
+    # A replica missing the write would serve the user's reads, and refill the response cache with them
+    raise ValueError(
+        f"DB_READ_YOUR_WRITES_SECONDS={DB_READ_YOUR_WRITES_SECONDS:g} is shorter than DB_REPLICA_MAX_LAG_SECONDS "
+        f"plus DB_REPLICA_HEALTH_INTERVAL ({DB_REPLICA_MAX_LAG_SECONDS + DB_REPLICA_HEALTH_INTERVAL:g})"
+    )
+
+_RECENT_WRITE_PREFIX = "replicas:recent-write:"
+
+# 0 on a replica that has replayed everything it received, even if the primary has been idle since
+_PG_LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+replica_healthy = registry.gauge("db_replica_healthy", "Whether a read replica takes reads (1) or not (0).",
+                                 ["pool"])
+replica_lag_seconds = registry.gauge("db_replica_lag_seconds", "Replay lag of a read replica at its last check.",
+                                     ["pool"])
+read_sessions_total = registry.counter(
+    "db_read_sessions_total", "Read sessions handed to routes, by the pool serving them.", ["pool"])
+
+
+@event.listens_for(Session, "after_commit")
+def _mark_committed(session):
+    session.info["committed"] = True
+
+
+class Replica:
+    """
+    One read replica: its engines and its health.
+
+    Args:
+        name (str): The ``pool`` metrics label, e.g. ``replica-0``.
+        engine (Engine): The sync engine, also used for health checks.
+        async_engine (AsyncEngine, optional): The engine serving reads when ``DB_ASYNC=1``.
+    """
+
+    __slots__ = ("name", "engine", "async_engine", "healthy")
+
+    def __init__(self, name: str, engine, async_engine=None):
+        self.name = name
+        self.engine = engine
+        self.async_engine = async_engine
+        self.healthy = True
+        replica_healthy.set_function(lambda: int(self.healthy), pool=name)
+
+    def session(self):
+        """
+        Open a session on this replica, async if it has an async engine.
+        """
+        if self.async_engine is not None:
+            return AsyncSession(bind=self.async_engine, autoflush=False, expire_on_commit=False)
+        return Session(bind=self.engine, autoflush=False)
+
+
+def create_replica(index: int, url: str) -> Replica:
+    """
+    Create the engines of a replica with the same pool settings and instrumentation as the primary.
+
+    Args:
+        index (int): The position of the replica in ``DATABASE_REPLICA_URLS``.
+        url (str): The database URL of the replica.
+
+    Returns:
+        Replica: The replica, considered healthy until its first check.
+    """
+    name = f"replica-{index}"
+    engine = create_engine(url, **database.engine_options(url, name=name))
+    database.register_pool_metrics(engine, name)
+    database.register_query_instrumentation(engine, name)
+    async_engine = None
+    if database.DB_ASYNC:
+        async_engine = create_async_engine(database.to_async_url(url),
+                                           **database.engine_options(url, is_async=True, name=f"{name}-async"))
+        database.register_pool_metrics(async_engine, f"{name}-async")
+        database.register_query_instrumentation(async_engine, f"{name}-async")
+    return Replica(name, engine, async_engine)
+
+
+class ReplicaSet:
+    """
+    Round-robin over the healthy replicas, with a background health check.
+
+    Args:
+        replicas (List[Replica]): The replicas to balance reads over.
+        health_interval (float, optional): Seconds between health checks.
+        max_lag (float, optional): Replay lag in seconds beyond which a replica takes no reads.
+    """
+
+    def __init__(self, replicas: List[Replica], health_interval: float = DB_REPLICA_HEALTH_INTERVAL,
+                 max_lag: float = DB_REPLICA_MAX_LAG_SECONDS):
+        self.replicas = replicas
+        self.health_interval = health_interval
+        self.max_lag = max_lag
+        self._counter = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    def next(self) -> Optional[Replica]:
+        """
+        Return the next healthy replica, or None if there is none.
+        """
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)]
+
+    def mark_down(self, replica: Replica, reason):
+        """
+        Take a replica out of rotation until its next successful health check.
+        """
+        if replica.healthy:
+            logger.warning("Read replica %s is unavailable: %s", replica.name, reason)
+        replica.healthy = False
+
+    def check(self):
+        """
+        Check every replica and update which ones take reads.
+
+        Blocking; runs in the threadpool.
+        """
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as connection:
+                    lag = 0.0
+                    if replica.engine.dialect.name == "postgresql":
+                        lag = float(connection.execute(_PG_LAG_QUERY).scalar())
+                    else:
+                        connection.execute(text("SELECT 1"))
+            except exc.DBAPIError as error:
+                self.mark_down(replica, type(error).__name__)
+                continue
+            replica_lag_seconds.set(lag, pool=replica.name)
+            if lag > self.max_lag:
+                self.mark_down(replica, f"{lag:.1f}s behind the primary")
+            elif not replica.healthy:
+                logger.info("Read replica %s is back", replica.name)
+                replica.healthy = True
+
+    def start(self):
+        """
+        Start checking the replicas on the running event loop.
+        """
+        if self._task is None and self.replicas:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the health checks and close the replicas' pooled connections.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for replica in self.replicas:
+            if replica.async_engine is not None:
+                await replica.async_engine.dispose()
+            await run_in_threadpool(replica.engine.dispose)
+
+    async def _run(self):
+        while True:
+            try:
+                await run_in_threadpool(self.check)
+            except Exception:
+                logger.exception("Read replicas: health check failed")
+            await asyncio.sleep(self.health_interval)
+
+
+class RecentWrites:
+    """
+    Users who wrote within the read-your-writes window.
+
+    Args:
+        window (float): Seconds a write keeps the user's reads on the primary.
+        max_entries (int): Capacity of the in-process tier.
+        redis (redis.Redis, optional): Client of the shared tier. Disabled if None.
+    """
+
+    def __init__(self, window: float, max_entries: int, redis=None):
+        self.window = window
+        self.redis = redis
+        self._local = ExpiringLRU(max_entries)
+
+    def record(self, user_id: int):
+        """
+        Start or extend the read-your-writes window of a user.
+        """
+        self._local.set(user_id, True, time.time() + self.window)
+        if self.redis is not None:
+            try:
+                self.redis.set(f"{_RECENT_WRITE_PREFIX}{user_id}", 1, px=max(int(self.window * 1000), 1))
+            except Exception:
+                logger.warning("Read replicas: shared write record failed", exc_info=True)
+
+    def recent(self, user_id: int) -> bool:
+        """
+        Check whether a user wrote within the window, in this worker or, with Redis, in any.
+        """
+        if self._local.get(user_id):
+            return True
+        if self.redis is not None:
+            try:
+                return bool(self.redis.exists(f"{_RECENT_WRITE_PREFIX}{user_id}"))
+            except Exception:
+                logger.warning("Read replicas: shared write lookup failed", exc_info=True)
+        return False
+
+
+replica_set = ReplicaSet([create_replica(index, url) for index, url in enumerate(DATABASE_REPLICA_URLS)])
+recent_writes = RecentWrites(DB_READ_YOUR_WRITES_SECONDS, DB_READ_YOUR_WRITES_MAX_ENTRIES)
+
+
+async def record_write(user_id: int):
+    """
+    Start the read-your-writes window of a user who committed a write outside ``get_write_session``.
+
+    The shared tier is updated from the threadpool so Redis never blocks the
+    event loop.
+
+    Args:
+        user_id (int): The ID of the user who wrote.
+    """
+    if not replica_set.replicas:
+        return
+    if recent_writes.redis is not None:
+        await run_in_threadpool(recent_writes.record, user_id)
+    else:
+        recent_writes.record(user_id)
+
+
+async def _wrote_recently(user_id: int) -> bool:
+    if recent_writes.redis is not None:
+        return await run_in_threadpool(recent_writes.recent, user_id)
+    return recent_writes.recent(user_id)
+
+
+async def get_write_session(db=Depends(database.get_session),
+                            current_user: schemas.UserResponse = Depends(auth.get_current_user)):
+    """
+    Provide the request's primary session, recording the user's write if it commits.
+
+    Yields:
+        Session | AsyncSession: The session ``database.get_session`` gives the request.
+    """
+    yield db
+    if db.info.pop("committed", False):
+        await record_write(current_user.id)
+
+
+async def get_read_session(db=Depends(database.get_session),
+                           current_user: schemas.UserResponse = Depends(auth.get_current_user)):
+    """
+    Provide a session for a request that only reads.
+
+    Yields:
+        Session | AsyncSession: A session on the next healthy replica, or the
+        request's primary session when there is none or the user wrote recently.
+    """
+    replica = None
+    if replica_set.replicas and not await _wrote_recently(current_user.id):
+        replica = replica_set.next()
+    if replica is None:
+        read_sessions_total.inc(pool="primary")
+        yield db
+        return
+    read_sessions_total.inc(pool=replica.name)
+    session = replica.session()
+    try:
+        yield session
+    except exc.OperationalError as error:
+        replica_set.mark_down(replica, type(error).__name__)
+        raise
+    finally:
+        if isinstance(session, AsyncSession):
+            await session.close()
+        else:
+            await run_in_threadpool(session.close)
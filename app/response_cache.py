@@ -0,0 +1,270 @@
+"""
+Per-owner response cache for contact reads.
+
+This module caches the rendered JSON of ``GET /api/contacts``,
+``/contacts/search`` and ``/contacts/upcoming-birthdays`` in a bounded
+in-process LRU, optionally backed by the Redis client that ``main.startup``
+connects. Every key is stamped with the owner's contacts version, which the
+contact writes in ``crud`` and ``async_crud`` bump after they commit: a write
+never deletes entries, it makes the owner's old keys unreachable and they age
+out of the LRU and Redis by TTL.
+
+Concurrent misses for the same key in a worker share a single database
+query, and TTLs are jittered, so a popular entry expiring does not send a
+burst of identical queries to the database.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+
+from app.metrics import registry
+from app.token_cache import ExpiringLRU
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+# Seconds a cached list or birthday window is served
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "60"))
+# Seconds a cached search result is served; searches are rarely repeated, so they expire sooner
+RESPONSE_CACHE_SEARCH_TTL = int(os.getenv("RESPONSE_CACHE_SEARCH_TTL", "30"))
+# Use the Redis client connected in main.startup as a shared tier
+RESPONSE_CACHE_REDIS = os.getenv("RESPONSE_CACHE_REDIS", "1") == "1"
+
+_VERSION_PREFIX = "response-cache:version:"
+_ENTRY_PREFIX = "response-cache:entry:"
+
+hits_total = registry.counter("response_cache_hits_total", "Contact reads served from the response cache.",
+                              ["endpoint"])
+misses_total = registry.counter("response_cache_misses_total", "Contact reads that queried the database.",
+                                ["endpoint"])
+coalesced_total = registry.counter(
+    "response_cache_coalesced_total", "Contact reads that waited for a concurrent miss instead of querying.",
+    ["endpoint"])
+
+# A cached response: the JSON body and the headers sent with it
+CachedResponse = Tuple[str, Dict[str, str]]
+
+
+def render_json(content) -> str:
+    """
+    Render content the way FastAPI renders a ``JSONResponse``.
+
+    Args:
+        content: A value accepted by ``jsonable_encoder``, e.g. a list of schemas.
+
+    Returns:
+        str: The JSON document.
+    """
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":"))
+
+
+class ResponseCache:
+    """
+    Two-tier cache of rendered responses, versioned per owner.
+
+    Without a shared tier the owner versions live in this process, so other
+    workers may serve a response for up to its TTL after a write. With Redis
+    the versions are read from Redis on every lookup and a write is visible to
+    every worker immediately.
+
+    Args:
+        max_entries (int): Capacity of the in-process LRU.
+        redis (redis.Redis, optional): Client of the shared tier. Disabled if None.
+    """
+
+    def __init__(self, max_entries: int, redis=None):
+        self.redis = redis
+        self._entries = ExpiringLRU(max_entries)
+        self._versions: Dict[int, int] = {}
+        self._versions_lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def version(self, owner_id: int) -> int:
+        """
+        Return the current contacts version of an owner.
+        """
+        if self.redis is not None:
+            try:
+                return int(self.redis.get(f"{_VERSION_PREFIX}{owner_id}") or 0)
+            except Exception:
+                logger.warning("Response cache: shared version lookup failed", exc_info=True)
+        return self._versions.get(owner_id, 0)
+
+    def bump(self, owner_id: int):
+        """
+        Advance the contacts version of an owner, invalidating their cached responses.
+
+        Call this after committing any change to the owner's contacts.
+
+        Args:
+            owner_id (int): The ID of the user who owns the contacts.
+        """
+        with self._versions_lock:
+            self._versions[owner_id] = self._versions.get(owner_id, 0) + 1
+        if self.redis is not None:
+            try:
+                self.redis.incr(f"{_VERSION_PREFIX}{owner_id}")
+            except Exception:
+                logger.warning("Response cache: shared version bump failed", exc_info=True)
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """
+        Look a key up in the local tier, then in the shared tier.
+        """
+        value = self._entries.get(key)
+        if value is not None or self.redis is None:
+            return value
+        try:
+            raw = self.redis.get(_ENTRY_PREFIX + key)
+        except Exception:
+            logger.warning("Response cache: shared tier lookup failed", exc_info=True)
+            return None
+        if raw is None:
+            return None
+        body, headers, expires_at = json.loads(raw)
+        value = (body, headers)
+        self._entries.set(key, value, expires_at)
+        return value
+
+    def set(self, key: str, value: CachedResponse, ttl: int):
+        """
+        Store a response in both tiers for about ``ttl`` seconds.
+        """
+        ttl = ttl * random.uniform(0.9, 1.0)
+        expires_at = time.time() + ttl
+        self._entries.set(key, value, expires_at)
+        if self.redis is not None:
+            try:
+                self.redis.set(_ENTRY_PREFIX + key, json.dumps([value[0], value[1], expires_at]),
+                               px=max(int(ttl * 1000), 1))
+            except Exception:
+                logger.warning("Response cache: shared tier write failed", exc_info=True)
+
+    def _lookup(self, owner_id: int, endpoint: str, params: dict) -> Tuple[str, Optional[CachedResponse]]:
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:32]
+        key = f"{owner_id}:{self.version(owner_id)}:{endpoint}:{digest}"
+        return key, self.get(key)
+
+    async def get_or_compute(self, owner_id: int, endpoint: str, params: dict,
+                             compute: Callable[[], Awaitable[CachedResponse]], ttl: int) -> CachedResponse:
+        """
+        Return a cached response, computing and caching it on a miss.
+
+        Concurrent misses for the same key wait for the first one's result
+        instead of running ``compute`` again.
+
+        Args:
+            owner_id (int): The ID of the user who owns the contacts.
+            endpoint (str): The name of the endpoint, part of the key and metric label.
+            params (dict): The parameters the response depends on.
+            compute (Callable): Coroutine function producing the response on a miss.
+            ttl (int): Seconds the response may be served.
+
+        Returns:
+            CachedResponse: The JSON body and headers of the response.
+        """
+        if self.redis is not None:
+            key, value = await run_in_threadpool(self._lookup, owner_id, endpoint, params)
+        else:
+            key, value = self._lookup(owner_id, endpoint, params)
+        if value is not None:
+            hits_total.inc(endpoint=endpoint)
+            return value
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            coalesced_total.inc(endpoint=endpoint)
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            misses_total.inc(endpoint=endpoint)
+            value = await compute()
+            if self.redis is not None:
+                await run_in_threadpool(self.set, key, value, ttl)
+            else:
+                self.set(key, value, ttl)
+            future.set_result(value)
+            return value
+        except BaseException as error:
+            future.set_exception(error)
+            # Waiters receive the error; mark it retrieved so an unobserved future does not log it
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def clear(self):
+        """
+        Drop every entry and version from the local tier.
+        """
+        self._entries.clear()
+        with self._versions_lock:
+            self._versions.clear()
+
+
+cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES)
+
+
+def bump_owner(owner_id: int):
+    """
+    Invalidate the cached responses of an owner, if the response cache is enabled.
+
+    Args:
+        owner_id (int): The ID of the user who owns the contacts.
+    """
+    if RESPONSE_CACHE_ENABLED:
+        cache.bump(owner_id)
+
+
+async def abump_owner(owner_id: int):
+    """
+    Invalidate the cached responses of an owner from async code.
+
+    The shared tier is updated from the threadpool so Redis never blocks the
+    event loop.
+
+    Args:
+        owner_id (int): The ID of the user who owns the contacts.
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return
+    if cache.redis is not None:
+        await run_in_threadpool(cache.bump, owner_id)
+    else:
+        cache.bump(owner_id)
+
+
+async def cached(owner_id: int, endpoint: str, params: dict, compute: Callable[[], Awaitable[CachedResponse]],
+                 ttl: int = RESPONSE_CACHE_TTL) -> CachedResponse:
+    """
+    Serve a response through the cache, or compute it directly if the cache is disabled.
+
+    Args:
+        owner_id (int): The ID of the user who owns the contacts.
+        endpoint (str): The name of the endpoint.
+        params (dict): The parameters the response depends on.
+        compute (Callable): Coroutine function producing the response on a miss.
+        ttl (int, optional): Seconds the response may be served. Defaults to ``RESPONSE_CACHE_TTL``.
+
+    Returns:
+        CachedResponse: The JSON body and headers of the response.
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return await compute()
+    return await cache.get_or_compute(owner_id, endpoint, params, compute, ttl)
@@ -1,59 +1,314 @@
-from fastapi import APIRouter, Depends, HTTPException
+import io
+import os
+from datetime import date
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, Response, UploadFile
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List
-from fastapi_limiter.depends import RateLimiter
-from .. import schemas, crud, auth
-from ..database import get_db
+from typing import List, Literal, Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+from .. import schemas, crud, auth, export_data, import_data, replicas, response_cache, serialization
+from ..rate_limit import RateLimiter
+from ..async_crud import call
+from ..database import DB_ASYNC, SessionLocal
 
 router = APIRouter(tags=["Contacts"])
 
+# Bulk requests: items per request, and items per minute per user; every created, updated or deleted item
+# costs one token of the "contacts:bulk" policy, so a full batch takes CONTACTS_BULK_MAX_ITEMS of the budget
+CONTACTS_BULK_MAX_ITEMS = int(os.getenv("CONTACTS_BULK_MAX_ITEMS", "1000"))
+CONTACTS_BULK_ITEMS_PER_MINUTE = int(os.getenv("CONTACTS_BULK_ITEMS_PER_MINUTE", "5000"))
+# Imports per minute per user
+CONTACTS_BULK_RATE_LIMIT = int(os.getenv("CONTACTS_BULK_RATE_LIMIT", "10"))
+# Rejected rows returned in an import report
+CONTACTS_IMPORT_ERROR_LIMIT = int(os.getenv("CONTACTS_IMPORT_ERROR_LIMIT", "100"))
+
+
+def _render_contacts(contacts, headers: dict = None) -> response_cache.CachedResponse:
+    # The body FastAPI would render for response_model=List[schemas.Contact]
+    if serialization.FAST_JSON:
+        # Plain rows from crud(as_rows=True): no ORM objects and no per-row validation
+        return serialization.dumps(contacts), headers or {}
+    items = [
+        schemas.Contact(id=contact.id, first_name=contact.first_name, last_name=contact.last_name,
+                        email=contact.email, phone=contact.phone, birthday=contact.birthday,
+                        additional_info=contact.additional_info, updated_at=contact.updated_at)
+        for contact in contacts
+    ]
+    return response_cache.render_json(items), headers or {}
+
+
+def _json_response(cached: response_cache.CachedResponse, headers: dict) -> Response:
+    body, cached_headers = cached
+    return Response(content=body, media_type="application/json", headers={**cached_headers, **headers})
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    # If-None-Match uses the weak comparison: W/"x" matches "x"
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in header.split(","))
+
+
+async def _check_etag(request: Request, db, user_id: int, *parts) -> Tuple[dict, Optional[Response]]:
+    """
+    Compute the ETag of a contacts response and answer a matching If-None-Match.
+
+    The ETag is derived from the user's contacts version, which every contact
+    write increments, so checking it costs one primary-key lookup and no rows
+    are loaded for a 304.
+
+    Args:
+        request (Request): The incoming request.
+        db (Session | AsyncSession): The database session.
+        user_id (int): The ID of the user who owns the contacts.
+        *parts: Other values the response depends on besides the URL and the contacts.
+
+    Returns:
+        tuple: The validator headers to send, and a 304 response if the client's copy is current.
+    """
+    version = await call(crud.get_contacts_version, db, user_id)
+    etag = '"' + "-".join(str(part) for part in (user_id, version) + parts) + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request, etag):
+        return headers, Response(status_code=304, headers=headers)
+    return headers, None
+
 
 @router.get("/contacts", response_model=List[schemas.Contact])
-def read_contacts(skip: int = 0, limit: int = 10, db: Session = Depends(get_db),
-                  current_user: schemas.UserResponse = Depends(auth.get_current_user)):
+async def read_contacts(request: Request, skip: int = 0, limit: int = Query(10, ge=1, le=1000),
+                        cursor: Optional[str] = None, sort: Literal["id", "name"] = "id",
+                        db: Session = Depends(replicas.get_read_session),
+                        current_user: schemas.UserResponse = Depends(auth.get_current_user)):
     """
     Retrieve contacts for the current user.
 
+    Pages can be requested by offset (``skip``) or, for deep pages, by the opaque
+    ``cursor`` returned in the ``X-Next-Cursor`` header of the previous page.
+    The header is only set when the page is full. Pages are served from the
+    response cache until the user's contacts change, and carry an ETag:
+    a request with a current ``If-None-Match`` gets 304 Not Modified.
+
     Args:
-        skip (int): Number of records to skip (default: 0).
+        request (Request): The incoming request, used for ``If-None-Match``.
+        skip (int): Number of records to skip (default: 0). Ignored when ``cursor`` is given.
         limit (int): Maximum number of records to retrieve (default: 10).
-        db (Session): SQLAlchemy database session dependency.
+        cursor (str, optional): Cursor of the page to retrieve.
+        sort (str): Sort order, "id" or "name" (last name, first name, id). Defaults to "id".
+        db (Session | AsyncSession): SQLAlchemy database session dependency.
         current_user (schemas.UserResponse): Current authenticated user.
 
     Returns:
         List[schemas.Contact]: List of contacts belonging to the current user.
+
+    Raises:
+        HTTPException: If the cursor is malformed or belongs to another sort order.
+    """
+    after = None
+    if cursor:
+        try:
+            after = crud.decode_contact_cursor(cursor, sort)
+        except ValueError as error:
+            raise HTTPException(status_code=400, detail=str(error))
+    headers, not_modified = await _check_etag(request, db, current_user.id)
+    if not_modified:
+        return not_modified
+
+    async def load():
+        contacts = await call(crud.get_contacts, db, user_id=current_user.id, skip=skip, limit=limit,
+                              after=after, sort=sort, as_rows=serialization.FAST_JSON)
+        headers = {}
+        if len(contacts) == limit:
+            headers["X-Next-Cursor"] = crud.encode_contact_cursor(contacts[-1], sort)
+        return _render_contacts(contacts, headers)
+
+    # The ETag, and with it the contacts version, is part of the key: a cached body is only sent with the
+    # ETag of the version it was read at, whichever database or worker answered
+    params = {"skip": skip, "limit": limit, "after": after, "sort": sort, "etag": headers["ETag"]}
+    return _json_response(await response_cache.cached(current_user.id, "contacts", params, load), headers)
+
+
+@router.get("/contacts/changes", response_model=schemas.ContactChanges)
+async def read_contact_changes(request: Request, response: Response, since: int = Query(0, ge=0),
+                               db: Session = Depends(replicas.get_read_session),
+                               current_user: schemas.UserResponse = Depends(auth.get_current_user)):
     """
-    contacts = crud.get_contacts(db, user_id=current_user.id, skip=skip, limit=limit)
-    return contacts
+    Retrieve the contacts created, modified or deleted since a contacts version.
 
+    Clients keep the ``version`` of the last response and pass it as ``since``
+    to pull only what changed; ``since=0`` returns every contact.
 
-@router.post("/contacts", response_model=schemas.Contact, dependencies=[Depends(RateLimiter(times=5, seconds=60))])
-def create_contact(contact: schemas.ContactCreate, db: Session = Depends(get_db),
+    Args:
+        request (Request): The incoming request, used for ``If-None-Match``.
+        response (Response): The outgoing response, used to set the ETag.
+        since (int): The contacts version the client has (default: 0).
+        db (Session | AsyncSession): SQLAlchemy database session dependency.
+        current_user (schemas.UserResponse): Current authenticated user.
+
+    Returns:
+        schemas.ContactChanges: The current version, the changed contacts and the deleted contact IDs.
+    """
+    headers, not_modified = await _check_etag(request, db, current_user.id)
+    if not_modified:
+        return not_modified
+    changes = await call(crud.get_contact_changes, db, user_id=current_user.id, since=since,
+                         as_rows=serialization.FAST_JSON)
+    if serialization.FAST_JSON:
+        return serialization.json_response(changes, headers)
+    response.headers.update(headers)
+    return changes
+
+
+@router.post("/contacts", response_model=schemas.Contact,
+             dependencies=[Depends(RateLimiter("contacts:create", times=5, seconds=60))])
+async def create_contact(contact: schemas.ContactCreate, db: Session = Depends(replicas.get_write_session),
                    current_user: schemas.UserResponse = Depends(auth.get_current_user)):
     """
     Create a new contact for the current user.
 
     Args:
         contact (schemas.ContactCreate): Contact data to create.
-        db (Session): SQLAlchemy database session dependency.
+        db (Session | AsyncSession): SQLAlchemy database session dependency.
         current_user (schemas.UserResponse): Current authenticated user.
 
     Returns:
         schemas.Contact: Created contact data.
     """
-    return crud.create_contact(db=db, contact=contact, user_id=current_user.id)
+    return await call(crud.create_contact, db, contact=contact, user_id=current_user.id)
+
+
+bulk_rate_limit = RateLimiter("contacts:bulk", times=CONTACTS_BULK_ITEMS_PER_MINUTE, seconds=60)
+
+
+@router.post("/contacts/bulk", response_model=schemas.ContactBulkResponse)
+async def bulk_contacts(request: schemas.ContactBulkRequest, db: Session = Depends(replicas.get_write_session),
+                        current_user: schemas.UserResponse = Depends(auth.get_current_user)):
+    """
+    Create, update and delete contacts of the current user in one transaction.
+
+    Items that cannot be applied (unknown IDs, duplicate emails) are reported
+    per item instead of failing the whole batch. The rate limit is charged one
+    token per item, ``CONTACTS_BULK_ITEMS_PER_MINUTE`` items per minute by default.
+
+    Args:
+        request (schemas.ContactBulkRequest): The operations to apply.
+        db (Session | AsyncSession): SQLAlchemy database session dependency.
+        current_user (schemas.UserResponse): Current authenticated user.
+
+    Returns:
+        schemas.ContactBulkResponse: The outcome of every item.
+
+    Raises:
+        HTTPException: 413 if the batch has more than ``CONTACTS_BULK_MAX_ITEMS`` items,
+            429 if the user's item budget is exhausted,
+            409 if a concurrent write made the batch conflict.
+    """
+    items = len(request.create) + len(request.update) + len(request.delete)
+    if items > CONTACTS_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {CONTACTS_BULK_MAX_ITEMS} items per bulk request")
+    await bulk_rate_limit.charge(current_user.id, max(items, 1))
+    try:
+        results = await call(crud.bulk_contacts, db, request=request, user_id=current_user.id)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="Bulk request conflicts with existing contacts")
+    return {"results": results}
+
+
+@router.post("/contacts/import", response_model=schemas.ImportReport,
+             dependencies=[Depends(RateLimiter("contacts:import", times=CONTACTS_BULK_RATE_LIMIT, seconds=60))])
+async def import_contacts(file: UploadFile = File(...),
+                          fmt: Optional[Literal["csv", "ndjson", "vcf"]] = Query(None, alias="format"),
+                          current_user: schemas.UserResponse = Depends(auth.get_current_user)):
+    """
+    Import contacts for the current user from an uploaded CSV, NDJSON or vCard file.
+
+    The upload is streamed through ``import_data.import_contacts`` in chunks on
+    a dedicated sync session, so PostgreSQL can load it with ``COPY`` in both
+    database modes.
+
+    Args:
+        file (UploadFile): The file to import.
+        fmt (str, optional): The input format; guessed from the file name if omitted.
+        current_user (schemas.UserResponse): Current authenticated user.
+
+    Returns:
+        schemas.ImportReport: Import totals and the first rejected rows.
+
+    Raises:
+        HTTPException: If the format cannot be determined.
+    """
+    if fmt is None:
+        try:
+            fmt = import_data.detect_format(file.filename or "")
+        except ValueError as error:
+            raise HTTPException(status_code=400, detail=str(error))
+    errors = []
+
+    def on_error(record):
+        if len(errors) < CONTACTS_IMPORT_ERROR_LIMIT:
+            errors.append(record)
+
+    def run_import():
+        db = SessionLocal()
+        stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+        try:
+            return import_data.import_contacts(db, stream, current_user.id, fmt, on_error=on_error)
+        finally:
+            stream.detach()
+            db.close()
+
+    try:
+        stats = await run_in_threadpool(run_import)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Import files must be UTF-8 encoded")
+    if stats.imported:
+        await replicas.record_write(current_user.id)
+    return dict(stats.as_dict(), errors=errors)
+
+
+@router.get("/contacts/export", response_class=StreamingResponse)
+async def export_contacts(request: Request, fmt: Literal["ndjson", "csv", "vcf"] = Query("ndjson", alias="format"),
+                          current_user: schemas.UserResponse = Depends(auth.get_current_user)):
+    """
+    Export all contacts of the current user as NDJSON, CSV or vCard.
+
+    Contacts are streamed from a server-side cursor and serialized as they are
+    read. The body is gzip-compressed when the client accepts it.
+
+    Args:
+        request (Request): The incoming request, used to negotiate compression.
+        fmt (str): The output format, "ndjson", "csv" or "vcf". Defaults to "ndjson".
+        current_user (schemas.UserResponse): Current authenticated user.
+
+    Returns:
+        StreamingResponse: The export as an attachment.
+    """
+    compress = "gzip" in request.headers.get("accept-encoding", "").lower()
+    stream = export_data.aiter_export if DB_ASYNC else export_data.iter_export
+    headers = {
+        "Content-Disposition": f'attachment; filename="contacts.{fmt}"',
+        "Vary": "Accept-Encoding",
+    }
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(stream(fmt, current_user.id, compress), media_type=export_data.MEDIA_TYPES[fmt],
+                             headers=headers)
 
 
 @router.put("/contacts/{contact_id}", response_model=schemas.Contact)
-def update_contact(contact_id: int, contact: schemas.ContactUpdate, db: Session = Depends(get_db),
-                   current_user: schemas.UserResponse = Depends(auth.get_current_user)):
+async def update_contact(contact_id: int, contact: schemas.ContactUpdate,
+                         db: Session = Depends(replicas.get_write_session),
+                         current_user: schemas.UserResponse = Depends(auth.get_current_user)):
     """
     Update an existing contact for the current user.
 
     Args:
         contact_id (int): ID of the contact to update.
         contact (schemas.ContactUpdate): Contact data to update.
-        db (Session): SQLAlchemy database session dependency.
+        db (Session | AsyncSession): SQLAlchemy database session dependency.
         current_user (schemas.UserResponse): Current authenticated user.
 
     Returns:
@@ -62,21 +317,58 @@ def update_contact(contact_id: int, contact: schemas.ContactUpdate, db: Session
     Raises:
         HTTPException: If the contact with the specified ID is not found.
     """
-    db_contact = crud.get_contact(db, contact_id=contact_id, user_id=current_user.id)
-    if not db_contact:
+    db_contact = await call(crud.update_contact, db, contact_id=contact_id, contact=contact, user_id=current_user.id)
+    if db_contact is None:
         raise HTTPException(status_code=404, detail="Contact not found")
-    return crud.update_contact(db=db, contact_id=contact_id, contact=contact, user_id=current_user.id)
+    return db_contact
+
+
+@router.patch("/contacts/{contact_id}", response_model=schemas.Contact)
+async def patch_contact(contact_id: int, contact: schemas.ContactPatch,
+                        db: Session = Depends(replicas.get_write_session),
+                        current_user: schemas.UserResponse = Depends(auth.get_current_user)):
+    """
+    Change some fields of an existing contact of the current user.
+
+    Only the fields present in the request body are written; if the contact
+    already has their values, nothing is written and its version is unchanged.
+
+    Args:
+        contact_id (int): ID of the contact to update.
+        contact (schemas.ContactPatch): The fields to change.
+        db (Session | AsyncSession): SQLAlchemy database session dependency.
+        current_user (schemas.UserResponse): Current authenticated user.
+
+    Returns:
+        schemas.Contact: The contact after the update.
+
+    Raises:
+        HTTPException: 422 if a required field is set to null, 404 if the contact is not found,
+            409 if the new email belongs to another contact.
+    """
+    nulls = [field for field, value in contact.dict(exclude_unset=True).items()
+             if value is None and field != "additional_info"]
+    if nulls:
+        raise HTTPException(status_code=422, detail=f"Fields cannot be null: {', '.join(nulls)}")
+    try:
+        db_contact = await call(crud.patch_contact, db, contact_id=contact_id, contact=contact,
+                                user_id=current_user.id)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="A contact with this email already exists")
+    if db_contact is None:
+        raise HTTPException(status_code=404, detail="Contact not found")
+    return db_contact
 
 
 @router.delete("/contacts/{contact_id}", response_model=schemas.Contact)
-def delete_contact(contact_id: int, db: Session = Depends(get_db),
+async def delete_contact(contact_id: int, db: Session = Depends(replicas.get_write_session),
                    current_user: schemas.UserResponse = Depends(auth.get_current_user)):
     """
     Delete an existing contact for the current user.
 
     Args:
         contact_id (int): ID of the contact to delete.
-        db (Session): SQLAlchemy database session dependency.
+        db (Session | AsyncSession): SQLAlchemy database session dependency.
         current_user (schemas.UserResponse): Current authenticated user.
 
     Returns:
@@ -85,40 +377,81 @@ def delete_contact(contact_id: int, db: Session = Depends(get_db),
     Raises:
         HTTPException: If the contact with the specified ID is not found.
     """
-    db_contact = crud.get_contact(db, contact_id=contact_id, user_id=current_user.id)
-    if not db_contact:
+    db_contact = await call(crud.delete_contact, db, contact_id=contact_id, user_id=current_user.id)
+    if db_contact is None:
         raise HTTPException(status_code=404, detail="Contact not found")
-    return crud.delete_contact(db=db, contact_id=contact_id, user_id=current_user.id)
+    return db_contact
 
 
 @router.get("/contacts/search", response_model=List[schemas.Contact])
-def search_contacts(query: str, db: Session = Depends(get_db),
-                    current_user: schemas.UserResponse = Depends(auth.get_current_user)):
+async def search_contacts(request: Request, query: str = Query(..., min_length=1), skip: int = 0,
+                          limit: int = Query(20, ge=1, le=100),
+                          prefix: bool = False, db: Session = Depends(replicas.get_read_session),
+                          current_user: schemas.UserResponse = Depends(auth.get_current_user)):
     """
     Search contacts for the current user based on a query string.
 
+    Results are served from the response cache until the user's contacts change,
+    and carry an ETag for conditional requests.
+
     Args:
+        request (Request): The incoming request, used for ``If-None-Match``.
         query (str): Search query string.
-        db (Session): SQLAlchemy database session dependency.
+        skip (int): Number of results to skip (default: 0).
+        limit (int): Maximum number of results to retrieve (default: 20).
+        prefix (bool): Only match names or emails starting with the query (default: False).
+        db (Session | AsyncSession): SQLAlchemy database session dependency.
         current_user (schemas.UserResponse): Current authenticated user.
 
     Returns:
-        List[schemas.Contact]: List of contacts matching the search query.
+        List[schemas.Contact]: List of contacts matching the search query, best matches first.
+
+    Raises:
+        HTTPException: 422 if the query is only whitespace.
     """
-    return crud.search_contacts(db, query=query, user_id=current_user.id)
+    if not query.strip():
+        raise HTTPException(status_code=422, detail="Search query must not be blank")
+    headers, not_modified = await _check_etag(request, db, current_user.id)
+    if not_modified:
+        return not_modified
+
+    async def load():
+        return _render_contacts(await call(crud.search_contacts, db, query=query, user_id=current_user.id,
+                                           skip=skip, limit=limit, prefix=prefix,
+                                           as_rows=serialization.FAST_JSON))
+
+    params = {"query": query, "skip": skip, "limit": limit, "prefix": prefix, "etag": headers["ETag"]}
+    return _json_response(await response_cache.cached(current_user.id, "search", params, load,
+                                                      ttl=response_cache.RESPONSE_CACHE_SEARCH_TTL), headers)
 
 
 @router.get("/contacts/upcoming-birthdays", response_model=List[schemas.Contact])
-def get_upcoming_birthdays(db: Session = Depends(get_db),
-                           current_user: schemas.UserResponse = Depends(auth.get_current_user)):
+async def get_upcoming_birthdays(request: Request, days: int = Query(7, ge=0, le=366),
+                                 db: Session = Depends(replicas.get_read_session),
+                                 current_user: schemas.UserResponse = Depends(auth.get_current_user)):
     """
     Retrieve contacts with upcoming birthdays for the current user.
 
+    Results are served from the response cache until the user's contacts change
+    or the date does, and carry an ETag for conditional requests.
+
     Args:
-        db (Session): SQLAlchemy database session dependency.
+        request (Request): The incoming request, used for ``If-None-Match``.
+        days (int): Number of days ahead to look, today included (default: 7).
+        db (Session | AsyncSession): SQLAlchemy database session dependency.
         current_user (schemas.UserResponse): Current authenticated user.
 
     Returns:
-        List[schemas.Contact]: List of contacts with upcoming birthdays.
+        List[schemas.Contact]: List of contacts with upcoming birthdays, soonest first.
     """
-    return crud.get_upcoming_birthdays(db, user_id=current_user.id)
+    today = date.today()
+    headers, not_modified = await _check_etag(request, db, current_user.id, today.isoformat())
+    if not_modified:
+        return not_modified
+
+    async def load():
+        return _render_contacts(await call(crud.get_upcoming_birthdays, db, user_id=current_user.id, days=days,
+                                           today=today, as_rows=serialization.FAST_JSON))
+
+    params = {"days": days, "today": today, "etag": headers["ETag"]}
+    return _json_response(await response_cache.cached(current_user.id, "upcoming-birthdays", params, load), headers)
@@ -1,53 +1,61 @@
 from datetime import timedelta
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from cloudinary.uploader import upload as cloudinary_upload
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status, UploadFile, File
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordRequestForm
-from .. import schemas, crud, auth
-from ..database import get_db
+from .. import schemas, crud, auth, avatars, hashing, outbox
+from ..async_crud import call
+from ..database import get_session
 
 router = APIRouter()
 
 @router.post("/register", response_model=schemas.UserResponse)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user: schemas.UserCreate, db: Session = Depends(get_session)):
     """
     Register a new user.
 
+    The password is hashed on the hashing executor. The verification email is
+    written to the outbox and delivered in the background, so registration does
+    not wait for (or fail with) the SMTP server.
+
     Args:
         user (schemas.UserCreate): User registration data.
-        db (Session): SQLAlchemy database session dependency.
+        db (Session | AsyncSession): SQLAlchemy database session dependency.
 
     Returns:
         schemas.UserResponse: Details of the registered user.
 
     Raises:
-        HTTPException: If the email is already registered.
+        HTTPException: If the email is already registered, or 503 if the hashing queue is full.
     """
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await call(crud.get_user_by_email, db, email=user.email)
     if db_user:
         raise HTTPException(status_code=409, detail="Email already registered")
-    db_user = crud.create_user(db=db, user=user)
+    hashed_password = await hashing.hash_password(user.password)
     token = auth.generate_verification_token(user.email)
     verification_url = f"http://0.0.0.0:8000/api/verify-email?token={token}"
-    auth.send_email(user.email, "Verify your email", f"Please verify your email: {verification_url}")
+    # Committed with the user: a registered user always has the email queued
+    db_user = await call(crud.create_user, db, user=user, hashed_password=hashed_password,
+                         verification_email=("Verify your email", f"Please verify your email: {verification_url}"))
+    outbox.dispatcher.notify()
     return db_user
 
 @router.post("/token", response_model=schemas.Token)
-def login_for_access_token(db: Session = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()):
+async def login_for_access_token(db: Session = Depends(get_session), form_data: OAuth2PasswordRequestForm = Depends()):
     """
     Get an access token for authentication.
 
     Args:
-        db (Session): SQLAlchemy database session dependency.
+        db (Session | AsyncSession): SQLAlchemy database session dependency.
         form_data (OAuth2PasswordRequestForm): Form data containing username (email) and password.
 
     Returns:
         schemas.Token: Access token details.
 
     Raises:
-        HTTPException: If credentials are incorrect or email is not verified.
+        HTTPException: If credentials are incorrect or email is not verified, or 503
+            if the hashing queue is full.
     """
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+    user = await auth.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -83,13 +91,13 @@ def read_users_me(current_user: schemas.UserResponse = Depends(auth.get_current_
     return current_user
 
 @router.get("/verify-email")
-def verify_email(token: str, db: Session = Depends(get_db)):
+async def verify_email(token: str, db: Session = Depends(get_session)):
     """
     Verify user email using a verification token.
 
     Args:
         token (str): Verification token sent to the user.
-        db (Session): SQLAlchemy database session dependency.
+        db (Session | AsyncSession): SQLAlchemy database session dependency.
 
     Returns:
         dict: Confirmation message upon successful email verification.
@@ -98,32 +106,58 @@ def verify_email(token: str, db: Session = Depends(get_db)):
         HTTPException: If user is not found.
     """
     email = auth.verify_verification_token(token)
-    user = crud.verify_user_email(db, email=email)
+    user = await call(crud.verify_user_email, db, email=email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "Email verified successfully"}
 
-@router.post("/upload-avatar", response_model=schemas.UserResponse)
-def upload_avatar(
+@router.post("/upload-avatar", response_model=schemas.AvatarJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def upload_avatar(
+        request: Request,
+        response: Response,
         avatar: UploadFile = File(...),
         current_user: schemas.UserResponse = Depends(auth.get_current_user),
-        db: Session = Depends(get_db)
 ):
     """
     Upload a user avatar.
 
+    The file is spooled to disk, then resized into WebP and JPEG variants and
+    stored in the background (see ``app.avatars``); the user's ``avatar_url``
+    changes once the job is done.
+
     Args:
+        request (Request): The request, to build the Location of the job.
+        response (Response): Carries the Location header of the job.
         avatar (UploadFile): Uploaded avatar file.
         current_user (schemas.UserResponse): Current authenticated user details.
-        db (Session): SQLAlchemy database session dependency.
 
     Returns:
-        schemas.UserResponse: Updated user details with avatar URL.
+        schemas.AvatarJobResponse: The queued upload job.
+
+    Raises:
+        HTTPException: 413 if the file is too large, 503 if the upload queue is full.
     """
-    upload_result = cloudinary_upload(avatar.file)  # Assuming avatar.file is directly passed to cloudinary_upload
-    updated_user = crud.update_user_avatar(
-        db=db,
-        user_id=current_user.id,
-        avatar_url=upload_result['secure_url']  # Assuming secure_url field contains the avatar URL
-    )
-    return updated_user
+    path = await avatars.spool(avatar)
+    job = avatars.uploader.submit(current_user.id, path)
+    response.headers["Location"] = f"{request.url.path}/{job.id}"
+    return job
+
+@router.get("/upload-avatar/{job_id}", response_model=schemas.AvatarJobResponse)
+async def get_avatar_job(job_id: str, current_user: schemas.UserResponse = Depends(auth.get_current_user)):
+    """
+    Report on a background avatar upload.
+
+    Args:
+        job_id (str): The ID returned by ``upload_avatar``.
+        current_user (schemas.UserResponse): Current authenticated user details.
+
+    Returns:
+        schemas.AvatarJobResponse: The upload job.
+
+    Raises:
+        HTTPException: 404 if the job is unknown to this worker or belongs to another user.
+    """
+    job = avatars.uploader.get(job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return job
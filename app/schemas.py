@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
-from datetime import date
+from typing import List, Optional
+from datetime import date, datetime
 
 # Contacts
 class ContactBase(BaseModel):
@@ -40,20 +40,126 @@ class ContactUpdate(ContactBase):
     """
     pass
 
+class ContactPatch(BaseModel):
+    """
+    Schema for a partial update of a contact.
+
+    Only the fields present in the request are changed; ``additional_info``
+    is the only field that may be set to null.
+
+    Attributes:
+        first_name (str, optional): The first name of the contact.
+        last_name (str, optional): The last name of the contact.
+        email (EmailStr, optional): The email address of the contact.
+        phone (str, optional): The phone number of the contact.
+        birthday (date, optional): The birthday of the contact.
+        additional_info (str, optional): Additional information about the contact.
+    """
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    email: Optional[EmailStr] = None
+    phone: Optional[str] = None
+    birthday: Optional[date] = None
+    additional_info: Optional[str] = None
+
 class Contact(ContactBase):
     """
     Schema representing a contact including its ID.
 
-    Inherits attributes from ContactBase and adds an 'id' attribute.
+    Inherits attributes from ContactBase and adds 'id' and 'updated_at' attributes.
 
     Attributes:
         id (int): The unique identifier of the contact.
+        updated_at (datetime, optional): When the contact was last modified (UTC).
     """
     id: int
+    updated_at: Optional[datetime] = None
 
     class Config:
         orm_mode = True  # Used for compatibility with ORM models
 
+class ContactBulkUpdate(ContactUpdate):
+    """
+    Schema for one update in a bulk contact request.
+
+    Inherits attributes from ContactUpdate and adds the ID of the contact to update.
+
+    Attributes:
+        id (int): The unique identifier of the contact.
+    """
+    id: int
+
+class ContactBulkRequest(BaseModel):
+    """
+    Schema for a bulk contact request, applied in a single transaction.
+
+    Deletes run first, then updates, then creates.
+
+    Attributes:
+        create (List[ContactCreate]): Contacts to create.
+        update (List[ContactBulkUpdate]): Contacts to update.
+        delete (List[int]): IDs of contacts to delete.
+    """
+    create: List[ContactCreate] = []
+    update: List[ContactBulkUpdate] = []
+    delete: List[int] = []
+
+class BulkItemResult(BaseModel):
+    """
+    Schema for the outcome of one item of a bulk contact request.
+
+    Attributes:
+        op (str): The operation: "create", "update" or "delete".
+        index (int): The position of the item in its operation list.
+        status (str): "created", "updated", "deleted", "conflict" or "not_found".
+        id (int, optional): The ID of the affected contact, if any.
+    """
+    op: str
+    index: int
+    status: str
+    id: Optional[int] = None
+
+class ContactBulkResponse(BaseModel):
+    """
+    Schema for the response to a bulk contact request.
+
+    Attributes:
+        results (List[BulkItemResult]): Per-item outcomes, deletes first, then updates, then creates.
+    """
+    results: List[BulkItemResult]
+
+class ContactChanges(BaseModel):
+    """
+    Schema for the contacts changed since a contacts version.
+
+    Attributes:
+        version (int): The current contacts version; pass it as ``since`` on the next sync.
+        updated (List[Contact]): Contacts created or modified since the requested version.
+        deleted (List[int]): IDs of contacts deleted since the requested version.
+    """
+    version: int
+    updated: List[Contact]
+    deleted: List[int]
+
+class ImportReport(BaseModel):
+    """
+    Schema for the outcome of a contact import.
+
+    Attributes:
+        rows_read (int): Rows parsed from the file.
+        imported (int): Contacts created.
+        skipped (int): Valid rows skipped because their email already exists.
+        rejected (int): Rows that failed validation.
+        elapsed (float): Seconds spent importing.
+        errors (List[dict]): The first rejected rows with their validation errors.
+    """
+    rows_read: int
+    imported: int
+    skipped: int
+    rejected: int
+    elapsed: float
+    errors: List[dict] = []
+
 # Users
 class UserCreate(BaseModel):
     """
@@ -106,6 +212,39 @@ class UserResponse(UserBase):
     class Config:
         alias_generator = "from_attributes"  # Configure alias generation for attribute names
 
+class CachedUser(BaseModel):
+    """
+    Slim snapshot of a user kept by the verified-token cache.
+
+    Holds only the columns needed by the routes that depend on
+    ``auth.get_current_user``.
+
+    Attributes:
+        id (int): The unique identifier of the user.
+        email (str): The email address of the user.
+        is_verified (bool, optional): Indicates if the user's email has been verified.
+        avatar_url (str, optional): URL of the user's avatar image.
+    """
+    id: int
+    email: str
+    is_verified: Optional[bool] = False
+    avatar_url: Optional[str] = None
+
+class AvatarJobResponse(BaseModel):
+    """
+    Schema for reporting on a background avatar upload.
+
+    Attributes:
+        id (str): The job ID.
+        status (str): "pending", "running", "done" or "failed".
+        avatar_url (str, optional): The stored avatar, once done.
+        error (str, optional): Why the upload failed.
+    """
+    id: str
+    status: str
+    avatar_url: Optional[str] = None
+    error: Optional[str] = None
+
 # Tokens
 class Token(BaseModel):
     """
@@ -0,0 +1,64 @@
+"""
+Fast JSON rendering for contact responses.
+
+By default the contact routes hand ORM objects to FastAPI, which validates
+every row against ``schemas.Contact`` (including the ``EmailStr`` check) and
+encodes the result with the standard library. With ``FAST_JSON=1`` the routes
+select plain rows instead (see ``crud.contact_rows_query``) and render them
+here directly, with orjson when it is installed. The output is the same JSON
+document and the routes keep their ``response_model``, so the OpenAPI schema
+does not change; the rows are trusted because they were validated on write.
+"""
+
+import json
+import os
+from datetime import date, datetime
+
+from dotenv import load_dotenv
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the fast path falls back to the json module
+    orjson = None
+
+load_dotenv()
+
+FAST_JSON = os.getenv("FAST_JSON", "0") == "1"
+
+
+def _default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> str:
+    """
+    Render plain data (dicts, lists, strings, numbers, dates) as compact JSON.
+
+    Args:
+        content: The data to render.
+
+    Returns:
+        str: The JSON document, identical to what FastAPI renders for the same data.
+    """
+    if orjson is not None:
+        return orjson.dumps(content).decode()
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_default)
+
+
+def json_response(content, headers: dict = None) -> Response:
+    """
+    Build a JSON response from plain data without response-model validation.
+
+    Args:
+        content: The data to render.
+        headers (dict, optional): Headers to send.
+
+    Returns:
+        Response: An ``ORJSONResponse`` when orjson is installed, otherwise a ``JSONResponse``.
+    """
+    if orjson is not None:
+        return ORJSONResponse(content, headers=headers)
+    return Response(content=dumps(content), media_type=JSONResponse.media_type, headers=headers)
@@ -0,0 +1,171 @@
+"""
+Production server.
+
+Runs the application under uvicorn's process supervisor::
+
+    python -m app.server [--workers N] [--host HOST] [--port PORT]
+
+* Workers: ``WEB_CONCURRENCY`` processes, by default one per CPU this
+  process may use (CPU affinity and the cgroup CPU quota of a container are
+  respected). Each runs its own event loop on uvloop and parses HTTP with
+  httptools, both installed by ``uvicorn[standard]``.
+* Preload: the application is imported once by the supervisor before any
+  worker starts, so a release that cannot import fails before it replaces
+  running workers. Missing tables are created there too (``DB_CREATE_ALL``),
+  not by every worker at once. Workers are spawned, not forked, and import
+  the application again.
+* Graceful reload: ``SIGHUP`` replaces the workers one at a time; each new
+  worker must be up before the old one is stopped. ``SIGTERM`` stops
+  accepting connections and gives in-flight requests
+  ``SERVER_GRACEFUL_TIMEOUT`` seconds to finish.
+* Budgets: ``SERVER_DB_CONNECTIONS`` and ``SERVER_REDIS_CONNECTIONS`` are the
+  connections the whole server may open to each database and to Redis. Every
+  worker gets an equal share, split between the engines it opens to each
+  database (the sync one, and the async one with ``DB_ASYNC=1``) as their
+  ``DB_POOL_SIZE`` without overflow, and as its ``REDIS_MAX_CONNECTIONS``.
+  Unset, the per-worker settings apply as they are.
+
+The threadpool running sync routes and database calls holds
+``THREADPOOL_SIZE`` threads per worker (see ``app.main``).
+
+``--reload`` restarts a single worker on code changes, for development.
+"""
+
+import argparse
+import logging
+import math
+import os
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+APP = "app.main:app"
+
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+# Worker processes; unset or 0 sizes them to the available CPUs
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0"))
+# Seconds in-flight requests get to finish on shutdown and reload
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))
+SERVER_KEEPALIVE = int(os.getenv("SERVER_KEEPALIVE", "5"))
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", "2048"))
+# Connections all workers together may open to each database server and to Redis; 0 keeps the per-worker settings
+SERVER_DB_CONNECTIONS = int(os.getenv("SERVER_DB_CONNECTIONS", "0"))
+SERVER_REDIS_CONNECTIONS = int(os.getenv("SERVER_REDIS_CONNECTIONS", "0"))
+# Workers open a sync engine to each database, and an async one too with DB_ASYNC=1
+DB_ENGINES = 2 if os.getenv("DB_ASYNC", "0") == "1" else 1
+
+
+def _cgroup_cpu_quota() -> Optional[float]:
+    # cgroup v2, then v1; None when the CPU time is not limited
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as file:
+            quota, period = file.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as file:
+            quota = int(file.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as file:
+            period = int(file.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus() -> int:
+    """
+    Count the CPUs this process may run on, capped by the container's CPU quota.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, math.ceil(quota))
+    return max(cpus, 1)
+
+
+def worker_settings(workers: int, db_connections: int = SERVER_DB_CONNECTIONS,
+                    redis_connections: int = SERVER_REDIS_CONNECTIONS, db_engines: int = DB_ENGINES) -> Dict[str, str]:
+    """
+    Derive the per-worker pool settings from the server-wide connection budgets.
+
+    Args:
+        workers (int): The number of worker processes.
+        db_connections (int, optional): Connections all workers may open to each database; 0 for no budget.
+        redis_connections (int, optional): Connections all workers may open to Redis; 0 for no budget.
+        db_engines (int, optional): Engines every worker opens to each database, each with its own pool.
+
+    Raises:
+        ValueError: If a budget leaves less than one connection per pool.
+
+    Returns:
+        Dict[str, str]: Environment variables to start every worker with.
+    """
+    settings = {}
+    if db_connections:
+        pools = workers * db_engines
+        if db_connections < pools:
+            raise ValueError(f"SERVER_DB_CONNECTIONS={db_connections} is less than one connection for each of "
+                             f"the {pools} database pools")
+        settings.update(DB_POOL_SIZE=str(db_connections // pools), DB_MAX_OVERFLOW="0")
+    if redis_connections:
+        if redis_connections < workers:
+            raise ValueError(f"SERVER_REDIS_CONNECTIONS={redis_connections} is less than one connection per worker")
+        settings["REDIS_MAX_CONNECTIONS"] = str(redis_connections // workers)
+    return settings
+
+
+def run(workers: int = 0, host: str = SERVER_HOST, port: int = SERVER_PORT, reload: bool = False):
+    """
+    Serve the application until the supervisor is stopped.
+
+    Args:
+        workers (int, optional): Worker processes; 0 sizes them with ``WEB_CONCURRENCY`` or the available CPUs.
+        host (str, optional): The interface to bind.
+        port (int, optional): The port to bind.
+        reload (bool, optional): Restart a single worker when the code changes.
+    """
+    import uvicorn
+
+    workers = 1 if reload else workers or WEB_CONCURRENCY or available_cpus()
+    # Workers read their settings at import time, from the environment they inherit
+    settings = worker_settings(workers)
+    os.environ.update(settings)
+    if not reload:
+        # Preload: fail here, before any worker is started
+        from app import database, main, models
+
+        if main.DB_CREATE_ALL:
+            # Once, instead of racing in every worker's startup
+            models.Base.metadata.create_all(bind=database.engine)
+            database.engine.dispose()
+            os.environ["DB_CREATE_ALL"] = "0"
+    logger.info("Starting %d worker(s) on %s:%d %s", workers, host, port,
+                " ".join(f"{name}={value}" for name, value in settings.items()))
+    uvicorn.run(APP, host=host, port=port, workers=workers, reload=reload, loop="auto", http="auto",
+                backlog=SERVER_BACKLOG, timeout_keep_alive=SERVER_KEEPALIVE,
+                timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Worker processes. Defaults to WEB_CONCURRENCY, or one per available CPU.")
+    parser.add_argument("--host", default=SERVER_HOST, help="Interface to bind.")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="Port to bind.")
+    parser.add_argument("--reload", action="store_true", help="Restart one worker on code changes (development).")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    run(args.workers, args.host, args.port, args.reload)
+
+
+if __name__ == "__main__":
+    main()
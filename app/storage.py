@@ -0,0 +1,262 @@
+"""
+File storage backends.
+
+Uploaded files are stored through a ``Storage`` backend selected with
+``STORAGE_BACKEND``:
+
+* ``cloudinary`` (default): Cloudinary, configured by ``CLOUDINARY_URL``.
+* ``local``: a directory on this host (``LOCAL_STORAGE_DIR``), served by the
+  application under ``LOCAL_STORAGE_URL``. Needs no network access, which
+  makes it the backend for development and benchmarks.
+* ``s3``: an S3-compatible object store (``S3_BUCKET``, ``S3_ENDPOINT_URL``
+  for MinIO and others, ``S3_PUBLIC_URL`` for a CDN in front of the bucket).
+  Requires boto3.
+
+Stored files are never overwritten with different content (their keys are
+content hashes), so they are served with ``IMMUTABLE_CACHE_CONTROL``.
+
+Backends are blocking and are called from background threads; the client
+libraries are imported on first use.
+"""
+
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from dotenv import load_dotenv
+from starlette.staticfiles import StaticFiles
+
+load_dotenv()
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "cloudinary")
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", "media")
+LOCAL_STORAGE_URL = os.getenv("LOCAL_STORAGE_URL", "/media").rstrip("/")
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+S3_REGION = os.getenv("S3_REGION")
+S3_PUBLIC_URL = os.getenv("S3_PUBLIC_URL")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Local files are served from the application's origin: never sniffed as another type, and rendered
+# without scripts or same-origin access should one not be an image
+MEDIA_SECURITY_HEADERS = {
+    "X-Content-Type-Options": "nosniff",
+    "Content-Security-Policy": "default-src 'none'; sandbox",
+}
+
+
+class Storage(ABC):
+    """
+    A place to put files that are then served from a public URL.
+    """
+
+    name = "storage"
+
+    @abstractmethod
+    def save(self, path: str, key: str, content_type: Optional[str] = None,
+             cache_control: Optional[str] = None) -> str:
+        """
+        Store a file.
+
+        Args:
+            path (str): The local file to store.
+            key (str): The name to store it under, e.g. ``avatars/<sha256>/256.webp``.
+            content_type (str, optional): The MIME type of the file.
+            cache_control (str, optional): The Cache-Control header to serve it with,
+                where the backend supports setting it.
+
+        Returns:
+            str: The URL the file is served from.
+        """
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """
+        Check whether a file is stored under ``key``.
+        """
+
+    @abstractmethod
+    def url(self, key: str) -> str:
+        """
+        Return the URL the file stored under ``key`` is served from.
+        """
+
+
+class LocalStorage(Storage):
+    """
+    Store files in a local directory.
+
+    Args:
+        directory (str): The root directory of the stored files.
+        base_url (str): The URL prefix the directory is served under.
+    """
+
+    name = "local"
+
+    def __init__(self, directory: str = LOCAL_STORAGE_DIR, base_url: str = LOCAL_STORAGE_URL):
+        self.directory = directory
+        self.base_url = base_url
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, *key.split("/"))
+
+    def save(self, path: str, key: str, content_type: Optional[str] = None,
+             cache_control: Optional[str] = None) -> str:
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Copy next to the target and rename, so a file is never served half-written
+        fd, partial = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".partial-")
+        try:
+            with os.fdopen(fd, "wb") as destination, open(path, "rb") as source:
+                shutil.copyfileobj(source, destination)
+            os.replace(partial, target)
+        except BaseException:
+            if os.path.exists(partial):
+                os.unlink(partial)
+            raise
+        return self.url(key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+
+class CloudinaryStorage(Storage):
+    """
+    Store files on Cloudinary, which serves them from its CDN.
+
+    Files are uploaded as raw resources: they are already processed, and the
+    extension stays part of the public ID, so variants differing only in
+    format do not collide.
+
+    ``exists`` asks the public delivery URL rather than the rate-limited Admin
+    API, and uploads never overwrite: a key that was stored already keeps its
+    (identical) content.
+    """
+
+    name = "cloudinary"
+
+    def save(self, path: str, key: str, content_type: Optional[str] = None,
+             cache_control: Optional[str] = None) -> str:
+        from cloudinary.uploader import upload
+
+        result = upload(path, public_id=key, overwrite=False, resource_type="raw")
+        return result["secure_url"]
+
+    def exists(self, key: str) -> bool:
+        from urllib.error import HTTPError
+        from urllib.request import Request, urlopen
+
+        try:
+            with urlopen(Request(self.url(key), method="HEAD"), timeout=10):
+                return True
+        except HTTPError as error:
+            if error.code == 404:
+                return False
+            raise
+
+    def url(self, key: str) -> str:
+        from cloudinary.utils import cloudinary_url
+
+        return cloudinary_url(key, resource_type="raw", secure=True)[0]
+
+
+class S3Storage(Storage):
+    """
+    Store files in an S3-compatible bucket.
+
+    Args:
+        bucket (str): The bucket name.
+        endpoint_url (str, optional): The endpoint of a non-AWS store such as MinIO.
+        region (str, optional): The bucket region.
+        public_url (str, optional): The URL prefix objects are served under.
+            Defaults to ``<endpoint>/<bucket>``, or the AWS virtual-hosted URL.
+    """
+
+    name = "s3"
+
+    def __init__(self, bucket: Optional[str] = S3_BUCKET, endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+                 region: Optional[str] = S3_REGION, public_url: Optional[str] = S3_PUBLIC_URL):
+        if not bucket:
+            raise ValueError("S3_BUCKET must be set to store files in S3")
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.region = region
+        if public_url:
+            self.public_url = public_url.rstrip("/")
+        elif endpoint_url:
+            self.public_url = f"{endpoint_url.rstrip('/')}/{bucket}"
+        else:
+            self.public_url = f"https://{bucket}.s3.amazonaws.com"
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+
+            self._client = boto3.client("s3", endpoint_url=self.endpoint_url, region_name=self.region)
+        return self._client
+
+    def save(self, path: str, key: str, content_type: Optional[str] = None,
+             cache_control: Optional[str] = None) -> str:
+        extra_args = {}
+        if content_type:
+            extra_args["ContentType"] = content_type
+        if cache_control:
+            extra_args["CacheControl"] = cache_control
+        self.client.upload_file(path, self.bucket, key, ExtraArgs=extra_args)
+        return self.url(key)
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as error:
+            if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def url(self, key: str) -> str:
+        return f"{self.public_url}/{key}"
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """
+    ``StaticFiles`` serving the local backend's files with ``IMMUTABLE_CACHE_CONTROL``
+    and ``MEDIA_SECURITY_HEADERS``.
+    """
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        response.headers.update(MEDIA_SECURITY_HEADERS)
+        return response
+
+
+_BACKENDS = {backend.name: backend for backend in (LocalStorage, CloudinaryStorage, S3Storage)}
+_storage: Optional[Storage] = None
+
+
+def get_storage() -> Storage:
+    """
+    Return the configured storage backend, creating it on first use.
+
+    Raises:
+        ValueError: If ``STORAGE_BACKEND`` names no known backend.
+
+    Returns:
+        Storage: The backend selected by ``STORAGE_BACKEND``.
+    """
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND not in _BACKENDS:
+            raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}', expected one of {sorted(_BACKENDS)}")
+        _storage = _BACKENDS[STORAGE_BACKEND]()
+    return _storage
@@ -0,0 +1,339 @@
+"""
+Verified-token cache.
+
+This module keeps the decoded claims of bearer tokens and a slim snapshot of
+their users in a bounded in-process LRU, optionally backed by a shared Redis
+tier, so repeated requests with the same token skip ``jwt.decode`` and the
+user lookup in ``auth.get_current_user``.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+
+from app.schemas import CachedUser
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TOKEN_CACHE_ENABLED = os.getenv("TOKEN_CACHE_ENABLED", "1") == "1"
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+TOKEN_CACHE_USER_TTL = int(os.getenv("TOKEN_CACHE_USER_TTL", "300"))
+TOKEN_CACHE_REDIS_URL = os.getenv("TOKEN_CACHE_REDIS_URL")
+
+_CLAIMS_PREFIX = "token-cache:claims:"
+_USER_PREFIX = "token-cache:user:"
+
+
+class ExpiringLRU:
+    """
+    Thread-safe LRU mapping whose entries expire at an absolute timestamp.
+
+    Args:
+        max_entries (int): The maximum number of entries kept before the least
+            recently used one is evicted.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the value stored under a key, or None if it is missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= now:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at: float):
+        """
+        Store a value until ``expires_at``, evicting the oldest entries if needed.
+        """
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        """
+        Remove a key if present.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TokenCache:
+    """
+    Two-tier cache of verified tokens and the users they belong to.
+
+    Claims are stored per token (keyed by a SHA-256 digest, never the raw token)
+    until the token's ``exp``. User snapshots are stored per email so that
+    ``invalidate_user`` can drop them when the user row changes; they live until
+    the token expires or ``user_ttl`` seconds pass, whichever comes first, which
+    bounds staleness in other workers that did not see the invalidation.
+
+    Args:
+        max_entries (int): Capacity of each in-process LRU.
+        user_ttl (int): Upper bound in seconds on how long a user snapshot is kept.
+        redis_url (str, optional): URL of the shared Redis tier. Disabled if None.
+    """
+
+    def __init__(self, max_entries: int, user_ttl: int, redis_url: Optional[str] = None):
+        self.user_ttl = user_ttl
+        self.redis_url = redis_url
+        self._claims = ExpiringLRU(max_entries)
+        self._users = ExpiringLRU(max_entries)
+        self._redis = None
+
+    @staticmethod
+    def _token_key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @property
+    def shared(self):
+        """
+        The Redis client of the shared tier, created on first use, or None.
+        """
+        if self._redis is None and self.redis_url:
+            import redis
+
+            self._redis = redis.Redis.from_url(self.redis_url)
+        return self._redis
+
+    def get_local(self, token: str) -> Tuple[Optional[Tuple[str, int]], Optional[CachedUser]]:
+        """
+        Look a token up in the in-process tier only.
+
+        Args:
+            token (str): The bearer token.
+
+        Returns:
+            tuple: The token's ``(subject, exp)`` claims and the cached user
+            snapshot, each None on a miss.
+        """
+        claims = self._claims.get(self._token_key(token))
+        if claims is None:
+            return None, None
+        return claims, self._users.get(claims[0])
+
+    def get_shared(self, token: str) -> Tuple[Optional[Tuple[str, int]], Optional[CachedUser]]:
+        """
+        Look a token up in the Redis tier and promote hits to the local tier.
+
+        Args:
+            token (str): The bearer token.
+
+        Returns:
+            tuple: The token's ``(subject, exp)`` claims and user snapshot, each
+            None on a miss.
+        """
+        key = self._token_key(token)
+        try:
+            raw_claims = self.shared.get(_CLAIMS_PREFIX + key)
+            if raw_claims is None:
+                return None, None
+            payload = json.loads(raw_claims)
+            email, exp = payload["sub"], payload["exp"]
+            self._claims.set(key, (email, exp), exp)
+            raw_user = self.shared.get(_USER_PREFIX + email)
+        except Exception:
+            logger.warning("Token cache: shared tier lookup failed", exc_info=True)
+            return None, None
+        if raw_user is None:
+            return (email, exp), None
+        user = CachedUser.parse_raw(raw_user)
+        self._users.set(email, user, min(exp, time.time() + self.user_ttl))
+        return (email, exp), user
+
+    async def lookup(self, token: str) -> Tuple[Optional[Tuple[str, int]], Optional[CachedUser]]:
+        """
+        Look a token up in the local tier, then in the shared tier on a miss.
+
+        The shared tier is queried from the threadpool so a slow Redis never
+        blocks the event loop.
+
+        Args:
+            token (str): The bearer token.
+
+        Returns:
+            tuple: The token's ``(subject, exp)`` claims and user snapshot, each
+            None on a miss.
+        """
+        claims, user = self.get_local(token)
+        if user is None and self.redis_url:
+            shared_claims, user = await run_in_threadpool(self.get_shared, token)
+            claims = claims or shared_claims
+        return claims, user
+
+    def _share_claims(self, key: str, email: str, exp: int):
+        ttl = int(exp - time.time())
+        if ttl > 0:
+            try:
+                self.shared.set(_CLAIMS_PREFIX + key, json.dumps({"sub": email, "exp": exp}), ex=ttl)
+            except Exception:
+                logger.warning("Token cache: shared tier write failed", exc_info=True)
+
+    def _share_user(self, snapshot: CachedUser, expires_at: float):
+        ttl = int(expires_at - time.time())
+        if ttl > 0:
+            try:
+                self.shared.set(_USER_PREFIX + snapshot.email, snapshot.json(), ex=ttl)
+            except Exception:
+                logger.warning("Token cache: shared tier write failed", exc_info=True)
+
+    def _store_user_locally(self, user, exp: int) -> Tuple[CachedUser, float]:
+        snapshot = CachedUser(id=user.id, email=user.email, is_verified=user.is_verified, avatar_url=user.avatar_url)
+        expires_at = min(exp, time.time() + self.user_ttl)
+        self._users.set(snapshot.email, snapshot, expires_at)
+        return snapshot, expires_at
+
+    def store_claims(self, token: str, email: str, exp: int):
+        """
+        Cache the verified subject of a token until its expiry.
+
+        Args:
+            token (str): The bearer token.
+            email (str): The token's subject.
+            exp (int): The token's expiry as a UNIX timestamp.
+        """
+        key = self._token_key(token)
+        self._claims.set(key, (email, exp), exp)
+        if self.redis_url:
+            self._share_claims(key, email, exp)
+
+    async def astore_claims(self, token: str, email: str, exp: int):
+        """
+        Cache the verified subject of a token from async code.
+
+        Like ``store_claims``, but the shared tier is written from the
+        threadpool so Redis never blocks the event loop.
+
+        Args:
+            token (str): The bearer token.
+            email (str): The token's subject.
+            exp (int): The token's expiry as a UNIX timestamp.
+        """
+        key = self._token_key(token)
+        self._claims.set(key, (email, exp), exp)
+        if self.redis_url:
+            await run_in_threadpool(self._share_claims, key, email, exp)
+
+    def store_user(self, user, exp: int) -> CachedUser:
+        """
+        Cache a snapshot of a user for a token expiring at ``exp``.
+
+        Args:
+            user (User): The ORM user object.
+            exp (int): The expiry of the token that resolved to this user.
+
+        Returns:
+            CachedUser: The cached snapshot.
+        """
+        snapshot, expires_at = self._store_user_locally(user, exp)
+        if self.redis_url:
+            self._share_user(snapshot, expires_at)
+        return snapshot
+
+    async def astore_user(self, user, exp: int) -> CachedUser:
+        """
+        Cache a snapshot of a user from async code.
+
+        Like ``store_user``, but the shared tier is written from the threadpool
+        so Redis never blocks the event loop.
+
+        Args:
+            user (User): The ORM user object.
+            exp (int): The expiry of the token that resolved to this user.
+
+        Returns:
+            CachedUser: The cached snapshot.
+        """
+        snapshot, expires_at = self._store_user_locally(user, exp)
+        if self.redis_url:
+            await run_in_threadpool(self._share_user, snapshot, expires_at)
+        return snapshot
+
+    def invalidate_user(self, email: str):
+        """
+        Drop the cached snapshot of a user from both tiers.
+
+        Call this whenever a column copied into ``CachedUser`` changes.
+
+        Args:
+            email (str): The email address of the user.
+        """
+        self._users.pop(email)
+        if self.redis_url:
+            try:
+                self.shared.delete(_USER_PREFIX + email)
+            except Exception:
+                logger.warning("Token cache: shared tier invalidation failed", exc_info=True)
+
+    def clear(self):
+        """
+        Drop every entry from the local tier.
+        """
+        self._claims.clear()
+        self._users.clear()
+
+
+cache = TokenCache(TOKEN_CACHE_MAX_ENTRIES, TOKEN_CACHE_USER_TTL, TOKEN_CACHE_REDIS_URL)
+
+
+def invalidate_user(email: str):
+    """
+    Drop the cached snapshot of a user, if the token cache is enabled.
+
+    Args:
+        email (str): The email address of the user.
+    """
+    if TOKEN_CACHE_ENABLED:
+        cache.invalidate_user(email)
+
+
+async def ainvalidate_user(email: str):
+    """
+    Drop the cached snapshot of a user from async code.
+
+    The shared tier is updated from the threadpool so Redis never blocks the
+    event loop.
+
+    Args:
+        email (str): The email address of the user.
+    """
+    if not TOKEN_CACHE_ENABLED:
+        return
+    if cache.redis_url:
+        await run_in_threadpool(cache.invalidate_user, email)
+    else:
+        cache.invalidate_user(email)
@@ -0,0 +1,473 @@
+"""
+Load benchmark of the contacts API.
+
+Seeds ``--users`` users with ``--contacts`` contacts each (users in one
+executemany INSERT, contacts through ``POST /api/contacts/bulk``), then drives
+each scenario with ``--concurrency`` concurrent clients against the app
+in-process over ASGI, so it needs nothing but the database: SQLite by
+default, or a local PostgreSQL with ``--database-url``. Rate limiting, the
+email outbox and Redis are disabled, and avatars go to the local storage
+backend in a temporary directory.
+
+For every scenario it reports p50/p95/p99 latency, successful requests per
+second, failed requests and SQL statements per request, and the cold start of a fresh worker process:
+the import of ``app.main``, its startup handler and the first successful
+``/ready``, the median of ``--cold-starts`` runs. The results are written as
+JSON.
+
+On PostgreSQL a new database gets its contacts table hash-partitioned by
+owner into ``--contact-partitions`` partitions; compare the list and search
+scenarios of a run with ``--contact-partitions 0`` (one table) against one
+with partitions, each against a fresh database. Pass an earlier
+result file with ``--compare`` to flag regressions between commits, any
+new failed request included; the command then exits with status 1.
+
+Usage:
+    python -m benchmarks.load --users 20 --contacts 500 --requests 500 --concurrency 16
+    python -m benchmarks.load --compare benchmarks/results/load-<commit>.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+SCENARIOS = ("token", "list", "search", "birthdays", "create", "update", "avatar")
+PASSWORD = "benchmark-password"
+
+# Compared between runs: (metric, True if higher is better)
+COMPARED_METRICS = (("p95_ms", False), ("rps", True))
+COLD_START_METRICS = ("import_ms", "startup_ms", "ready_ms", "total_ms")
+COMPARED_COLD_START_METRIC = "total_ms"
+
+
+def configure_environment(args):
+    """
+    Point the app at the benchmark database and switch off external services.
+
+    Must run before ``app`` is imported, because its settings are read at import time.
+    """
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["DB_ASYNC"] = "1" if args.async_db else "0"
+    os.environ["RATE_LIMIT_ENABLED"] = "0"
+    os.environ["RATE_LIMIT_BACKEND"] = "memory"
+    os.environ["RESPONSE_CACHE_ENABLED"] = "1" if args.response_cache else "0"
+    os.environ["RESPONSE_CACHE_REDIS"] = "0"
+    os.environ["OUTBOX_ENABLED"] = "0"
+    os.environ["DB_CREATE_ALL"] = "0"
+    os.environ["CONTACT_PARTITIONS"] = str(args.contact_partitions)
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ["LOCAL_STORAGE_DIR"] = os.path.join(tempfile.gettempdir(), "benchmark-media")
+    # Measure accepting uploads rather than the 503s of a full processing queue
+    os.environ.setdefault("AVATAR_UPLOAD_QUEUE_LIMIT", "10000")
+    os.environ.pop("TOKEN_CACHE_REDIS_URL", None)
+    for name, value in (("SECRET_KEY", "benchmark"), ("ALGORITHM", "HS256"), ("ACCESS_TOKEN_EXPIRE_MINUTES", "60"),
+                        ("EMAIL_SECRET_KEY", "benchmark")):
+        os.environ.setdefault(name, value)
+
+
+class QueryCounter:
+    """
+    Count the SQL statements executed by the app's engines.
+    """
+
+    def __init__(self, engines):
+        from sqlalchemy import event
+
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def contact_payload(user_index: int, index: int, rng: random.Random) -> dict:
+    """
+    Build a contact with a name to search for and a birthday spread over the year.
+    """
+    birthday = date(1970 + rng.randrange(40), 1, 1) + timedelta(days=rng.randrange(365))
+    return {
+        "first_name": f"First{index}", "last_name": f"Last{user_index}x{index}",
+        "email": f"contact{index}.user{user_index}@example.com", "phone": "+380501234567",
+        "birthday": birthday.isoformat(),
+        "additional_info": "Seeded by the load benchmark" if index % 3 == 0 else None,
+    }
+
+
+async def seed(client: httpx.AsyncClient, users: int, contacts: int, rng: random.Random) -> List[dict]:
+    """
+    Create the benchmark users and their contacts, reusing those of an earlier run.
+
+    Returns:
+        List[dict]: The email, ID, access token and contact IDs of every user.
+    """
+    from sqlalchemy import func, select
+
+    from app import crud, database, hashing, models
+
+    emails = [f"bench-user{index}@example.com" for index in range(users)]
+    db = database.SessionLocal()
+    try:
+        hashed_password = hashing.hash_password_sync(PASSWORD)
+        insert = crud.insert_ignoring_conflicts(db.bind.dialect.name, models.User.__table__)
+        db.execute(insert, [{"email": email, "hashed_password": hashed_password, "is_verified": True}
+                            for email in emails])
+        db.commit()
+        user_ids = dict(db.execute(
+            select(models.User.email, models.User.id).where(models.User.email.in_(emails))).all())
+        counts = dict(db.execute(
+            select(models.Contact.owner_id, func.count()).where(models.Contact.owner_id.in_(user_ids.values()))
+            .group_by(models.Contact.owner_id)).all())
+    finally:
+        db.close()
+
+    seeded = []
+    for user_index, email in enumerate(emails):
+        response = await client.post("/api/token", data={"username": email, "password": PASSWORD})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        missing = contacts - counts.get(user_ids[email], 0)
+        for start in range(contacts - missing, contacts, 1000):
+            batch = [contact_payload(user_index, index, rng) for index in range(start, min(start + 1000, contacts))]
+            response = await client.post("/api/contacts/bulk", json={"create": batch}, headers=headers)
+            response.raise_for_status()
+        response = await client.get("/api/contacts", params={"limit": 1000}, headers=headers)
+        response.raise_for_status()
+        seeded.append({"index": user_index, "email": email, "headers": headers,
+                       "contact_ids": [contact["id"] for contact in response.json()]})
+    return seeded
+
+
+def avatar_images(rng: random.Random, count: int = 8, size: int = 1024) -> List[bytes]:
+    """
+    Encode ``count`` distinct photo-sized JPEGs to upload as avatars.
+    """
+    import io
+
+    from PIL import Image
+
+    images = []
+    for _ in range(count):
+        image = Image.linear_gradient("L").resize((size, size)).convert("RGB")
+        image.paste(tuple(rng.randrange(256) for _ in range(3)), (0, 0, size // 2, size // 2))
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=90)
+        images.append(output.getvalue())
+    return images
+
+
+def make_requests(users: List[dict], rng: random.Random) -> Dict[str, Callable]:
+    """
+    Build one request factory per scenario; each call returns the arguments of ``client.request``.
+    """
+    created = iter(range(10 ** 9))
+    started = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+
+    def token():
+        user = rng.choice(users)
+        return "POST", "/api/token", {"data": {"username": user["email"], "password": PASSWORD}}
+
+    def contacts():
+        user = rng.choice(users)
+        return "GET", "/api/contacts", {"params": {"limit": 50, "skip": rng.randrange(10) * 50},
+                                        "headers": user["headers"]}
+
+    def search():
+        user = rng.choice(users)
+        return "GET", "/api/contacts/search", {"params": {"query": f"First{rng.randrange(100)}"},
+                                               "headers": user["headers"]}
+
+    def birthdays():
+        user = rng.choice(users)
+        return "GET", "/api/contacts/upcoming-birthdays", {"params": {"days": 7}, "headers": user["headers"]}
+
+    def create():
+        user = rng.choice(users)
+        payload = contact_payload(user["index"], 0, rng)
+        payload["email"] = f"created{next(created)}.{started}.user{user['index']}@example.com"
+        return "POST", "/api/contacts", {"json": payload, "headers": user["headers"]}
+
+    def update():
+        user = rng.choice([user for user in users if user["contact_ids"]])
+        contact_id = rng.choice(user["contact_ids"])
+        payload = contact_payload(user["index"], contact_id, rng)
+        payload["email"] = f"updated{contact_id}.user{user['index']}@example.com"
+        return "PUT", f"/api/contacts/{contact_id}", {"json": payload, "headers": user["headers"]}
+
+    images = avatar_images(rng)
+
+    def avatar():
+        user = rng.choice(users)
+        return "POST", "/api/upload-avatar", {"files": {"avatar": ("avatar.jpg", rng.choice(images), "image/jpeg")},
+                                              "headers": user["headers"]}
+
+    return {"token": token, "list": contacts, "search": search, "birthdays": birthdays, "create": create,
+            "update": update, "avatar": avatar}
+
+
+async def drive(client: httpx.AsyncClient, factory: Callable, requests: int, concurrency: int) -> dict:
+    """
+    Send ``requests`` requests from ``concurrency`` concurrent clients.
+
+    Returns:
+        dict: The latencies of successful requests, the number of errors and the elapsed time.
+    """
+    remaining = iter(range(requests))
+    latencies, errors = [], 0
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            method, url, kwargs = factory()
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            elapsed = time.perf_counter() - started
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {"latencies": latencies, "errors": errors, "elapsed": time.perf_counter() - started}
+
+
+def summarize(result: dict, requests: int, queries: int) -> dict:
+    """
+    Reduce a scenario run to its reported metrics.
+
+    Requests per second and latencies count successful requests only, so
+    fast failures never pass for throughput.
+    """
+    latencies = sorted(result["latencies"]) or [0.0]
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": requests,
+        "errors": result["errors"],
+        "rps": round((requests - result["errors"]) / result["elapsed"], 1),
+        "p50_ms": round(percentiles[49] * 1000, 3),
+        "p95_ms": round(percentiles[94] * 1000, 3),
+        "p99_ms": round(percentiles[98] * 1000, 3),
+        "queries_per_request": round(queries / requests, 2),
+    }
+
+
+def cold_start():
+    """
+    Start the app in this process and print how long each stage took, as JSON.
+
+    Run by ``measure_cold_start`` in a fresh interpreter.
+    """
+    started = time.perf_counter()
+    from app.main import app
+
+    imported = time.perf_counter()
+
+    async def start():
+        async with app.router.lifespan_context(app):
+            startup_done = time.perf_counter()
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+                response = await client.get("/ready")
+            response.raise_for_status()
+            return startup_done, time.perf_counter()
+
+    startup_done, ready = asyncio.run(start())
+    print(json.dumps({
+        "import_ms": (imported - started) * 1000,
+        "startup_ms": (startup_done - imported) * 1000,
+        "ready_ms": (ready - startup_done) * 1000,
+        "total_ms": (ready - started) * 1000,
+    }))
+
+
+def measure_cold_start(runs: int) -> dict:
+    """
+    Measure the cold start of the app in ``runs`` fresh interpreters.
+
+    Args:
+        runs (int): The number of processes to start.
+
+    Returns:
+        dict: The median of every stage in milliseconds, plus ``process_ms``,
+        the wall time from spawning the interpreter until it exited.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])))
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.check_output(
+            [sys.executable, "-c", "from benchmarks.load import cold_start; cold_start()"], env=env, text=True)
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample["process_ms"] = (time.perf_counter() - started) * 1000
+        samples.append(sample)
+    return {name: round(statistics.median(sample[name] for sample in samples), 2)
+            for name in COLD_START_METRICS + ("process_ms",)}
+
+
+def git_commit() -> Optional[str]:
+    """
+    Return the current commit, marked ``-dirty`` if the tree has local changes.
+    """
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                         stderr=subprocess.DEVNULL).strip()
+        dirty = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], text=True,
+                                        stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+
+async def run(args) -> dict:
+    configure_environment(args)
+    from sqlalchemy import __version__ as sqlalchemy_version
+
+    from app import database, models
+    from app.main import app
+
+    models.Base.metadata.create_all(bind=database.engine)
+    engines = [database.engine] + ([database.async_engine.sync_engine] if database.async_engine is not None else [])
+    counter = QueryCounter(engines)
+    rng = random.Random(args.seed)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        started = time.perf_counter()
+        users = await seed(client, args.users, args.contacts, rng)
+        print(f"seeded {args.users} users x {args.contacts} contacts in {time.perf_counter() - started:.1f}s")
+        factories = make_requests(users, rng)
+        scenarios = {}
+        for name in args.scenarios:
+            await drive(client, factories[name], args.warmup, args.concurrency)
+            queries = counter.count
+            result = await drive(client, factories[name], args.requests, args.concurrency)
+            scenarios[name] = summarize(result, args.requests, counter.count - queries)
+            print(format_row(name, scenarios[name]))
+
+    cold = measure_cold_start(args.cold_starts) if args.cold_starts else {}
+    if cold:
+        print("cold start: " + ", ".join(f"{name} {value:.1f}" for name, value in cold.items()))
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy_version,
+            "dialect": database.engine.dialect.name,
+            "contact_partitions": models.CONTACT_PARTITIONS if models.partitions_contacts(database.engine.dialect) else 0,
+        },
+        "config": {name: getattr(args, name) for name in (
+            "users", "contacts", "requests", "concurrency", "warmup", "seed", "async_db", "response_cache",
+            "contact_partitions")},
+        "scenarios": scenarios,
+        "cold_start": cold,
+    }
+
+
+def format_row(name: str, metrics: dict) -> str:
+    return (f"{name:>10} {metrics['rps']:>9.1f} {metrics['p50_ms']:>9.2f} {metrics['p95_ms']:>9.2f} "
+            f"{metrics['p99_ms']:>9.2f} {metrics['queries_per_request']:>8.2f} {metrics['errors']:>7}")
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    """
+    List the metrics of ``current`` that are worse than ``baseline`` by more than ``threshold``.
+
+    Args:
+        current (dict): A result document of this run.
+        baseline (dict): A result document of an earlier run.
+        threshold (float): The tolerated relative change, e.g. 0.1 for 10%.
+
+    Returns:
+        List[str]: One line per regression.
+    """
+    regressions = []
+    for name, metrics in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            if not before[metric]:
+                continue
+            change = (metrics[metric] - before[metric]) / before[metric]
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append(f"{name} {metric}: {before[metric]} -> {metrics[metric]} ({change:+.0%})")
+        if metrics["queries_per_request"] > before["queries_per_request"]:
+            regressions.append(f"{name} queries_per_request: {before['queries_per_request']} -> "
+                               f"{metrics['queries_per_request']}")
+        # Any new failed request is a regression
+        if metrics.get("errors", 0) > before.get("errors", 0):
+            regressions.append(f"{name} errors: {before.get('errors', 0)} -> {metrics['errors']}")
+    before, after = baseline.get("cold_start") or {}, current.get("cold_start") or {}
+    metric = COMPARED_COLD_START_METRIC
+    if before.get(metric) and metric in after:
+        change = (after[metric] - before[metric]) / before[metric]
+        if change > threshold:
+            regressions.append(f"cold start {metric}: {before[metric]} -> {after[metric]} ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="sqlite:///./benchmark.db",
+                        help="Database to seed and query; created if missing.")
+    parser.add_argument("--async-db", action="store_true", help="Serve requests through AsyncSession (DB_ASYNC=1).")
+    parser.add_argument("--response-cache", action="store_true", help="Keep the in-process response cache enabled.")
+    parser.add_argument("--contact-partitions", type=int, default=16,
+                        help="Hash partitions of a new contacts table on PostgreSQL; 0 for one table.")
+    parser.add_argument("--users", type=int, default=10, help="Users to seed.")
+    parser.add_argument("--contacts", type=int, default=500, help="Contacts to seed per user.")
+    parser.add_argument("--requests", type=int, default=300, help="Measured requests per scenario.")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per scenario.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients.")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the generated data and requests.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS),
+                        help="Scenarios to run.")
+    parser.add_argument("--cold-starts", type=int, default=3,
+                        help="Fresh processes started to measure the cold start; 0 skips it.")
+    parser.add_argument("--output", help="Result file. Defaults to benchmarks/results/load-<commit>.json.")
+    parser.add_argument("--compare", help="Result file of an earlier run to check for regressions.")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative change of p95 latency, RPS or cold start time counted as a regression.")
+    args = parser.parse_args(argv)
+
+    print(f"{'scenario':>10} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'errors':>7}")
+    results = asyncio.run(run(args))
+
+    output = args.output or os.path.join(os.path.dirname(__file__), "results",
+                                         f"load-{results['meta']['commit'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline.get("config") != results["config"]:
+            print(f"warning: {args.compare} was run with a different configuration: {baseline.get('config')}")
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions:
+            print(f"regression: {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
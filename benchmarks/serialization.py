@@ -0,0 +1,100 @@
+"""
+Microbenchmark of contact list serialization.
+
+Compares the default response path (ORM objects validated and encoded by
+FastAPI through ``response_model=List[schemas.Contact]``) with the fast path
+enabled by ``FAST_JSON=1`` (plain rows rendered by ``app.serialization``).
+Both routes are served by the same in-process FastAPI app over ASGI, so the
+difference is the cost of building the response body.
+
+Usage:
+    python -m benchmarks.serialization --rows 10 100 1000 --requests 200
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import date, datetime
+from typing import List
+
+import httpx
+from fastapi import FastAPI
+
+from app import crud, schemas, serialization
+from app.models import Contact
+
+
+def make_contacts(count: int) -> List[Contact]:
+    """
+    Build transient contacts shaped like real ones.
+    """
+    return [
+        Contact(id=index, first_name=f"First{index}", last_name=f"Last{index}", email=f"contact{index}@example.com",
+                phone="+380501234567", birthday=date(1990, 1 + index % 12, 1 + index % 28),
+                additional_info="Met at the conference" if index % 2 else None, updated_at=datetime(2024, 5, 1, 12))
+        for index in range(count)
+    ]
+
+
+def make_app(contacts: List[Contact]) -> FastAPI:
+    """
+    Build an app serving the same contacts through both response paths.
+    """
+    rows = [{name: getattr(contact, name) for name in crud.CONTACT_ROW_COLUMNS} for contact in contacts]
+    app = FastAPI()
+
+    @app.get("/orm", response_model=List[schemas.Contact])
+    async def orm():
+        return contacts
+
+    @app.get("/fast", response_model=List[schemas.Contact])
+    async def fast():
+        return serialization.json_response(rows)
+
+    return app
+
+
+async def measure(client: httpx.AsyncClient, path: str, requests: int) -> List[float]:
+    """
+    Time ``requests`` sequential GETs of ``path`` after a short warm-up.
+    """
+    for _ in range(10):
+        await client.get(path)
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = await client.get(path)
+        timings.append(time.perf_counter() - started)
+        response.raise_for_status()
+    return timings
+
+
+async def run(row_counts: List[int], requests: int):
+    print(f"json encoder: {'orjson' if serialization.orjson is not None else 'json'}")
+    print(f"{'rows':>6} {'path':>5} {'median ms':>10} {'p95 ms':>8} {'speedup':>8}")
+    for count in row_counts:
+        app = make_app(make_contacts(count))
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            orm_body, fast_body = (await client.get("/orm")).content, (await client.get("/fast")).content
+            if orm_body != fast_body:
+                raise SystemExit(f"Response bodies differ for {count} rows")
+            results = {path: await measure(client, f"/{path}", requests) for path in ("orm", "fast")}
+        baseline = statistics.median(results["orm"])
+        for path, timings in results.items():
+            median = statistics.median(timings)
+            p95 = statistics.quantiles(timings, n=20)[-1]
+            print(f"{count:>6} {path:>5} {median * 1000:>10.3f} {p95 * 1000:>8.3f} {baseline / median:>7.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 100, 1000], help="Page sizes to measure.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per path and page size.")
+    args = parser.parse_args(argv)
+    asyncio.run(run(args.rows, args.requests))
+
+
+if __name__ == "__main__":
+    main()
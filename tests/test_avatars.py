@@ -0,0 +1,124 @@
+# test_avatars.py
+import asyncio
+import io
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from fastapi import HTTPException, UploadFile
+
+from app import avatars, storage
+
+
+class TestSpool(unittest.TestCase):
+
+    def test_copies_in_chunks_and_rejects_large_files(self):
+        with patch.object(avatars, "AVATAR_CHUNK_BYTES", 4):
+            path = asyncio.run(avatars.spool(UploadFile(io.BytesIO(b"0123456789")), max_bytes=10))
+            with open(path, "rb") as file:
+                self.assertEqual(file.read(), b"0123456789")
+            os.unlink(path)
+            with self.assertRaises(HTTPException) as raised:
+                asyncio.run(avatars.spool(UploadFile(io.BytesIO(b"0123456789x")), max_bytes=10))
+        self.assertEqual(raised.exception.status_code, 413)
+
+
+class TestRenderVariants(unittest.TestCase):
+
+    def test_writes_square_variants_without_metadata(self):
+        from PIL import Image
+
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "upload.jpg")
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90 degrees clockwise
+        exif[0x010F] = "Camera"
+        Image.new("RGB", (300, 200), "red").save(path, "JPEG", exif=exif.tobytes())
+        variants = avatars.render_variants(path, directory, sizes=(32, 64))
+        self.assertEqual([name for name, _, _ in variants], ["32.webp", "32.jpg", "64.jpg", "64.webp"])
+        for name, variant_path, content_type in variants:
+            with Image.open(variant_path) as variant:
+                self.assertEqual(variant.size, (int(name.split(".")[0]),) * 2)
+                self.assertEqual(variant.get_format_mimetype(), content_type)
+                self.assertEqual(len(variant.getexif()), 0)
+        with open(path, "wb") as file:
+            file.write(b"not an image")
+        with self.assertRaises(avatars.InvalidImage):
+            avatars.render_variants(path, directory)
+
+
+class TestAvatarUploader(unittest.TestCase):
+
+    def upload(self, uploader, color):
+        from PIL import Image
+
+        fd, path = tempfile.mkstemp(suffix=".png")
+        os.close(fd)
+        Image.new("RGBA", (80, 80), color).save(path, "PNG")
+        return uploader.submit(7, path)
+
+    def test_stores_variants_once_and_records_the_url(self):
+        directory = tempfile.mkdtemp()
+        uploader = avatars.AvatarUploader(workers=1, process_workers=1, queue_limit=2)
+        with patch.object(storage, "_storage", storage.LocalStorage(directory, "/media")), \
+                patch.object(avatars.crud, "update_user_avatar") as update_user_avatar, \
+                patch.object(avatars, "AVATAR_SIZES", [32, 64]):
+            jobs = [self.upload(uploader, "red"), self.upload(uploader, "red"), self.upload(uploader, "blue")]
+            uploader.shutdown()
+        self.assertEqual([job.status for job in jobs], ["done"] * 3)
+        self.assertEqual(jobs[0].avatar_url, jobs[1].avatar_url)
+        self.assertNotEqual(jobs[0].avatar_url, jobs[2].avatar_url)
+        self.assertRegex(jobs[0].avatar_url, r"^/media/avatars/[0-9a-f]{64}/64\.webp$")
+        self.assertEqual(update_user_avatar.call_args.args[1:], (7, jobs[2].avatar_url))
+        self.assertEqual(len(os.listdir(os.path.join(directory, "avatars"))), 2)
+        self.assertIs(uploader.get(jobs[0].id, 7), jobs[0])
+        self.assertIsNone(uploader.get(jobs[0].id, 8))
+
+
+class TestStorage(unittest.TestCase):
+
+    def test_backends_must_implement_the_interface(self):
+        class Incomplete(storage.Storage):
+            def save(self, path, key, content_type=None, cache_control=None):
+                return key
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+        storage.LocalStorage(tempfile.mkdtemp(), "/media")
+
+
+class TestLocalStorage(unittest.TestCase):
+
+    def test_serves_files_without_sniffing_or_scripts(self):
+        from fastapi import FastAPI
+        from fastapi.testclient import TestClient
+
+        directory = tempfile.mkdtemp()
+        with open(os.path.join(directory, "page.html"), "w") as file:
+            file.write("<script>alert(1)</script>")
+        app = FastAPI()
+        app.mount("/media", storage.ImmutableStaticFiles(directory=directory))
+        response = TestClient(app).get("/media/page.html")
+        self.assertEqual(response.headers["X-Content-Type-Options"], "nosniff")
+        self.assertIn("sandbox", response.headers["Content-Security-Policy"])
+        self.assertEqual(response.headers["Cache-Control"], storage.IMMUTABLE_CACHE_CONTROL)
+
+
+class TestCloudinaryStorage(unittest.TestCase):
+
+    def test_exists_asks_the_delivery_url(self):
+        from urllib.error import HTTPError
+
+        backend = storage.CloudinaryStorage()
+        url = "https://res.cloudinary.com/demo/raw/upload/avatars/a/64.webp"
+        with patch.object(backend, "url", return_value=url), patch("urllib.request.urlopen") as urlopen:
+            self.assertTrue(backend.exists("avatars/a/64.webp"))
+            self.assertEqual(urlopen.call_args.args[0].get_method(), "HEAD")
+            self.assertEqual(urlopen.call_args.args[0].full_url, url)
+            urlopen.side_effect = HTTPError(url, 404, "Not Found", {}, None)
+            self.assertFalse(backend.exists("avatars/a/64.webp"))
+
+
+if __name__ == "__main__":
+    unittest.main()
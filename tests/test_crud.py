@@ -4,7 +4,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
 from app import crud, models, schemas
 from app.database import Base, engine, get_db
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
 import os
 
@@ -35,6 +35,8 @@ class TestCRUD(unittest.TestCase):
 
     def tearDown(self):
         # Clean up database after each test
+        self.db.query(models.ContactDeletion).delete()
+        self.db.query(models.Contact).delete()
         self.db.query(models.User).delete()
         self.db.commit()
         self.db.close()
@@ -43,6 +45,21 @@ class TestCRUD(unittest.TestCase):
         created_user = self.db.query(models.User).filter(models.User.email == self.user_data["email"]).first()
         self.assertEqual(created_user.email, self.user_data["email"])
 
+    def test_create_user_enqueues_verification_email_in_the_same_transaction(self):
+        from unittest.mock import patch
+        user = schemas.UserCreate(email="verify@example.com", password="testpassword")
+        with patch.object(crud, "enqueue_email", side_effect=RuntimeError("outbox down")):
+            with self.assertRaises(RuntimeError):
+                crud.create_user(self.db, user, verification_email=("Verify", "Body"))
+        self.db.rollback()
+        self.assertIsNone(crud.get_user_by_email(self.db, user.email))
+
+        db_user = crud.create_user(self.db, user, verification_email=("Verify", "Body"))
+        queued = self.db.query(models.EmailOutbox).filter(models.EmailOutbox.to_email == user.email).one()
+        self.assertEqual(queued.dedupe_key, f"verify-email:{db_user.id}")
+        self.db.delete(queued)
+        self.db.commit()
+
     def test_get_user_by_email(self):
         retrieved_user = crud.get_user_by_email(self.db, self.user_data["email"])
         self.assertEqual(retrieved_user.email, self.user_data["email"])
@@ -79,14 +96,37 @@ class TestCRUD(unittest.TestCase):
         self.assertIsNone(deleted_contact)
 
     def test_search_contacts(self):
-        contact_data_1 = {"first_name": "Alice", "last_name": "Johnson", "email": "alice.johnson@example.com"}
-        contact_data_2 = {"first_name": "Bob", "last_name": "Williams", "email": "bob.williams@example.com"}
+        contact_data_1 = {"first_name": "Alice", "last_name": "Johnson", "email": "alice.johnson@example.com",
+                          "phone": "1234567890", "birthday": "1990-01-01"}
+        contact_data_2 = {"first_name": "Bob", "last_name": "Williams", "email": "bob.williams@example.com",
+                          "phone": "1234567890", "birthday": "1990-01-01"}
         crud.create_contact(self.db, schemas.ContactCreate(**contact_data_1), self.user.id)
         crud.create_contact(self.db, schemas.ContactCreate(**contact_data_2), self.user.id)
         search_results = crud.search_contacts(self.db, "Alice", self.user.id)
         self.assertEqual(len(search_results), 1)
         self.assertEqual(search_results[0].first_name, "Alice")
 
+    def test_search_contacts_ranking_prefix_and_wildcards(self):
+        for first_name, last_name, email in [("Joanne", "Ray", "jo@example.com"),
+                                             ("Annabel", "Lee", "bel@example.com"),
+                                             ("Ann", "Smith", "smith@example.com"),
+                                             ("Deal", "100% Off", "deal@example.com"),
+                                             ("Under_score", "Kim", "under@example.com"),
+                                             ("Under-score", "Park", "park@example.com")]:
+            crud.create_contact(self.db, schemas.ContactCreate(
+                first_name=first_name, last_name=last_name, email=email,
+                phone="1234567890", birthday="1990-01-01"), self.user.id)
+
+        def search(query, prefix=False):
+            return [c.first_name for c in crud.search_contacts(self.db, query, self.user.id, prefix=prefix)]
+
+        # Exact match, then prefix matches, then other substrings
+        self.assertEqual(search("ann"), ["Ann", "Annabel", "Joanne"])
+        self.assertEqual(search("ANN", prefix=True), ["Ann", "Annabel"])
+        self.assertEqual(search("%"), ["Deal"])
+        self.assertEqual(search("r_s"), ["Under_score"])
+        self.assertEqual(search("   "), [])
+
     def test_get_upcoming_birthdays(self):
         contact_data = {"first_name": "David", "last_name": "Robinson", "email": "david.robinson@example.com", "birthday": datetime.now() + timedelta(days=5)}
         created_contact = crud.create_contact(self.db, schemas.ContactCreate(**contact_data), self.user.id)
@@ -94,6 +134,190 @@ class TestCRUD(unittest.TestCase):
         self.assertEqual(len(upcoming_birthdays), 1)
         self.assertEqual(upcoming_birthdays[0].first_name, "David")
 
+    def test_get_contacts_keyset_pagination(self):
+        for first_name, last_name, email in [("Ann", "Lee", "ann.lee@example.com"),
+                                             ("Bob", "Adams", "bob.adams@example.com"),
+                                             ("Cat", "Lee", "cat.lee@example.com")]:
+            crud.create_contact(self.db, schemas.ContactCreate(
+                first_name=first_name, last_name=last_name, email=email,
+                phone="1234567890", birthday="1990-01-01"), self.user.id)
+        first_page = crud.get_contacts(self.db, self.user.id, limit=2, sort="name")
+        self.assertEqual([c.first_name for c in first_page], ["Bob", "Ann"])
+        cursor = crud.encode_contact_cursor(first_page[-1], "name")
+        after = crud.decode_contact_cursor(cursor, "name")
+        second_page = crud.get_contacts(self.db, self.user.id, limit=2, after=after, sort="name")
+        self.assertEqual([c.first_name for c in second_page], ["Cat"])
+        with self.assertRaises(ValueError):
+            crud.decode_contact_cursor(cursor, "id")
+
+    def test_get_contacts_keyset_pagination_by_name_with_null_names(self):
+        for first_name, last_name in [("A", "Zed"), ("B", None), ("C", "Adams"), ("D", None)]:
+            self.db.add(models.Contact(first_name=first_name, last_name=last_name,
+                                       email=f"{first_name.lower()}@example.com", owner_id=self.user.id))
+        self.db.commit()
+        names, after = [], None
+        while True:
+            page = crud.get_contacts(self.db, self.user.id, limit=1, after=after, sort="name")
+            if not page:
+                break
+            names += [c.first_name for c in page]
+            after = crud.decode_contact_cursor(crud.encode_contact_cursor(page[-1], "name"), "name")
+        self.assertEqual(names, ["B", "D", "C", "A"])
+
+    def test_decode_contact_cursor_rejects_values_of_the_wrong_type(self):
+        import base64
+        import json
+
+        def encode(data):
+            return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+        self.assertEqual(crud.decode_contact_cursor(encode(["name", "", "Ann", 3]), "name"), ["", "Ann", 3])
+        for data in (["id", {"x": 1}], ["id", "3"], ["id", True], ["name", "Lee", 1, 3], ["name", None, "Ann", 3]):
+            with self.assertRaises(ValueError):
+                crud.decode_contact_cursor(encode(data), data[0])
+
+    def test_get_upcoming_birthdays_across_new_year(self):
+        for first_name, email, birthday in [("Eve", "eve@example.com", "1985-12-31"),
+                                            ("Finn", "finn@example.com", "1992-01-02"),
+                                            ("Gus", "gus@example.com", "1970-01-10")]:
+            crud.create_contact(self.db, schemas.ContactCreate(
+                first_name=first_name, last_name="Test", email=email,
+                phone="1234567890", birthday=birthday), self.user.id)
+        upcoming_birthdays = crud.get_upcoming_birthdays(self.db, self.user.id, days=7, today=date(2023, 12, 29))
+        self.assertEqual([c.first_name for c in upcoming_birthdays], ["Eve", "Finn"])
+        upcoming_birthdays = crud.get_upcoming_birthdays(self.db, self.user.id, days=366, today=date(2023, 12, 29))
+        self.assertEqual([c.first_name for c in upcoming_birthdays], ["Eve", "Finn", "Gus"])
+        upcoming_birthdays = crud.get_upcoming_birthdays(self.db, self.user.id, days=366, today=date(2023, 1, 5))
+        self.assertEqual([c.first_name for c in upcoming_birthdays], ["Gus", "Eve", "Finn"])
+
+    def test_birthday_window_includes_feb_29_in_common_years(self):
+        self.assertEqual(crud.birthday_window(date(2023, 2, 21), 7), [(221, 229)])
+        self.assertEqual(crud.birthday_window(date(2024, 2, 21), 7), [(221, 228)])
+
+    def test_bulk_contacts(self):
+        existing = crud.create_contact(self.db, schemas.ContactCreate(
+            first_name="Kim", last_name="Park", email="kim.park@example.com",
+            phone="1234567890", birthday="1990-01-01"), self.user.id)
+        request = schemas.ContactBulkRequest(
+            create=[
+                {"first_name": "Lea", "last_name": "Ray", "email": "lea.ray@example.com",
+                 "phone": "1234567890", "birthday": "1991-02-03"},
+                {"first_name": "Kim", "last_name": "Dup", "email": "kim.park@example.com",
+                 "phone": "1234567890", "birthday": "1991-02-03"},
+            ],
+            update=[{"id": existing.id, "first_name": "Kimberly", "last_name": "Park",
+                     "email": "kim.park@example.com", "phone": "1234567890", "birthday": "1990-01-01"}],
+            delete=[existing.id + 1000],
+        )
+        results = crud.bulk_contacts(self.db, request, self.user.id)
+        self.assertEqual([(r.op, r.status) for r in results],
+                         [("delete", "not_found"), ("update", "updated"), ("create", "created"), ("create", "conflict")])
+        self.assertEqual(crud.get_contact(self.db, existing.id, self.user.id).first_name, "Kimberly")
+
+    def test_bulk_contacts_reports_duplicate_emails_within_the_batch(self):
+        first = crud.create_contact(self.db, schemas.ContactCreate(
+            first_name="Max", last_name="One", email="max.one@example.com",
+            phone="1234567890", birthday="1990-01-01"), self.user.id)
+        second = crud.create_contact(self.db, schemas.ContactCreate(
+            first_name="Max", last_name="Two", email="max.two@example.com",
+            phone="1234567890", birthday="1990-01-01"), self.user.id)
+        item = {"last_name": "Same", "phone": "1234567890", "birthday": "1991-02-03"}
+        request = schemas.ContactBulkRequest(
+            create=[dict(item, first_name="Ana", email="twin@example.com"),
+                    dict(item, first_name="Bea", email="twin@example.com")],
+            update=[dict(item, id=first.id, first_name="Max", email="moved@example.com"),
+                    dict(item, id=second.id, first_name="Max", email="moved@example.com")],
+        )
+        results = crud.bulk_contacts(self.db, request, self.user.id)
+        self.assertEqual([(r.op, r.status) for r in results],
+                         [("update", "updated"), ("update", "conflict"), ("create", "created"), ("create", "conflict")])
+        self.assertEqual(crud.get_contact(self.db, second.id, self.user.id).email, "max.two@example.com")
+
+    def test_get_contact_changes(self):
+        kept = crud.create_contact(self.db, schemas.ContactCreate(
+            first_name="Ann", last_name="Lee", email="ann.lee@example.com",
+            phone="1234567890", birthday="1990-01-01"), self.user.id)
+        removed = crud.create_contact(self.db, schemas.ContactCreate(
+            first_name="Bob", last_name="Lee", email="bob.lee@example.com",
+            phone="1234567890", birthday="1990-01-01"), self.user.id)
+        since = crud.get_contacts_version(self.db, self.user.id)
+        crud.update_contact(self.db, kept.id, schemas.ContactUpdate(
+            first_name="Anna", last_name="Lee", email="ann.lee@example.com",
+            phone="1234567890", birthday="1990-01-01"), self.user.id)
+        crud.delete_contact(self.db, removed.id, self.user.id)
+        changes = crud.get_contact_changes(self.db, self.user.id, since)
+        self.assertEqual(changes["version"], since + 2)
+        self.assertEqual([contact.first_name for contact in changes["updated"]], ["Anna"])
+        self.assertEqual(changes["deleted"], [removed.id])
+
+    def test_missing_contact_write_keeps_version(self):
+        version = crud.get_contacts_version(self.db, self.user.id)
+        contact = schemas.ContactUpdate(first_name="Ann", last_name="Lee", email="ann.lee@example.com",
+                                        phone="1234567890", birthday="1990-01-01")
+        self.assertIsNone(crud.update_contact(self.db, 999999, contact, self.user.id))
+        self.assertIsNone(crud.delete_contact(self.db, 999999, self.user.id))
+        self.assertEqual(crud.get_contacts_version(self.db, self.user.id), version)
+
+    def test_patch_contact(self):
+        contact = crud.create_contact(self.db, schemas.ContactCreate(
+            first_name="Ann", last_name="Lee", email="ann.lee@example.com",
+            phone="1234567890", birthday="1990-01-01", additional_info="Colleague"), self.user.id)
+        version = crud.get_contacts_version(self.db, self.user.id)
+        patched = crud.patch_contact(self.db, contact.id, schemas.ContactPatch(phone="555", additional_info=None),
+                                     self.user.id)
+        self.assertEqual((patched.first_name, patched.phone, patched.additional_info), ("Ann", "555", None))
+        self.assertEqual(crud.get_contacts_version(self.db, self.user.id), version + 1)
+        unchanged = crud.patch_contact(self.db, contact.id, schemas.ContactPatch(phone="555"), self.user.id)
+        self.assertEqual(unchanged.phone, "555")
+        self.assertEqual(crud.get_contacts_version(self.db, self.user.id), version + 1)
+        self.assertIsNone(crud.patch_contact(self.db, 999999, schemas.ContactPatch(phone="1"), self.user.id))
+
+    def test_contact_writes_are_single_statements_on_postgresql(self):
+        from sqlalchemy.dialects import postgresql
+        updated = str(crud.update_contact_query("postgresql", 1, {"first_name": "Ann"}, 2)
+                      .compile(dialect=postgresql.dialect()))
+        self.assertTrue(updated.startswith("WITH contacts_version_bump AS"))
+        self.assertIn("RETURNING contacts.id", updated)
+        deleted = str(crud.delete_contact_query("postgresql", 1, 2).compile(dialect=postgresql.dialect()))
+        self.assertIn("DELETE FROM contacts", deleted)
+        self.assertIn("INSERT INTO contact_deletions", deleted)
+
+    def test_contact_partition_ddl(self):
+        statements = models.contact_partition_ddl("contacts", 4)
+        self.assertEqual(len(statements), 4)
+        self.assertEqual(statements[3], "CREATE TABLE contacts_p3 PARTITION OF contacts "
+                                        "FOR VALUES WITH (MODULUS 4, REMAINDER 3)")
+
+    def test_contacts_are_only_partitioned_on_postgresql(self):
+        from unittest.mock import patch
+        from sqlalchemy.dialects import postgresql, sqlite
+        from sqlalchemy.schema import CreateTable
+        table = models.Contact.__table__
+        with patch.object(models, "CONTACT_PARTITIONS", 4):
+            created = str(CreateTable(table).compile(dialect=postgresql.dialect()))
+            self.assertIn("PRIMARY KEY (id, owner_id)", created)
+            self.assertIn("UNIQUE (owner_id, email)", created)
+            created = str(CreateTable(table).compile(dialect=sqlite.dialect()))
+            self.assertIn("PRIMARY KEY (id)", created)
+            self.assertNotIn("UNIQUE", created)
+        self.assertEqual(models.contact_email_key(self.db.connection()), ("email",))
+
+    def test_create_all_builds_the_search_indexes_on_postgresql(self):
+        from sqlalchemy import create_mock_engine
+
+        def statements(url):
+            executed = []
+            mock = create_mock_engine(url, lambda sql, *args, **kwargs: executed.append(
+                str(sql.compile(dialect=mock.dialect))))
+            models.Base.metadata.create_all(mock)
+            return executed
+
+        executed = statements("postgresql://")
+        self.assertEqual(executed[:2], ["CREATE EXTENSION IF NOT EXISTS pg_trgm",
+                                        "CREATE EXTENSION IF NOT EXISTS btree_gin"])
+        self.assertIn("CREATE INDEX ix_contacts_owner_id_email_trgm ON contacts "
+                      "USING gin (owner_id, email gin_trgm_ops)", executed)
+        self.assertFalse([statement for statement in statements("sqlite://") if "trgm" in statement])
+
     def test_update_user_avatar(self):
         new_avatar_url = "https://avatars.githubusercontent.com/u/14985020?v=4"
         updated_user = crud.update_user_avatar(self.db, self.user.id, new_avatar_url)
@@ -0,0 +1,39 @@
+# test_import_data.py
+import io
+import unittest
+
+from app.import_data import detect_format, parse_csv, parse_ndjson, parse_vcard
+
+
+class TestParsers(unittest.TestCase):
+
+    def test_parse_csv_drops_empty_values(self):
+        stream = io.StringIO("first_name,last_name,email\nJohn,,john@example.com\n", newline="")
+        self.assertEqual(list(parse_csv(stream)), [(1, {"first_name": "John", "email": "john@example.com"})])
+
+    def test_parse_ndjson_rejects_invalid_lines(self):
+        stream = io.StringIO('{"first_name": "John"}\n\nnot json\n')
+        self.assertEqual(list(parse_ndjson(stream)), [(1, {"first_name": "John"}), (3, {})])
+
+    def test_parse_vcard_unfolds_lines(self):
+        stream = io.StringIO(
+            "BEGIN:VCARD\r\nN:Doe;John;;;\r\nEMAIL;TYPE=INTERNET:john@example.com\r\n"
+            "BDAY:19900115\r\nNOTE:first\\, line\r\n  continued\r\nEND:VCARD\r\n"
+        )
+        self.assertEqual(list(parse_vcard(stream)), [(1, {
+            "last_name": "Doe",
+            "first_name": "John",
+            "email": "john@example.com",
+            "birthday": "1990-01-15",
+            "additional_info": "first, line continued",
+        })])
+
+    def test_detect_format(self):
+        self.assertEqual(detect_format("contacts.jsonl"), "ndjson")
+        self.assertEqual(detect_format("Contacts.VCF"), "vcf")
+        with self.assertRaises(ValueError):
+            detect_format("contacts.xlsx")
+
+
+if __name__ == "__main__":
+    unittest.main()
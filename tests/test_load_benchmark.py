@@ -0,0 +1,59 @@
+# test_load_benchmark.py
+import unittest
+
+from benchmarks.load import compare, summarize
+from benchmarks.workers import add_speedups, worker_counts
+
+
+class TestLoadBenchmark(unittest.TestCase):
+
+    def test_summarize(self):
+        result = {"latencies": [index / 1000 for index in range(1, 101)], "errors": 2, "elapsed": 2.0}
+        metrics = summarize(result, requests=102, queries=204)
+        self.assertEqual(metrics["rps"], 50.0)
+        self.assertAlmostEqual(metrics["p50_ms"], 50.5)
+        self.assertAlmostEqual(metrics["p99_ms"], 99.01)
+        self.assertEqual(metrics["queries_per_request"], 2.0)
+        self.assertEqual(metrics["errors"], 2)
+
+    def test_compare_flags_regressions_beyond_threshold(self):
+        baseline = {"scenarios": {
+            "list": {"p95_ms": 10.0, "rps": 100.0, "queries_per_request": 2.0},
+            "search": {"p95_ms": 10.0, "rps": 100.0, "queries_per_request": 2.0},
+        }}
+        current = {"scenarios": {
+            "list": {"p95_ms": 10.5, "rps": 80.0, "queries_per_request": 2.0},
+            "search": {"p95_ms": 9.0, "rps": 120.0, "queries_per_request": 3.0},
+            "create": {"p95_ms": 50.0, "rps": 10.0, "queries_per_request": 4.0},
+        }}
+        regressions = compare(current, baseline, threshold=0.1)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith("list rps"))
+        self.assertTrue(regressions[1].startswith("search queries_per_request"))
+
+    def test_compare_flags_any_new_error(self):
+        baseline = {"scenarios": {"list": {"p95_ms": 10.0, "rps": 100.0, "queries_per_request": 2.0, "errors": 0}}}
+        current = {"scenarios": {"list": {"p95_ms": 10.0, "rps": 100.0, "queries_per_request": 2.0, "errors": 1}}}
+        self.assertEqual(compare(current, baseline, threshold=0.1), ["list errors: 0 -> 1"])
+        self.assertEqual(compare(baseline, current, threshold=0.1), [])
+
+    def test_compare_flags_slower_cold_start(self):
+        baseline = {"scenarios": {}, "cold_start": {"import_ms": 900.0, "ready_ms": 100.0, "total_ms": 1000.0}}
+        current = {"scenarios": {}, "cold_start": {"import_ms": 1000.0, "ready_ms": 250.0, "total_ms": 1250.0}}
+        self.assertEqual(compare(current, baseline, threshold=0.1), ["cold start total_ms: 1000.0 -> 1250.0 (+25%)"])
+        self.assertEqual(compare(current, {"scenarios": {}}, threshold=0.1), [])
+
+    def test_worker_counts(self):
+        self.assertEqual(worker_counts(1), [1])
+        self.assertEqual(worker_counts(4), [1, 2, 4])
+        self.assertEqual(worker_counts(6), [1, 2, 4, 6])
+
+    def test_add_speedups(self):
+        results = add_speedups({"1": {"list": {"rps": 100.0}}, "4": {"list": {"rps": 300.0}}})
+        self.assertEqual(results["1"]["list"]["speedup"], 1.0)
+        self.assertEqual(results["4"]["list"]["speedup"], 3.0)
+        self.assertEqual(results["4"]["list"]["efficiency"], 0.75)
+
+
+if __name__ == '__main__':
+    unittest.main()
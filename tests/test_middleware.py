@@ -0,0 +1,47 @@
+# test_middleware.py
+import unittest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from app import database
+from app.database import redact_parameters, register_query_instrumentation
+from app.middleware import QueryTimingMiddleware, request_statements
+
+
+class TestQueryTiming(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite://")
+        register_query_instrumentation(engine, "test")
+        app = FastAPI()
+        app.add_middleware(QueryTimingMiddleware)
+
+        @app.get("/items/{item_id}")
+        def read_item(item_id: int):
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+                connection.execute(text("SELECT :id"), {"id": item_id})
+            return {"id": item_id}
+
+        self.client = TestClient(app)
+
+    def test_counts_statements_per_request(self):
+        response = self.client.get("/items/7")
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response.headers["server-timing"],
+                         r'^db;dur=[\d.]+;desc="2 statements", pool;dur=[\d.]+, app;dur=[\d.]+$')
+        total, count = request_statements.summary(method="GET", route="/items/{item_id}")
+        self.assertEqual((total, count), (2, 1))
+        self.assertIsNone(database.query_stats.get())
+
+    def test_redact_parameters(self):
+        self.assertEqual(redact_parameters({"email": "a@example.com", "id": 3, "note": None}),
+                         {"email": "<str>", "id": "<int>", "note": None})
+        self.assertEqual(redact_parameters(("secret", 1.5)), ("<str>", "<float>"))
+        self.assertEqual(redact_parameters([("a",), ("b",)], executemany=True), "<2 parameter sets>")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# test_outbox.py
+import smtplib
+import unittest
+from unittest.mock import MagicMock, patch
+
+from app import outbox
+
+
+class TestBackoff(unittest.TestCase):
+
+    def test_grows_exponentially_and_is_capped(self):
+        with patch.object(outbox, "OUTBOX_BACKOFF_BASE", 10), patch.object(outbox, "OUTBOX_BACKOFF_MAX", 60):
+            self.assertTrue(5 <= outbox.backoff(1) <= 10)
+            self.assertTrue(20 <= outbox.backoff(3) <= 40)
+            self.assertTrue(30 <= outbox.backoff(10) <= 60)
+
+
+class TestSMTPConnectionPool(unittest.TestCase):
+
+    def test_reuses_connections(self):
+        server = MagicMock()
+        with patch.object(outbox, "smtp_connect", return_value=server) as connect:
+            pool = outbox.SMTPConnectionPool(size=1)
+            for _ in range(3):
+                with pool.connection() as connection:
+                    connection.sendmail("a@example.com", ["b@example.com"], "body")
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(server.sendmail.call_count, 3)
+
+    def test_discards_broken_connections(self):
+        broken, fresh = MagicMock(), MagicMock()
+        broken.rset.side_effect = smtplib.SMTPServerDisconnected()
+        with patch.object(outbox, "smtp_connect", side_effect=[broken, fresh]):
+            pool = outbox.SMTPConnectionPool(size=1)
+            with self.assertRaises(smtplib.SMTPServerDisconnected):
+                with pool.connection():
+                    raise smtplib.SMTPServerDisconnected()
+            with pool.connection() as connection:
+                self.assertIs(connection, fresh)
+
+
+class TestLease(unittest.TestCase):
+
+    def test_min_lease_covers_a_batch_of_timeouts(self):
+        with patch.object(outbox, "SMTP_TIMEOUT", 10):
+            self.assertEqual(outbox.min_lease_seconds(50, 2), 250)
+            self.assertEqual(outbox.min_lease_seconds(5, 2), 30)
+
+    def test_default_lease_covers_the_default_batch(self):
+        self.assertGreaterEqual(outbox.OUTBOX_LEASE_SECONDS, outbox.min_lease_seconds())
+
+
+class TestOutboxDispatcher(unittest.TestCase):
+
+    def test_records_each_result_as_it_completes(self):
+        batch = [{"id": index, "to_email": f"{index}@example.com", "subject": "s", "body": "b", "attempts": 1}
+                 for index in range(3)]
+        dispatcher = outbox.OutboxDispatcher(batch_size=3, connections=1)
+
+        def send(email):
+            if email["id"] == 1:
+                raise smtplib.SMTPRecipientsRefused({})
+
+        with patch.object(outbox.database, "SessionLocal"), \
+                patch.object(outbox, "claim_batch", return_value=batch), \
+                patch.object(outbox, "record_results") as record_results, \
+                patch.object(dispatcher, "_send", side_effect=send):
+            self.assertEqual(dispatcher.dispatch_once(), 3)
+        dispatcher._senders.shutdown()
+        calls = record_results.call_args_list
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(sorted(call.args[1] for call in calls if call.args[1]), [[0], [2]])
+        self.assertEqual([call.args[2][0][0]["id"] for call in calls if call.args[2]], [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+# test_rate_limit.py
+import asyncio
+import unittest
+from unittest import mock
+
+from fastapi import HTTPException
+
+from app import rate_limit
+from app.rate_limit import Limiter, MemoryBackend, Policy, RateLimiter, RedisBackend, parse_policy
+
+
+class FakeRedis:
+    """
+    Shared token buckets with the semantics of the Lua script, without a server.
+    """
+
+    def __init__(self):
+        self.levels = {}
+        self.calls = 0
+
+    def register_script(self, source):
+        def script(keys, args, client=None):
+            capacity, rate, cost, strict = args
+            tokens = self.levels.get(keys[0], capacity)
+            result = [0, str(tokens).encode()]
+            if not strict or tokens >= cost:
+                self.levels[keys[0]] = tokens - cost
+                result = [1, str(tokens - cost).encode()]
+            if client is not None:
+                client.results.append(result)
+            else:
+                self.calls += 1
+            return result
+        return script
+
+    def pipeline(self, transaction=True):
+        redis = self
+
+        class Pipeline:
+
+            def __init__(self):
+                self.results = []
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self):
+                redis.calls += 1
+                return self.results
+
+        return Pipeline()
+
+
+class TestPolicy(unittest.TestCase):
+
+    def test_parse_policy(self):
+        self.assertEqual(parse_policy("5/60"), Policy(5, 60))
+        self.assertEqual(parse_policy("5/60/strict"), Policy(5, 60, strict=True))
+        self.assertEqual(parse_policy({"times": 10, "seconds": 1, "strict": True}), Policy(10, 1, strict=True))
+        with self.assertRaises(ValueError):
+            parse_policy("5")
+        with self.assertRaises(ValueError):
+            parse_policy("0/60")
+
+
+class TestMemoryBackend(unittest.TestCase):
+
+    def test_allows_burst_then_refills(self):
+        backend = MemoryBackend()
+        policy = Policy(2, 10)
+        with mock.patch("app.rate_limit.time.monotonic", return_value=100.0):
+            self.assertEqual(backend.take("k", policy), 0)
+            self.assertEqual(backend.take("k", policy), 0)
+            self.assertAlmostEqual(backend.take("k", policy), 5.0)
+            self.assertEqual(backend.take("other", policy), 0)
+        with mock.patch("app.rate_limit.time.monotonic", return_value=105.0):
+            self.assertEqual(backend.take("k", policy), 0)
+
+    def test_prune_drops_full_buckets(self):
+        backend = MemoryBackend()
+        policy = Policy(2, 10)
+        with mock.patch("app.rate_limit.time.monotonic", return_value=100.0):
+            backend.take("k", policy)
+        backend.prune(104.0)
+        self.assertIn("k", backend._buckets)
+        backend.prune(105.0)
+        self.assertNotIn("k", backend._buckets)
+
+
+class TestLimiter(unittest.TestCase):
+
+    def test_overrides_and_rejection(self):
+        limiter = Limiter(policies={"create": "1/60"}, user_policies={"7": {"create": "3/60"}})
+        default = Policy(5, 60)
+        self.assertEqual(limiter.policy("create", 1, default), Policy(1, 60))
+        self.assertEqual(limiter.policy("create", 7, default), Policy(3, 60))
+        self.assertEqual(limiter.policy("bulk", 7, default), default)
+
+        async def scenario():
+            await limiter.check("create", 1, default)
+            await limiter.check("create", 1, default)
+
+        with self.assertRaises(HTTPException) as raised:
+            asyncio.run(scenario())
+        self.assertEqual(raised.exception.status_code, 429)
+        self.assertEqual(raised.exception.headers["Retry-After"], "60")
+
+    def test_charge_consumes_the_cost_given_by_the_handler(self):
+        bulk = RateLimiter("bulk", times=10, seconds=60)
+
+        async def scenario():
+            await bulk.charge(1, 6)
+            with self.assertRaises(HTTPException) as raised:
+                await bulk.charge(1, 6)
+            self.assertEqual(raised.exception.status_code, 429)
+            await bulk.charge(1, 4)
+
+        with mock.patch.object(rate_limit, "limiter", Limiter()), \
+                mock.patch.object(rate_limit, "RATE_LIMIT_ENABLED", True):
+            asyncio.run(scenario())
+
+
+class TestRedisBackend(unittest.TestCase):
+
+    def test_sync_pushes_consumption_and_adopts_shared_level(self):
+        redis = FakeRedis()
+        first, second = RedisBackend(redis), RedisBackend(redis)
+        policy = Policy(4, 60)
+
+        async def scenario():
+            for backend in (first, second):
+                self.assertEqual(await backend.hit("k", policy), 0)
+                self.assertEqual(await backend.hit("k", policy), 0)
+            self.assertEqual(redis.calls, 0)
+            await first.sync()
+            await second.sync()
+            await first.sync()
+            return await first.hit("k", policy)
+
+        retry_after = asyncio.run(scenario())
+        self.assertEqual(redis.levels["rate-limit:k"], 0)
+        self.assertGreater(retry_after, 0)
+
+    def test_strict_policy_consumes_shared_bucket(self):
+        redis = FakeRedis()
+        backend = RedisBackend(redis)
+        policy = Policy(1, 60, strict=True)
+
+        async def scenario():
+            return await backend.hit("k", policy), await backend.hit("k", policy)
+
+        allowed, rejected = asyncio.run(scenario())
+        self.assertEqual(allowed, 0)
+        self.assertGreater(rejected, 0)
+        self.assertEqual(redis.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
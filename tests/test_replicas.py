@@ -0,0 +1,111 @@
+# test_replicas.py
+import asyncio
+import contextlib
+import os
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from app import models, replicas
+
+
+def sqlite_engine(path):
+    return create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+
+async def open_read_session(db, user_id):
+    # Run the dependency the way FastAPI does, teardown included
+    async with contextlib.asynccontextmanager(replicas.get_read_session)(
+            db=db, current_user=SimpleNamespace(id=user_id)) as session:
+        return session
+
+
+class TestReplicaSet(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.replicas = [replicas.Replica(f"test-{index}", sqlite_engine(os.path.join(directory, f"{index}.db")))
+                         for index in range(2)]
+
+    def test_round_robin_skips_unhealthy_replicas(self):
+        replica_set = replicas.ReplicaSet(self.replicas)
+        self.assertEqual([replica_set.next().name for _ in range(4)], ["test-0", "test-1", "test-0", "test-1"])
+        replica_set.mark_down(self.replicas[0], "test")
+        self.assertEqual({replica_set.next().name for _ in range(3)}, {"test-1"})
+        replica_set.mark_down(self.replicas[1], "test")
+        self.assertIsNone(replica_set.next())
+
+    def test_check_marks_unreachable_replicas_down_and_back_up(self):
+        broken = replicas.Replica("test-broken", sqlite_engine("/nonexistent/directory/replica.db"))
+        replica_set = replicas.ReplicaSet([self.replicas[0], broken])
+        self.replicas[0].healthy = False
+        replica_set.check()
+        self.assertTrue(self.replicas[0].healthy)
+        self.assertFalse(broken.healthy)
+
+
+class TestRecentWrites(unittest.TestCase):
+
+    def test_window_expires(self):
+        recent_writes = replicas.RecentWrites(window=0.05, max_entries=10)
+        recent_writes.record(1)
+        self.assertTrue(recent_writes.recent(1))
+        self.assertFalse(recent_writes.recent(2))
+        time.sleep(0.1)
+        self.assertFalse(recent_writes.recent(1))
+
+
+class TestReadSession(unittest.TestCase):
+
+    def test_reads_go_to_the_replica_unless_the_user_wrote_recently(self):
+        # A second local database stands in for the replica
+        directory = tempfile.mkdtemp()
+        primary_engine = sqlite_engine(os.path.join(directory, "primary.db"))
+        replica = replicas.Replica("test-replica", sqlite_engine(os.path.join(directory, "replica.db")))
+        for engine in (primary_engine, replica.engine):
+            models.User.__table__.create(bind=engine)
+        with replica.engine.begin() as connection:
+            connection.execute(text("INSERT INTO users (id, email, hashed_password, is_verified, contacts_version) "
+                                    "VALUES (1, 'replica@example.com', 'x', 0, 0)"))
+
+        with patch.object(replicas, "replica_set", replicas.ReplicaSet([replica])), \
+                patch.object(replicas, "recent_writes", replicas.RecentWrites(window=60, max_entries=10)), \
+                Session(bind=primary_engine) as primary:
+            session = asyncio.run(open_read_session(primary, 1))
+            self.assertIsNot(session, primary)
+            self.assertEqual(session.get(models.User, 1).email, "replica@example.com")
+
+            asyncio.run(replicas.record_write(1))
+            self.assertIs(asyncio.run(open_read_session(primary, 1)), primary)
+            self.assertIsNot(asyncio.run(open_read_session(primary, 2)), primary)
+
+            replicas.replica_set.mark_down(replica, "test")
+            self.assertIs(asyncio.run(open_read_session(primary, 2)), primary)
+
+    def test_committing_write_session_starts_the_window(self):
+        engine = sqlite_engine(os.path.join(tempfile.mkdtemp(), "primary.db"))
+        replica = replicas.Replica("test-replica", engine)
+        user = SimpleNamespace(id=3)
+
+        async def write(db, commit):
+            async with contextlib.asynccontextmanager(replicas.get_write_session)(db=db, current_user=user) as session:
+                self.assertIs(session, db)
+                if commit:
+                    db.commit()
+
+        with patch.object(replicas, "replica_set", replicas.ReplicaSet([replica])), \
+                patch.object(replicas, "recent_writes", replicas.RecentWrites(window=60, max_entries=10)), \
+                Session(bind=engine) as db:
+            asyncio.run(write(db, commit=False))
+            self.assertFalse(replicas.recent_writes.recent(3))
+            asyncio.run(write(db, commit=True))
+            self.assertTrue(replicas.recent_writes.recent(3))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+# test_response_cache.py
+import asyncio
+import unittest
+
+from app.response_cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache(max_entries=10)
+        self.calls = 0
+
+    async def compute(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return f"[{self.calls}]", {}
+
+    def get(self, owner_id=1, params=None):
+        return self.cache.get_or_compute(owner_id, "contacts", params or {}, self.compute, ttl=60)
+
+    def test_hits_until_owner_is_bumped(self):
+        async def scenario():
+            first = await self.get()
+            second = await self.get()
+            other_owner = await self.get(owner_id=2)
+            self.cache.bump(1)
+            third = await self.get()
+            return first, second, other_owner, third
+
+        first, second, other_owner, third = asyncio.run(scenario())
+        self.assertEqual(first, ("[1]", {}))
+        self.assertEqual(second, first)
+        self.assertEqual(other_owner, ("[2]", {}))
+        self.assertEqual(third, ("[3]", {}))
+
+    def test_concurrent_misses_compute_once(self):
+        async def scenario():
+            return await asyncio.gather(*(self.get() for _ in range(5)))
+
+        results = asyncio.run(scenario())
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(all(result == ("[1]", {}) for result in results))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+# test_serialization.py
+import unittest
+from datetime import date, datetime
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from app import crud, serialization
+from app.routers.contacts import _render_contacts
+
+ROWS = [
+    {"first_name": "Zoë", "last_name": "Łukasiewicz", "email": "zoe@example.com", "phone": "+380 44 123 45 67",
+     "birthday": date(1990, 2, 28), "additional_info": None, "id": 1, "updated_at": None},
+    {"first_name": "Олена", "last_name": "O\"Brien \\ 😀", "email": "olena@example.com", "phone": "1234567890",
+     "birthday": date(2000, 1, 1), "additional_info": "Line one\nLine two", "id": 2,
+     "updated_at": datetime(2024, 5, 17, 9, 30, 0, 123456)},
+    {"first_name": "Al", "last_name": "Bo", "email": "al@example.com", "phone": "1", "birthday": date(1970, 12, 31),
+     "additional_info": "", "id": 3, "updated_at": datetime(2024, 5, 17, 9, 30)},
+]
+
+
+class TestFastJSON(unittest.TestCase):
+
+    def render(self, fast: bool):
+        contacts = ROWS if fast else [SimpleNamespace(**row) for row in ROWS]
+        with patch.object(serialization, "FAST_JSON", fast):
+            body, _ = _render_contacts(contacts)
+        return body.encode()
+
+    def test_rows_follow_the_schema_field_order(self):
+        self.assertEqual(tuple(crud.CONTACT_ROW_COLUMNS), tuple(ROWS[0]))
+
+    def test_fast_path_renders_the_same_bytes(self):
+        expected = self.render(fast=False)
+        self.assertEqual(self.render(fast=True), expected)
+        # Without orjson, through the json module
+        with patch.object(serialization, "orjson", None):
+            self.assertEqual(self.render(fast=True), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
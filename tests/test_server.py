@@ -0,0 +1,31 @@
+# test_server.py
+import unittest
+
+from app.server import available_cpus, worker_settings
+
+
+class TestServer(unittest.TestCase):
+
+    def test_worker_settings_split_the_connection_budgets(self):
+        self.assertEqual(worker_settings(4, db_connections=80, redis_connections=50, db_engines=1),
+                         {"DB_POOL_SIZE": "20", "DB_MAX_OVERFLOW": "0", "REDIS_MAX_CONNECTIONS": "12"})
+        self.assertEqual(worker_settings(4, db_connections=0, redis_connections=0), {})
+
+    def test_worker_settings_split_the_database_budget_between_engines(self):
+        settings = worker_settings(4, db_connections=80, redis_connections=0, db_engines=2)
+        self.assertEqual(settings["DB_POOL_SIZE"], "10")
+        with self.assertRaises(ValueError):
+            worker_settings(4, db_connections=6, redis_connections=0, db_engines=2)
+
+    def test_worker_settings_reject_budgets_below_one_connection_per_worker(self):
+        with self.assertRaises(ValueError):
+            worker_settings(8, db_connections=4, redis_connections=0)
+        with self.assertRaises(ValueError):
+            worker_settings(8, db_connections=0, redis_connections=4)
+
+    def test_available_cpus(self):
+        self.assertGreaterEqual(available_cpus(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
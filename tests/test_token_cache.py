@@ -0,0 +1,80 @@
+# test_token_cache.py
+import asyncio
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+from app.token_cache import ExpiringLRU, TokenCache
+
+
+class TestExpiringLRU(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        lru = ExpiringLRU(max_entries=2)
+        expires_at = time.time() + 60
+        lru.set("a", 1, expires_at)
+        lru.set("b", 2, expires_at)
+        lru.get("a")
+        lru.set("c", 3, expires_at)
+        self.assertEqual(lru.get("a"), 1)
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.get("c"), 3)
+
+    def test_expired_entries_are_dropped(self):
+        lru = ExpiringLRU(max_entries=2)
+        lru.set("a", 1, time.time() - 1)
+        self.assertIsNone(lru.get("a"))
+        self.assertEqual(len(lru), 0)
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = TokenCache(max_entries=10, user_ttl=60)
+        self.user = SimpleNamespace(id=1, email="test@example.com", is_verified=True, avatar_url=None)
+        self.exp = int(time.time()) + 600
+
+    def test_miss_then_hit(self):
+        self.assertEqual(self.cache.get_local("token"), (None, None))
+        self.cache.store_claims("token", self.user.email, self.exp)
+        snapshot = self.cache.store_user(self.user, self.exp)
+        claims, cached_user = self.cache.get_local("token")
+        self.assertEqual(claims, (self.user.email, self.exp))
+        self.assertEqual(cached_user, snapshot)
+        self.assertEqual(cached_user.id, self.user.id)
+
+    def test_invalidate_user_keeps_claims(self):
+        self.cache.store_claims("token", self.user.email, self.exp)
+        self.cache.store_user(self.user, self.exp)
+        self.cache.invalidate_user(self.user.email)
+        claims, cached_user = self.cache.get_local("token")
+        self.assertEqual(claims, (self.user.email, self.exp))
+        self.assertIsNone(cached_user)
+
+    def test_expired_token_is_not_served(self):
+        self.cache.store_claims("token", self.user.email, int(time.time()) - 1)
+        self.assertEqual(self.cache.get_local("token"), (None, None))
+
+    def test_async_stores_write_the_shared_tier_off_the_event_loop(self):
+        writes = []
+
+        class SharedTier:
+            def set(self, key, value, ex):
+                writes.append((key, threading.current_thread()))
+
+        cache = TokenCache(max_entries=10, user_ttl=60, redis_url="redis://shared")
+        cache._redis = SharedTier()
+
+        async def store():
+            await cache.astore_claims("token", self.user.email, self.exp)
+            return await cache.astore_user(self.user, self.exp), threading.current_thread()
+
+        snapshot, loop_thread = asyncio.run(store())
+        self.assertEqual(cache.get_local("token"), ((self.user.email, self.exp), snapshot))
+        self.assertEqual(len(writes), 2)
+        self.assertTrue(all(thread is not loop_thread for _, thread in writes))
+
+
+if __name__ == "__main__":
+    unittest.main()